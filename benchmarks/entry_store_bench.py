@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Memory benchmark of EntryStore against a dict of TimeEntry namedtuples.
+
+Run from the project root directory:
+  python3 -m benchmarks.entry_store_bench [--sizes 10000 100000 1000000]
+"""
+
+import argparse
+import gc
+import time
+import tracemalloc
+
+from truthsaver import entry_store
+from truthsaver import truthsaver
+
+
+def synthetic_rows(n):
+  """Yields n record rows spread over 2000 players and every stage/mode."""
+  stages = [stage[1] for game in truthsaver.GAMES
+            for stage in truthsaver.STAGES[game]]
+  modes = truthsaver.MODES['goldeneye']
+  for i in range(n):
+    player = 'Player Number %d' % (i % 2000)
+    yield ['https://rankings.the-elite.net/~Player+Number+%d/time/%d'
+           % (i % 2000, i), i, player, modes[i % len(modes)],
+           stages[i % len(stages)], 60 + i % 3000, 1 if i % 50 else 0]
+
+
+def build_dict(n):
+  return {row[0]: truthsaver.TimeEntry(*row) for row in synthetic_rows(n)}
+
+
+def build_store(n):
+  return entry_store.EntryStore.from_rows(truthsaver.TimeEntry,
+                                          synthetic_rows(n))
+
+
+def measure(builder, n):
+  """Returns (MiB held, seconds to build, seconds to find pending)."""
+  gc.collect()
+  tracemalloc.start()
+  start = time.perf_counter()
+  entries = builder(n)
+  build_time = time.perf_counter() - start
+  held, _ = tracemalloc.get_traced_memory()
+  tracemalloc.stop()
+
+  start = time.perf_counter()
+  if isinstance(entries, dict):
+    pending = [e for e in entries.values()
+               if e.status == truthsaver.TruthSaver.NEW_URL]
+  else:
+    pending = list(entries.with_status(truthsaver.TruthSaver.NEW_URL))
+  pending_time = time.perf_counter() - start
+  assert len(pending) == n // 50 + (n % 50 > 0)
+  return held / 2**20, build_time, pending_time
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--sizes', type=int, nargs='+',
+                      default=[10000, 100000, 1000000])
+  args = parser.parse_args()
+
+  print('%-10s %-12s %10s %10s %12s' % (
+      'entries', 'container', 'MiB', 'build s', 'pending ms'))
+  for n in args.sizes:
+    for name, builder in (('dict', build_dict), ('EntryStore', build_store)):
+      mib, build_time, pending_time = measure(builder, n)
+      print('%-10d %-12s %10.1f %10.2f %12.2f' % (
+          n, name, mib, build_time, 1000 * pending_time))
+
+
+if __name__ == '__main__':
+  main()
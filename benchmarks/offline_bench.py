@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""End to end benchmark of TruthSaver against a local replay server.
+
+Crawls every stage from a benchmarks.replay_server holding synthetic times,
+resolves a sample of their links, then saves and loads the resulting record
+in every format. Results are printed and written to a JSON file, which can
+be compared against the results of an earlier run. Run from the project
+root directory:
+  python3 -m benchmarks.offline_bench [--times 100000] [--output out.json]
+      [--baseline old.json]
+"""
+
+import argparse
+import concurrent.futures
+import datetime
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from truthsaver import parsers
+from truthsaver import truthsaver
+
+from benchmarks.record_bench import FORMATS
+from benchmarks.replay_server import ReplayServer
+
+
+def bench_crawl(truth):
+  """Crawls every stage, returns (results, entries found)."""
+
+  start = time.perf_counter()
+  entries = truth.get_all_time_entries()
+  elapsed = time.perf_counter() - start
+  n_stages = sum(len(truthsaver.STAGES[game]) for game in truthsaver.GAMES)
+  results = {
+      'seconds': elapsed,
+      'times': len(entries),
+      'times_per_s': len(entries) / elapsed,
+      # Each stage has a regular and an LTK page.
+      'pages_per_s': 2 * n_stages / elapsed,
+  }
+  for page in ('regular', 'ltk'):
+    n_pages = truth.metrics.histogram_count('parse_seconds', page=page)
+    seconds = sum(histogram['sum'] for histogram
+                  in truth.metrics.report()['histograms']
+                  if histogram['name'] == 'parse_seconds'
+                  and histogram['labels']['page'] == page)
+    results['parse_ms_per_%s_page' % page] = 1000 * seconds / max(1, n_pages)
+  return results, entries
+
+
+def bench_resolve(truth, entries, sample):
+  """Resolves the links of sample entries on truth.resolve_workers threads."""
+
+  entries = list(entries)[:sample]
+  start = time.perf_counter()
+  with concurrent.futures.ThreadPoolExecutor(
+      max_workers=truth.resolve_workers) as pool:
+    links = list(pool.map(truth.resolve_entry, entries))
+  elapsed = time.perf_counter() - start
+  return {
+      'seconds': elapsed,
+      'links': sum(link is not None for link in links),
+      'links_per_s': len(entries) / elapsed,
+  }
+
+
+def bench_records(entries, temp_dir):
+  """Saves and loads entries in every record format."""
+
+  results = {}
+  for ext in FORMATS:
+    record_path = os.path.join(temp_dir, 'bench' + ext)
+    start = time.perf_counter()
+    truthsaver.TruthSaver.save_entries(record_path, entries)
+    save_time = time.perf_counter() - start
+    loaded = json.loads(subprocess.check_output(
+        [sys.executable, '-m', 'benchmarks.record_bench',
+         '--child', record_path]).decode('utf-8'))
+    results[ext.lstrip('.')] = {
+        'save_s': save_time,
+        'load_s': loaded['load_s'],
+        'pending_s': loaded['pending_s'],
+        'peak_rss_mib': loaded['peak_rss_mib'],
+        'size_mib': os.path.getsize(record_path) / 2**20,
+    }
+  return results
+
+
+def flatten(results, prefix=''):
+  """Returns {'a.b': number} for every number nested in results."""
+
+  flat = {}
+  for key, value in results.items():
+    if isinstance(value, dict):
+      flat.update(flatten(value, prefix + key + '.'))
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+      flat[prefix + key] = value
+  return flat
+
+
+def compare(baseline, results):
+  """Prints every shared number of two results with its relative change."""
+
+  old = flatten(baseline)
+  new = flatten(results)
+  print('%-36s %14s %14s %9s' % ('metric', 'baseline', 'current', 'change'))
+  for key in sorted(set(old) & set(new)):
+    change = ''
+    if old[key]:
+      change = '%+8.1f%%' % (100.0 * (new[key] - old[key]) / old[key])
+    print('%-36s %14.4f %14.4f %9s' % (key, old[key], new[key], change))
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--times', type=int, default=100000)
+  parser.add_argument('--crawl_workers', type=int, default=4)
+  parser.add_argument('--resolve_workers', type=int, default=4)
+  parser.add_argument('--resolve_sample', type=int, default=500,
+                      help='Number of links to resolve.')
+  parser.add_argument('--parser', type=str,
+                      choices=parsers.available_backends())
+  parser.add_argument('--output', type=str, default='offline_bench.json')
+  parser.add_argument('--baseline', type=str,
+                      help='Results of an earlier run to compare against.')
+  args = parser.parse_args()
+
+  if args.parser:
+    parsers.set_default_backend(args.parser)
+
+  temp_dir = tempfile.mkdtemp()
+  try:
+    with ReplayServer(args.times) as server:
+      truthsaver.BASE_URL = server.base_url
+      record_path = os.path.join(temp_dir, 'record.json')
+      truthsaver.TruthSaver.save_entries(record_path, {})
+      truth = truthsaver.TruthSaver(
+          record_path=record_path,
+          video_root=temp_dir, crawl_workers=args.crawl_workers,
+          resolve_workers=args.resolve_workers)
+      crawl, entries = bench_crawl(truth)
+      for url, entry in entries.items():
+        truth.saved_entries[url] = entry
+      resolve = bench_resolve(
+          truth, truth.saved_entries.with_status(truth.NEW_URL),
+          args.resolve_sample)
+      n_requests = server.n_requests
+    records = bench_records(truth.saved_entries, temp_dir)
+  finally:
+    shutil.rmtree(temp_dir)
+
+  results = {
+      'meta': {
+          'date': datetime.datetime.now().isoformat(),
+          'python': platform.python_version(),
+          'platform': platform.platform(),
+          'parser': parsers.get_backend().name,
+          'times': args.times,
+          'crawl_workers': args.crawl_workers,
+          'resolve_workers': args.resolve_workers,
+          'requests': n_requests,
+      },
+      'crawl': crawl,
+      'resolve': resolve,
+      'records': records,
+  }
+  with open(args.output, 'w') as fh:
+    json.dump(results, fh, indent=2, sort_keys=True)
+  print(json.dumps({k: v for k, v in results.items() if k != 'meta'},
+                   indent=2, sort_keys=True))
+  print('Wrote %s' % args.output)
+
+  if args.baseline:
+    with open(args.baseline) as fh:
+      compare(json.load(fh), results)
+
+
+if __name__ == '__main__':
+  main()
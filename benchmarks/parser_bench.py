@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Micro-benchmark of the HTML parser backends on the test fixtures.
+
+Run from the project root directory:
+  python3 -m benchmarks.parser_bench [--repeat N]
+"""
+
+import argparse
+import os
+import timeit
+
+from bs4 import BeautifulSoup
+
+from truthsaver import parsers
+
+TEST_DIR = './tests/testdata/'
+LTK_PAGES = ['attack_ship_ltk.html', 'silo_ltk.html']
+TIME_PAGES = ['bb_dam.html', 'old_aztec.html', 'swompz_arch.html',
+              'tara_dam.html']
+
+
+def full_tree_ltk(html):
+  """The full BeautifulSoup tree walk parsers replaced, as a baseline."""
+  soup = BeautifulSoup(html, 'html.parser')
+  return [[tr.find(class_='user').text for tr in table.find_all('tr')
+           if tr.find(class_='video-link')]
+          for table in soup.find_all('table')]
+
+
+def full_tree_links(html):
+  soup = BeautifulSoup(html, 'html.parser')
+  return [(link.text, link['href']) for tag in soup.find_all('p')
+          for link in tag.find_all('a', href=True)]
+
+
+def read_pages(names, mode):
+  pages = []
+  for name in names:
+    with open(os.path.join(TEST_DIR, name), mode) as fh:
+      pages.append(fh.read())
+  return pages
+
+
+def bench(func, pages, repeat):
+  """Returns the best mean milliseconds per page over repeat runs."""
+  runs = timeit.repeat(lambda: [func(page) for page in pages],
+                       number=10, repeat=repeat)
+  return 1000 * min(runs) / (10 * len(pages))
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--repeat', type=int, default=5)
+  args = parser.parse_args()
+
+  ltk_pages = read_pages(LTK_PAGES, 'r')
+  time_pages = read_pages(TIME_PAGES, 'rb')
+
+  print('%-16s %14s %14s' % ('backend', 'ltk ms/page', 'time ms/page'))
+  print('%-16s %14.3f %14.3f' % (
+      'full tree', bench(full_tree_ltk, ltk_pages, args.repeat),
+      bench(full_tree_links, time_pages, args.repeat)))
+  for name in parsers.available_backends():
+    backend = parsers.get_backend(name)
+    print('%-16s %14.3f %14.3f' % (
+        name, bench(backend.ltk_tables, ltk_pages, args.repeat),
+        bench(backend.paragraph_links, time_pages, args.repeat)))
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Benchmark of record load time and peak RSS for each record format.
+
+Each format is loaded in a fresh child process which then walks the pending
+entries, as download_videos does. Run from the project root directory:
+  python3 -m benchmarks.record_bench [--entries 100000]
+"""
+
+import argparse
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from truthsaver import entry_store
+from truthsaver import truthsaver
+
+from benchmarks.entry_store_bench import synthetic_rows
+
+FORMATS = ['.json', '.pkl', '.sqlite', '.snap']
+
+
+def peak_rss_mib():
+  """Returns the peak RSS of this process in MiB.
+
+  VmHWM is preferred on Linux, ru_maxrss can carry over the parent's peak
+  across fork and exec.
+  """
+  try:
+    with open('/proc/self/status') as fh:
+      for line in fh:
+        if line.startswith('VmHWM:'):
+          return int(line.split()[1]) / 1024.0
+  except IOError:
+    pass
+  return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def child(record_path):
+  """Loads record_path and prints its timings and peak RSS as JSON."""
+  start = time.perf_counter()
+  entries = truthsaver.TruthSaver.get_saved_list(record_path)
+  load_time = time.perf_counter() - start
+  start = time.perf_counter()
+  n_pending = sum(
+      1 for _ in entries.with_status(truthsaver.TruthSaver.NEW_URL))
+  pending_time = time.perf_counter() - start
+  print(json.dumps({
+      'load_s': load_time,
+      'pending_s': pending_time,
+      'pending': n_pending,
+      'peak_rss_mib': peak_rss_mib(),
+  }))
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--entries', type=int, default=100000)
+  parser.add_argument('--child', type=str, help=argparse.SUPPRESS)
+  args = parser.parse_args()
+
+  if args.child:
+    child(args.child)
+    return
+
+  temp_dir = tempfile.mkdtemp()
+  try:
+    entries = entry_store.EntryStore.from_rows(
+        truthsaver.TimeEntry, synthetic_rows(args.entries))
+    print('%-8s %10s %12s %14s %10s' % (
+        'format', 'load s', 'pending s', 'peak RSS MiB', 'size MiB'))
+    for ext in FORMATS:
+      record_path = os.path.join(temp_dir, 'record' + ext)
+      truthsaver.TruthSaver.save_entries(record_path, entries)
+      result = json.loads(subprocess.check_output(
+          [sys.executable, '-m', 'benchmarks.record_bench',
+           '--child', record_path]).decode('utf-8'))
+      print('%-8s %10.2f %12.2f %14.1f %10.1f' % (
+          ext, result['load_s'], result['pending_s'],
+          result['peak_rss_mib'], os.path.getsize(record_path) / 2**20))
+  finally:
+    shutil.rmtree(temp_dir)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Local HTTP server replaying rankings pages for offline benchmarks.
+
+The tests/testdata fixtures are served at the paths they were saved from.
+Given a number of times, every stage instead gets synthetic AJAX JSON and
+LTK pages holding its share of that many times, and every time page is
+answered with a copy of a fixture time page. Run from the project root
+directory to serve it by hand:
+  python3 -m benchmarks.replay_server [--times 100000] [--port 8000]
+"""
+
+import argparse
+import http.server
+import json
+import os
+import re
+import socketserver
+import threading
+
+from truthsaver import truthsaver
+
+TEST_DIR = './tests/testdata/'
+
+# Fixture files by the path they were saved from
+FIXTURES = {
+    '/ajax/stage/19': 'test_data.json',
+    '/ajax/stage/21': 'test_pd.json',
+    '/goldeneye/ltk/stage/silo': 'silo_ltk.html',
+    '/perfect-dark/ltk/stage/attack-ship': 'attack_ship_ltk.html',
+    '/~Big+Bossman/time/10': 'bb_dam.html',
+    '/~Tara/time/113844': 'tara_dam.html',
+    '/~Swompz/time/78905': 'swompz_arch.html',
+    '/~Wouter+Jansen/time/54778': 'old_aztec.html',
+}
+
+# Fixture served for every time page which is not a fixture itself
+TIME_PAGE = 'bb_dam.html'
+
+# Every time in one in this many has no video
+NO_VIDEO_EVERY = 10
+
+_TIME_PATH = re.compile(r'^/(~[^/]+/time|goldeneye/ltk|perfect-dark/ltk)/\d+$')
+
+_LTK_PAGE = '<html><body>\n%s\n</body></html>'
+_LTK_TABLE = ('<table class="stage-table">\n<tr><th>Rank</th><th>Player</th>'
+              '<th>Time/Points</th></tr>\n%s</table>')
+_LTK_ROW = ('<tr><td class="rank">%d</td><td><a href="/~%s/%s/ltk" '
+            'class="user">%s</a></td><td><a href="/%s/ltk/%d" class="time">'
+            '%s</a>/<span class="points">%d</span>%s</td></tr>\n')
+_VIDEO_LINK = (' <a href="/%s/ltk/%d" class="video-link" '
+               'title="Watch the video">Video</a>')
+
+
+def _stages():
+  return [(game, stage) for game in truthsaver.GAMES
+          for stage in truthsaver.STAGES[game]]
+
+
+def synthetic_pages(n_times):
+  """Returns path -> body of the stage pages holding n_times times.
+
+  Time i goes to stage i % 40 and the mode (i // 40) % 5 of its game.
+  """
+
+  stages = _stages()
+  regular = {stage: [[], [], []] for _, stage in stages}
+  ltk = {stage: [[], []] for _, stage in stages}
+  for i in range(n_times):
+    game, stage = stages[i % len(stages)]
+    mode_idx = (i // len(stages)) % 5
+    player_id = i % 2000
+    player = 'Player Number %d' % player_id
+    alias = 'Player+Number+%d' % player_id
+    time_id = i + 1
+    time_sec = 60 + i % 3000
+    has_video = i % NO_VIDEO_EVERY != 0
+    if mode_idx < 3:
+      regular[stage][mode_idx].extend(
+          [player, alias, player_id, time_id, time_sec, 2 if has_video else 0])
+    else:
+      ltk[stage][mode_idx - 3].append(
+          (game, alias, player, time_id, time_sec, has_video))
+
+  pages = {}
+  for game, stage in stages:
+    pages['/ajax/stage/%d' % stage[0]] = json.dumps(regular[stage])
+    tables = []
+    for rows in ltk[stage]:
+      rows.sort(key=lambda row: row[4])
+      tables.append(_LTK_TABLE % ''.join(
+          _LTK_ROW % (rank, alias, game, player, game, time_id,
+                      truthsaver.sec_to_ge_time(time_sec), 100 - rank % 100,
+                      _VIDEO_LINK % (game, time_id) if has_video else '')
+          for rank, (game, alias, player, time_id, time_sec, has_video)
+          in enumerate(rows, 1)))
+    pages['/%s/ltk/stage/%s' % (game, stage[1])] = (
+        _LTK_PAGE % '\n'.join(tables))
+  return {path: body.encode('utf-8') for path, body in pages.items()}
+
+
+def fixture_pages():
+  """Returns path -> body of every fixture."""
+
+  pages = {}
+  for path, name in FIXTURES.items():
+    with open(os.path.join(TEST_DIR, name), 'rb') as fh:
+      pages[path] = fh.read()
+  return pages
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+
+  protocol_version = 'HTTP/1.1'
+
+  def do_GET(self):
+    server = self.server
+    path = self.path.split('?')[0]
+    body = server.pages.get(path)
+    if body is None and _TIME_PATH.match(path):
+      body = server.time_page
+    with server.lock:
+      server.n_requests += 1
+    if body is None:
+      self.send_response(404)
+      self.send_header('Content-Length', '0')
+      self.end_headers()
+      return
+    self.send_response(200)
+    if path.startswith('/ajax/'):
+      self.send_header('Content-Type', 'application/json')
+    else:
+      self.send_header('Content-Type', 'text/html; charset=utf-8')
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, *args):
+    pass
+
+
+class _ThreadingServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+  daemon_threads = True
+
+
+class ReplayServer(object):
+  """Serves the fixtures, and n_times synthetic times if given, locally.
+
+  Binds to a free port on localhost, base_url is the URL to use as
+  truthsaver.BASE_URL. Use as a context manager or call start() / stop().
+  """
+
+  def __init__(self, n_times=0, port=0):
+    self._server = _ThreadingServer(('127.0.0.1', port), _Handler)
+    self._server.pages = fixture_pages()
+    if n_times:
+      self._server.pages.update(synthetic_pages(n_times))
+    self._server.time_page = self._server.pages[
+        next(path for path, name in FIXTURES.items() if name == TIME_PAGE)]
+    self._server.lock = threading.Lock()
+    self._server.n_requests = 0
+    self._thread = None
+    self.base_url = 'http://127.0.0.1:%d' % self._server.server_address[1]
+
+  @property
+  def n_requests(self):
+    return self._server.n_requests
+
+  def start(self):
+    self._thread = threading.Thread(target=self._server.serve_forever)
+    self._thread.daemon = True
+    self._thread.start()
+    return self
+
+  def stop(self):
+    self._server.shutdown()
+    self._server.server_close()
+    self._thread.join()
+
+  def __enter__(self):
+    return self.start()
+
+  def __exit__(self, *exc_info):
+    self.stop()
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--times', type=int, default=0)
+  parser.add_argument('--port', type=int, default=8000)
+  args = parser.parse_args()
+
+  server = ReplayServer(args.times, port=args.port)
+  print('Serving %d synthetic times at %s' % (args.times, server.base_url))
+  server.start()
+  try:
+    server._thread.join()
+  except KeyboardInterrupt:
+    server.stop()
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Benchmark of the time to import truthsaver and start the CLI.
+
+Every case runs in a fresh interpreter. The eager_deps case also imports
+the dependencies truthsaver loads lazily, which is what importing it cost
+before they were made lazy. Run from the project root directory:
+  python3 -m benchmarks.startup_bench [--runs 20]
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+
+# Dependencies only imported once a code path needing them runs
+HEAVY_MODULES = ('requests', 'bs4', 'pytube', 'lxml')
+
+_REPORT_MODULES = (
+    'import sys, json; print(json.dumps([m for m in %r if m in sys.modules]))'
+    % (HEAVY_MODULES,))
+
+# name -> python arguments
+CASES = {
+    'import': ['-c', 'import truthsaver.truthsaver; ' + _REPORT_MODULES],
+    'eager_deps': ['-c', 'import truthsaver.truthsaver, requests, bs4, '
+                   'pytube; ' + _REPORT_MODULES],
+    'cli_help': ['-m', 'truthsaver', '--help'],
+}
+
+
+def bench_case(args, runs):
+  """Returns (median seconds, min seconds, stdout of the last run)."""
+
+  times = []
+  out = b''
+  for _ in range(runs):
+    start = time.perf_counter()
+    out = subprocess.check_output([sys.executable] + args)
+    times.append(time.perf_counter() - start)
+  return statistics.median(times), min(times), out.decode('utf-8')
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--runs', type=int, default=20)
+  parser.add_argument('--output', type=str,
+                      help='Path to write the results to as JSON.')
+  args = parser.parse_args()
+
+  # Python's own startup, subtracted from every case.
+  base, _, _ = bench_case(['-c', 'pass'], args.runs)
+  results = {'python_ms': 1000 * base}
+  print('%-12s %10s %10s  %s' % ('case', 'median ms', 'min ms',
+                                 'heavy modules imported'))
+  for name in sorted(CASES):
+    median, fastest, out = bench_case(CASES[name], args.runs)
+    modules = json.loads(out) if not name.startswith('cli') else None
+    results[name] = {'median_ms': 1000 * (median - base),
+                     'min_ms': 1000 * (fastest - base),
+                     'modules': modules}
+    print('%-12s %10.1f %10.1f  %s' % (
+        name, 1000 * (median - base), 1000 * (fastest - base),
+        ', '.join(modules) if modules else '-'))
+  if args.output:
+    with open(args.output, 'w') as fh:
+      json.dump(results, fh, indent=2, sort_keys=True)
+    print('Wrote %s' % args.output)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Tests for the watch daemon."""
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from mock import patch
+
+from truthsaver import daemon
+from truthsaver import truthsaver
+
+from tests.helpers import make_entries
+
+
+class TestWatchDaemon(unittest.TestCase):
+
+  def setUp(self):
+    self.temp_dir = tempfile.mkdtemp()
+    self.record_path = os.path.join(self.temp_dir, 'record.json')
+    truthsaver.TruthSaver.save_entries(self.record_path, {})
+    self.truth = truthsaver.TruthSaver(self.record_path,
+                                       video_root=self.temp_dir,
+                                       crawl_workers=4)
+    self.new_times = {}
+
+  def tearDown(self):
+    shutil.rmtree(self.temp_dir)
+
+  def stage_entries(self, stage):
+    times = self.new_times.pop(stage[1], {})
+    return {e.url: e for e in times}
+
+  @patch('random.uniform', return_value=0)
+  def testAdaptiveIntervals(self, _):
+    watch = daemon.WatchDaemon(self.truth, min_interval=60, max_interval=600,
+                               download=False)
+    entries = make_entries(4)
+    now = time.time()
+    with patch.object(self.truth, 'get_stage_entries',
+                      side_effect=self.stage_entries) as mock_get:
+      self.new_times['dam'] = entries[:2]
+      self.assertEqual(watch.poll_due(now), 2)
+      self.assertEqual(mock_get.call_count, len(watch.schedules))
+      self.assertEqual(watch.schedules['dam'].interval, 60)
+      self.assertEqual(watch.schedules['silo'].interval, 90)
+      self.assertEqual(watch.seconds_to_next_poll(now), 60)
+
+      # Only dam is due, it finds nothing and starts backing off.
+      self.assertEqual(watch.poll_due(now + 60), 0)
+      self.assertEqual(mock_get.call_count, len(watch.schedules) + 1)
+      self.assertEqual(watch.schedules['dam'].interval, 90)
+
+      self.new_times['silo'] = entries[2:]
+      self.assertEqual(watch.poll_due(now + 90), 2)
+      self.assertEqual(watch.schedules['silo'].interval, 60)
+      self.assertEqual(watch.schedules['dam'].interval, 90)
+      self.assertEqual(watch.schedules['facility'].interval, 135)
+
+      for n in range(10):
+        watch.poll_due(now + 1000 * (n + 1))
+      self.assertEqual(watch.schedules['dam'].interval, 600)
+
+    # New entries were journaled, a fresh load of the record has them.
+    loaded = truthsaver.TruthSaver.get_saved_list(self.record_path)
+    self.assertEqual(sorted(loaded), sorted(e.url for e in entries))
+    self.assertEqual(self.truth.watermarks['silo']['Agent'], 3)
+
+  def testDownloadsNewEntries(self):
+    entries = make_entries(3)
+    old_entry = entries.pop()
+    self.truth.saved_entries[old_entry.url] = old_entry
+    self.new_times['dam'] = entries
+    watch = daemon.WatchDaemon(self.truth, min_interval=3600)
+    downloaded = []
+
+    def fake_download(link, entry):
+      downloaded.append(entry.url)
+      return 10
+
+    with patch.object(self.truth, 'get_stage_entries',
+                      side_effect=self.stage_entries), \
+        patch.object(self.truth, 'get_yt_link',
+                     return_value='https://youtu.be/'), \
+        patch.object(self.truth, 'download_yt_video',
+                     side_effect=fake_download):
+      thread = threading.Thread(target=watch.run)
+      thread.start()
+      for _ in range(500):
+        if len(downloaded) == 3:
+          break
+        time.sleep(0.01)
+      watch.stop()
+      thread.join()
+
+    self.assertEqual(sorted(downloaded),
+                     sorted([old_entry.url] + [e.url for e in entries]))
+    loaded = truthsaver.TruthSaver.get_saved_list(self.record_path)
+    self.assertEqual(set(e.status for e in loaded.values()),
+                     {truthsaver.TruthSaver.DOWNLOADED})
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Tests for the index of downloaded videos."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from mock import patch
+
+from truthsaver import dedup
+from truthsaver import truthsaver
+
+from tests.helpers import make_entries
+
+
+class TestDedup(unittest.TestCase):
+
+  def setUp(self):
+    self.temp_dir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.temp_dir)
+
+  def testVideoId(self):
+    for link in ('https://youtu.be/QtvECUNjszU',
+                 'https://www.youtube.com/watch?v=QtvECUNjszU&t=10',
+                 'http://m.youtube.com/watch?feature=share&v=QtvECUNjszU',
+                 'https://www.youtube.com/embed/QtvECUNjszU',
+                 'https://youtube.com/shorts/QtvECUNjszU?si=x'):
+      self.assertEqual(dedup.video_id(link), 'QtvECUNjszU', link)
+    for link in (None, '', 'https://youtu.be/', 'https://twitch.tv/v/1',
+                 'https://www.youtube.com/watch?v=short',
+                 'https://www.youtube.com/channel/UCQtvECUNjszU'):
+      self.assertIsNone(dedup.video_id(link), link)
+
+  def testIndex(self):
+    path = os.path.join(self.temp_dir, 'a', 'video.mp4')
+    os.makedirs(os.path.dirname(path))
+    with open(path, 'wb') as fh:
+      fh.write(b'video')
+    index = dedup.VideoIndex(self.temp_dir)
+    self.assertIsNone(index.lookup('QtvECUNjszU'))
+    index.add('QtvECUNjszU', path)
+
+    reloaded = dedup.VideoIndex(self.temp_dir)
+    self.assertEqual(reloaded.lookup('QtvECUNjszU'), path)
+    copy_path = os.path.join(self.temp_dir, 'copy.mp4')
+    with patch('os.link', side_effect=OSError('cross-device link')):
+      self.assertFalse(dedup.link_file(path, copy_path))
+    with open(copy_path, 'rb') as fh:
+      self.assertEqual(fh.read(), b'video')
+
+    os.remove(path)
+    self.assertIsNone(reloaded.lookup('QtvECUNjszU'))
+    self.assertEqual(len(dedup.VideoIndex(self.temp_dir)), 0)
+
+  def testSharedVideoDownloadedOnce(self):
+    record_path = os.path.join(self.temp_dir, 'record.json')
+    truthsaver.TruthSaver.save_entries(record_path, {})
+    truth = truthsaver.TruthSaver(record_path, video_root=self.temp_dir)
+    entries = make_entries(3)
+
+    def fake_fetch(link, entry):
+      vid_file = os.path.join(self.temp_dir, entry.vid_path() + '.mp4')
+      os.makedirs(os.path.dirname(vid_file), exist_ok=True)
+      with open(vid_file, 'wb') as fh:
+        fh.write(b'x' * 100)
+      return vid_file, 100
+
+    with patch.object(truth, 'fetch_yt_video',
+                      side_effect=fake_fetch) as mock_fetch:
+      self.assertEqual(truth.download_yt_video(
+          'https://youtu.be/QtvECUNjszU', entries[0]), 100)
+      self.assertEqual(truth.download_yt_video(
+          'https://www.youtube.com/watch?v=QtvECUNjszU', entries[1]), 0)
+      self.assertEqual(truth.download_yt_video(
+          'https://youtu.be/', entries[2]), 100)
+    self.assertEqual(mock_fetch.call_count, 2)
+    first, second = [os.path.join(self.temp_dir, e.vid_path() + '.mp4')
+                     for e in entries[:2]]
+    self.assertTrue(os.path.samefile(first, second))
+    self.assertEqual(truth.metrics.counter_value('dedup_bytes'), 100)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Tests for the compact TimeEntry store."""
+
+import unittest
+
+from truthsaver import entry_store
+from truthsaver import truthsaver
+
+from tests.helpers import make_entries
+
+TimeEntry = truthsaver.TimeEntry
+
+
+class TestEntryStore(unittest.TestCase):
+
+  def testMapping(self):
+    entries = make_entries(50)
+    store = entry_store.EntryStore(TimeEntry, {e.url: e for e in entries})
+    self.assertEqual(len(store), 50)
+    self.assertEqual(store, {e.url: e for e in entries})
+    self.assertEqual(list(store.values()), entries)
+    self.assertIs(store[entries[3].url].player, store[entries[10].url].player)
+
+    changed = entries[4]._replace(player='Someone Else', time=1)
+    store[changed.url] = changed
+    self.assertEqual(store[changed.url], changed)
+    del store[entries[0].url]
+    self.assertNotIn(entries[0].url, store)
+    self.assertEqual(len(store), 49)
+    self.assertEqual(len(store.for_player('Someone Else')), 1)
+    self.assertEqual(
+        sum(len(store.for_player('Player %d' % i)) for i in range(7)), 48)
+    self.assertEqual(len(store.for_stage('dam')), 24)
+    self.assertEqual(
+        dict(store.items()),
+        {e.url: e for e in [changed] + entries[1:4] + entries[5:]})
+
+  def testInsertionOrder(self):
+    entries = make_entries(10)
+    store = entry_store.EntryStore.from_rows(TimeEntry, entries)
+    del store[entries[1].url]
+    store[entries[2].url] = entries[2]._replace(player='Someone Else')
+    store.add_row(*entries[1])
+    order = [0, 2, 3, 4, 5, 6, 7, 8, 9, 1]
+    self.assertEqual([e.time_id for e in store.values()], order)
+    self.assertEqual([e.time_id for e in store.with_status(0)], order)
+    self.assertEqual([row[1] for row in store.rows()], order)
+
+    # Deleting half of the rows compacts them, in order.
+    for entry in entries[3:8]:
+      del store[entry.url]
+    self.assertEqual([e.time_id for e in store.values()], [0, 2, 8, 9, 1])
+    self.assertEqual(len(store._urls), 5)
+    self.assertEqual(
+        [e.time_id for e in store.for_player('Player 1')], [8, 1])
+    self.assertEqual(store.count(0), 5)
+
+  def testStatusIndex(self):
+    entries = make_entries(20)
+    store = entry_store.EntryStore.from_rows(TimeEntry, entries)
+    for entry in entries[:5]:
+      store.set_status(entry.url, truthsaver.TruthSaver.DOWNLOADED)
+    store.set_status(entries[7].url, truthsaver.TruthSaver.BAD_LINK)
+    store[entries[9].url] = entries[9]._replace(
+        status=truthsaver.TruthSaver.BAD_VIDEO)
+
+    self.assertEqual(store.count(truthsaver.TruthSaver.DOWNLOADED), 5)
+    self.assertEqual(store.count(truthsaver.TruthSaver.NEW_URL), 13)
+    self.assertEqual(store.get_status(entries[7].url),
+                     truthsaver.TruthSaver.BAD_LINK)
+    pending = store.with_status(truthsaver.TruthSaver.BAD_LINK,
+                                truthsaver.TruthSaver.BAD_VIDEO)
+    self.assertEqual([e.time_id for e in pending], [7, 9])
+    downloaded = store.with_status(truthsaver.TruthSaver.DOWNLOADED)
+    self.assertEqual([e.time_id for e in downloaded], list(range(5)))
+
+    # Statuses may change while iterating.
+    for entry in store.with_status(truthsaver.TruthSaver.NEW_URL):
+      store.set_status(entry.url, truthsaver.TruthSaver.DOWNLOADED)
+    self.assertEqual(store.count(truthsaver.TruthSaver.DOWNLOADED), 18)
+
+  def testWatermarks(self):
+    entries = make_entries(30)
+    store = entry_store.EntryStore.from_rows(TimeEntry, entries)
+    self.assertEqual(store.watermarks(),
+                     truthsaver.TruthSaver.get_watermarks(entries))
+    self.assertEqual(list(store.rows()), [tuple(e) for e in entries])
+
+  def testLinks(self):
+    entries = make_entries(10)
+    store = entry_store.EntryStore.from_rows(TimeEntry, entries)
+    store.set_link(entries[2].url, 'https://youtu.be/2', None, 1000.5)
+    store.set_link(entries[3].url, None, 'twitch video', 1001.0)
+    self.assertEqual(store[entries[2].url].link, 'https://youtu.be/2')
+    self.assertEqual(store[entries[2].url].resolved_at, 1000.5)
+    self.assertEqual(store[entries[3].url].link_error, 'twitch video')
+    self.assertIsNone(store[entries[4].url].resolved_at)
+
+    del store[entries[0].url]
+    rows = list(store.rows())
+    self.assertEqual(len(rows), 9)
+    self.assertIn(tuple(store[entries[2].url]), rows)
+    self.assertEqual(entry_store.EntryStore.from_rows(TimeEntry, rows), store)
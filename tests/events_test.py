@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Tests for the download event feed and hooks."""
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from mock import patch
+
+from truthsaver import events
+from truthsaver import truthsaver
+
+from tests.helpers import make_entries
+
+
+class TestEvents(unittest.TestCase):
+
+  def setUp(self):
+    self.temp_dir = tempfile.mkdtemp()
+    self.events_path = os.path.join(self.temp_dir, 'events.jsonl')
+
+  def tearDown(self):
+    shutil.rmtree(self.temp_dir)
+
+  def read_events(self):
+    with open(self.events_path) as fh:
+      return [json.loads(line) for line in fh]
+
+  def testFeed(self):
+    feed = events.EventFeed(self.events_path)
+    seen = []
+
+    def failing_hook(event):
+      raise RuntimeError('hook failed')
+
+    feed.add_hook(failing_hook)
+    feed.add_hook(seen.append)
+    feed.emit(events.DOWNLOADED, url='a', bytes=10)
+    # Written and flushed before the feed is closed.
+    self.assertEqual([e['url'] for e in self.read_events()], ['a'])
+    feed.remove_hook(seen.append)
+    feed.emit(events.SKIPPED, url='b')
+    feed.close()
+    self.assertEqual([(e['event'], e['url']) for e in seen],
+                     [(events.DOWNLOADED, 'a')])
+    self.assertEqual([e['event'] for e in self.read_events()],
+                     [events.DOWNLOADED, events.SKIPPED])
+
+  def testDownloadEvents(self):
+    record_path = os.path.join(self.temp_dir, 'record.json')
+    entries = make_entries(3)
+    truthsaver.TruthSaver.save_entries(
+        record_path, {e.url: e for e in entries})
+    truth = truthsaver.TruthSaver(record_path, video_root=self.temp_dir,
+                                  events_path=self.events_path)
+    hooked = []
+    truth.add_download_hook(hooked.append)
+
+    def fake_link(entry):
+      if entry.time_id == 1:
+        raise ValueError('Cannot download it is a twitch video')
+      return 'https://youtu.be/'
+
+    def fake_fetch(link, entry):
+      if entry.time_id == 2:
+        raise IOError('connection reset')
+      vid_file = os.path.join(self.temp_dir, entry.vid_path() + '.mp4')
+      os.makedirs(os.path.dirname(vid_file), exist_ok=True)
+      with open(vid_file, 'wb') as fh:
+        fh.write(b'x' * 100)
+      return vid_file, 100
+
+    with patch.object(truth, 'get_yt_link', side_effect=fake_link), \
+        patch.object(truth, 'fetch_yt_video', side_effect=fake_fetch):
+      truth.download_videos()
+    truth.events.close()
+
+    feed = {e['time_id']: e for e in self.read_events()}
+    self.assertEqual(feed, {e['time_id']: e for e in hooked})
+    self.assertEqual(feed[0]['event'], events.DOWNLOADED)
+    self.assertEqual(feed[0]['path'], os.path.join(
+        self.temp_dir, entries[0].vid_path() + '.mp4'))
+    self.assertEqual(feed[0]['bytes'], 100)
+    self.assertEqual(feed[0]['size'], 100)
+    self.assertEqual(truth.video_paths, {})
+    self.assertEqual(feed[0]['status'], truthsaver.TruthSaver.DOWNLOADED)
+    self.assertEqual(feed[1]['event'], events.FAILED)
+    self.assertEqual(feed[1]['status'], truthsaver.TruthSaver.BAD_LINK)
+    self.assertIn('twitch', feed[1]['error'])
+    self.assertEqual(feed[2]['event'], events.SKIPPED)
+    self.assertEqual(feed[2]['status'], truthsaver.TruthSaver.NEW_URL)
+    self.assertIn('connection reset', feed[2]['error'])
+    self.assertIsNone(feed[2]['path'])
+    self.assertIsNone(feed[2]['size'])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,15 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Fixtures shared by the tests."""
+
+from truthsaver import truthsaver
+
+
+def make_entries(n):
+  """Returns n pending entries over 7 players, 3 modes and 2 stages."""
+
+  return [truthsaver.TimeEntry(
+      url='https://rankings.the-elite.net/~p%d/time/%d' % (i % 7, i),
+      time_id=i, player='Player %d' % (i % 7),
+      mode=('Agent', 'SA', '00A')[i % 3], stage=('dam', 'silo')[i % 2],
+      time=60 + i, status=0) for i in range(n)]
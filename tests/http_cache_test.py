@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Tests for the conditional GET response cache."""
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from mock import patch
+import requests
+
+from truthsaver import http_cache
+from truthsaver import truthsaver
+
+TEST_DIR = './tests/testdata/'
+LTK_URL = 'https://rankings.the-elite.net/goldeneye/ltk/stage/silo'
+
+
+def make_response(status, content=b'', headers=None):
+  response = requests.models.Response()
+  response.status_code = status
+  response._content = content
+  response.encoding = 'utf-8'
+  response.headers.update(headers or {})
+  return response
+
+
+class TestResponseCache(unittest.TestCase):
+
+  def setUp(self):
+    self.temp_dir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.temp_dir)
+
+  def testNotModified(self):
+    cache = http_cache.ResponseCache(self.temp_dir)
+    self.assertEqual(cache.conditional_headers('http://a'), {})
+
+    fresh = cache.update('http://a', make_response(
+        200, b'body', {'ETag': '"v1"', 'Last-Modified': 'yesterday'}))
+    self.assertFalse(fresh.from_cache)
+    self.assertEqual(cache.conditional_headers('http://a'),
+                     {'If-None-Match': '"v1"',
+                      'If-Modified-Since': 'yesterday'})
+
+    cached = cache.update('http://a', make_response(304))
+    self.assertTrue(cached.from_cache)
+    self.assertEqual(cached.text, 'body')
+    # A 304 for an unknown url has to be refetched.
+    self.assertIsNone(cache.update('http://b', make_response(304)))
+
+  def testTtlAndEviction(self):
+    cache = http_cache.ResponseCache(self.temp_dir, ttl=60, max_bytes=600)
+    cache.update('http://a', make_response(200, b'a' * 200, {'ETag': 'a'}))
+    with patch('time.time', return_value=time.time() + 120):
+      self.assertEqual(cache.conditional_headers('http://a'), {})
+
+    for url in ('http://b', 'http://c', 'http://d'):
+      cache.update(url, make_response(200, b'x' * 200, {'ETag': 'x'}))
+    self.assertLessEqual(
+        sum(os.path.getsize(os.path.join(self.temp_dir, f))
+            for f in os.listdir(self.temp_dir)), 600)
+    self.assertIn('If-None-Match', cache.conditional_headers('http://d'))
+
+  def testStagePageSkipsParse(self):
+    with open(os.path.join(TEST_DIR, 'silo_ltk.html'), 'rb') as fh:
+      page = fh.read()
+    truth = truthsaver.TruthSaver(video_root=self.temp_dir,
+                                  cache_dir=self.temp_dir)
+    with patch('requests.Session.get', return_value=make_response(
+        200, page, {'ETag': '"silo"'})):
+      fresh_times = truth.get_ltk_level_data((6, 'silo'))
+
+    with patch('requests.Session.get',
+               return_value=make_response(304)) as mock_get, \
+        patch.object(truthsaver.parsers, 'get_backend') as mock_parser:
+      cached_times = truth.get_ltk_level_data((6, 'silo'))
+      self.assertEqual(mock_get.call_args[0][0], LTK_URL)
+      self.assertEqual(mock_get.call_args[1]['headers'],
+                       {'If-None-Match': '"silo"'})
+      self.assertFalse(mock_parser.called)
+    self.assertEqual(fresh_times, cached_times)
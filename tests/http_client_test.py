@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Tests for the shared session and its retry engine."""
+
+import io
+import unittest
+
+from mock import patch
+import requests
+
+from truthsaver import http_client
+
+
+def make_response(status, headers=None):
+  response = requests.models.Response()
+  response.status_code = status
+  response.raw = io.BytesIO()
+  response.headers.update(headers or {})
+  return response
+
+
+@patch('time.sleep')
+class TestHttpClient(unittest.TestCase):
+
+  def testSharedSession(self, mock_sleep):
+    http_client.configure(pool_size=4)
+    session = http_client.get_session()
+    self.assertIs(session, http_client.get_session())
+    self.assertEqual(session.get_adapter('https://a')._pool_maxsize, 4)
+    http_client.configure(pool_size=http_client.DEFAULT_POOL_SIZE)
+    self.assertIsNot(session, http_client.get_session())
+
+  def testRetriesTransientFailures(self, mock_sleep):
+    responses = [requests.exceptions.ConnectionError('reset'),
+                 make_response(503),
+                 make_response(429, {'Retry-After': '7'}),
+                 make_response(200)]
+    with patch('requests.Session.get', side_effect=responses) as mock_get:
+      response = http_client.get('https://a')
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(mock_get.call_count, 4)
+    self.assertEqual(mock_sleep.call_args_list[-1][0][0], 7.0)
+
+  def testGivesUp(self, mock_sleep):
+    with patch('requests.Session.get', return_value=make_response(404)):
+      self.assertEqual(http_client.get('https://a').status_code, 404)
+      self.assertFalse(mock_sleep.called)
+    with patch('requests.Session.get', return_value=make_response(500)):
+      self.assertEqual(
+          http_client.get('https://a', max_tries=3).status_code, 500)
+      self.assertEqual(mock_sleep.call_count, 2)
+    with patch('requests.Session.get',
+               side_effect=requests.exceptions.Timeout('slow')):
+      self.assertRaises(requests.exceptions.Timeout,
+                        http_client.get, 'https://a', max_tries=2)
+
+  def testBackoff(self, mock_sleep):
+    for tries in range(10):
+      self.assertLessEqual(http_client.backoff_delay(tries),
+                           http_client.BACKOFF_MAX)
+    self.assertEqual(http_client.parse_retry_after('3'), 3.0)
+    self.assertEqual(http_client.parse_retry_after(
+        'Wed, 21 Oct 2015 07:28:00 GMT'), 0.0)
+    self.assertIsNone(http_client.parse_retry_after('soon'))
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Tests for the status journal and its compaction into the record."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from truthsaver import journal
+from truthsaver import truthsaver
+
+TEST_DIR = './tests/testdata/'
+OSCAR_URL = 'https://rankings.the-elite.net/~Oscar+Pleininger/time/115050'
+LLOYD_URL = 'https://rankings.the-elite.net/goldeneye/ltk/300'
+
+
+class TestStatusJournal(unittest.TestCase):
+
+  def setUp(self):
+    self.temp_dir = tempfile.mkdtemp()
+    self.record_path = os.path.join(self.temp_dir, 'record.json')
+    shutil.copy(os.path.join(TEST_DIR, 'test.json'), self.record_path)
+
+  def tearDown(self):
+    shutil.rmtree(self.temp_dir)
+
+  def testReplay(self):
+    status_journal = journal.StatusJournal(os.path.join(self.temp_dir, 'j'))
+    status_journal.append('a', 1)
+    status_journal.append('b', -1)
+    status_journal.close()
+    with open(status_journal.path, 'a') as fh:
+      fh.write('["c", ')
+    self.assertEqual(list(status_journal.replay()), [('a', 1), ('b', -1)])
+    status_journal.truncate()
+    self.assertEqual(list(status_journal.replay()), [])
+
+  def testAppendAfterTornLine(self):
+    status_journal = journal.StatusJournal(os.path.join(self.temp_dir, 'j'))
+    status_journal.append('a', 1)
+    status_journal.close()
+    with open(status_journal.path, 'a') as fh:
+      fh.write('["b", ')
+    status_journal = journal.StatusJournal(status_journal.path)
+    status_journal.append('c', 2)
+    status_journal.close()
+    self.assertEqual(list(status_journal.replay()), [('a', 1), ('c', 2)])
+
+    # A journal holding nothing but a torn line.
+    with open(status_journal.path, 'w') as fh:
+      fh.write('["d", ')
+    status_journal = journal.StatusJournal(status_journal.path)
+    status_journal.append('e', 3)
+    status_journal.close()
+    self.assertEqual(list(status_journal.replay()), [('e', 3)])
+
+  def testStatusSurvivesKill(self):
+    truth = truthsaver.TruthSaver(self.record_path, video_root=self.temp_dir)
+    truth.set_entry_status(OSCAR_URL, truthsaver.TruthSaver.DOWNLOADED)
+    truth.set_entry_status(LLOYD_URL, truthsaver.TruthSaver.BAD_LINK)
+
+    # No save, as if the process was killed.
+    entries = truthsaver.TruthSaver.get_saved_list(self.record_path)
+    self.assertEqual(entries.get_status(OSCAR_URL),
+                     truthsaver.TruthSaver.DOWNLOADED)
+    self.assertEqual(entries.get_status(LLOYD_URL),
+                     truthsaver.TruthSaver.BAD_LINK)
+
+  def testCompaction(self):
+    truth = truthsaver.TruthSaver(self.record_path, video_root=self.temp_dir,
+                                  compact_every=2)
+    truth.set_entry_status(OSCAR_URL, truthsaver.TruthSaver.BAD_VIDEO)
+    self.assertTrue(os.path.exists(truth.journal.path))
+    truth.set_entry_status(LLOYD_URL, truthsaver.TruthSaver.DOWNLOADED)
+    self.assertFalse(os.path.exists(truth.journal.path))
+    self.assertEqual(os.listdir(self.temp_dir), ['record.json'])
+
+    entries = truthsaver.TruthSaver.get_saved_list(self.record_path)
+    self.assertEqual(entries.get_status(OSCAR_URL),
+                     truthsaver.TruthSaver.BAD_VIDEO)
+    self.assertEqual(entries.get_status(LLOYD_URL),
+                     truthsaver.TruthSaver.DOWNLOADED)
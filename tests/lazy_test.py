@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Tests for lazily imported modules."""
+
+import json
+import subprocess
+import sys
+import unittest
+
+from truthsaver import lazy
+
+
+class TestLazy(unittest.TestCase):
+
+  def testLazyModule(self):
+    module = lazy.LazyModule('json')
+    self.assertIsNone(module.__dict__['_module'])
+    self.assertEqual(module.dumps([1]), '[1]')
+    self.assertIs(module.__dict__['_module'], json)
+    self.assertRaises(AttributeError, getattr, module, 'no_such_name')
+    self.assertTrue(lazy.is_available('json'))
+    self.assertFalse(lazy.is_available('no_such_module'))
+
+  def testImportSkipsHeavyModules(self):
+    out = subprocess.check_output([
+        sys.executable, '-c',
+        'import sys, truthsaver.truthsaver, truthsaver.daemon; '
+        'print(sorted(m for m in ("requests", "bs4", "pytube", "lxml") '
+        'if m in sys.modules))'])
+    self.assertEqual(out.decode('utf-8').strip(), '[]')
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Tests for run metrics and their reports."""
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from mock import patch
+
+from truthsaver import metrics
+from truthsaver import truthsaver
+
+from tests.truthsaver_test import mock_request_get
+
+
+class TestMetrics(unittest.TestCase):
+
+  def setUp(self):
+    self.temp_dir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.temp_dir)
+
+  def testReport(self):
+    run_metrics = metrics.Metrics()
+    labels = {'game': 'goldeneye', 'stage': 'dam', 'mode': 'SA'}
+    run_metrics.count('download_bytes', 3000, **labels)
+    run_metrics.count('download_bytes', 1000, **labels)
+    run_metrics.observe('download_seconds', 0.5, **labels)
+    run_metrics.observe('download_seconds', 1.5, **labels)
+    with self.assertRaises(IOError):
+      with run_metrics.timer('download_seconds', **labels):
+        raise IOError('reset')
+
+    self.assertEqual(run_metrics.counter_value('download_bytes'), 4000)
+    self.assertEqual(run_metrics.counter_value('download_errors',
+                                               stage='dam'), 1)
+    self.assertEqual(run_metrics.histogram_count('download_seconds'), 3)
+
+    json_path = os.path.join(self.temp_dir, 'report.json')
+    run_metrics.write_json(json_path)
+    with open(json_path) as fh:
+      report = json.load(fh)
+    histogram = report['histograms'][0]
+    self.assertEqual(histogram['labels'], labels)
+    self.assertEqual(histogram['buckets'][3], ['0.5', 2])
+    self.assertEqual(histogram['buckets'][-1], ['+Inf', 3])
+    self.assertEqual(report['throughput'][0]['name'], 'download')
+    self.assertGreater(report['throughput'][0]['bytes_per_second'], 1000)
+
+    text = run_metrics.prometheus_text()
+    self.assertIn('# TYPE truthsaver_download_bytes_total counter\n'
+                  'truthsaver_download_bytes_total{game="goldeneye",'
+                  'mode="SA",stage="dam"} 4000\n', text)
+    self.assertIn('truthsaver_download_seconds_bucket{game="goldeneye",'
+                  'le="1",mode="SA",stage="dam"} 2\n', text)
+    self.assertIn('truthsaver_download_seconds_count{game="goldeneye",'
+                  'mode="SA",stage="dam"} 3\n', text)
+
+  @patch('requests.Session.get', side_effect=mock_request_get)
+  def testPhases(self, mock_get):
+    record_path = os.path.join(self.temp_dir, 'record.json')
+    truthsaver.TruthSaver.save_entries(record_path, {})
+    truth = truthsaver.TruthSaver(record_path, video_root=self.temp_dir)
+    truth.get_ltk_level_data((6, 'silo'))
+    self.assertEqual(truth.metrics.histogram_count(
+        'stage_fetch_seconds', stage='silo', page='ltk'), 1)
+    self.assertEqual(truth.metrics.histogram_count(
+        'parse_seconds', game='goldeneye'), 1)
+
+    entry = truthsaver.TimeEntry(
+        url='https://rankings.the-elite.net/~Big+Bossman/time/10',
+        time_id=10, player='Bryan Bosshardt', mode='Agent',
+        stage='dam', time=53, status=0)
+    truth.saved_entries[entry.url] = entry
+    with patch.object(truth, 'download_yt_video', return_value=10):
+      truth.download_videos()
+    self.assertEqual(truth.metrics.histogram_count(
+        'resolve_seconds', game='goldeneye', stage='dam', mode='Agent'), 1)
+    self.assertEqual(truth.metrics.counter_value('downloaded_videos'), 1)
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Tests that every parser backend extracts identical results."""
+
+import shutil
+import tempfile
+import unittest
+
+from mock import patch
+
+from truthsaver import parsers
+from truthsaver import truthsaver
+
+from tests.truthsaver_test import mock_request_get
+
+TIME_URLS = [
+    'https://rankings.the-elite.net/~Big+Bossman/time/10',
+    'https://rankings.the-elite.net/~Tara/time/113844',
+    'https://rankings.the-elite.net/~Swompz/time/78905',
+    'https://rankings.the-elite.net/~Wouter+Jansen/time/54778',
+]
+
+
+def resolve(url):
+  entry = truthsaver.TimeEntry(url=url, time_id=1, player='p', mode='Agent',
+                               stage='dam', time=60, status=0)
+  try:
+    return truthsaver.TruthSaver.get_yt_link(entry)
+  except ValueError as e:
+    return str(e)
+
+
+@patch('requests.Session.get', side_effect=mock_request_get)
+class TestParsers(unittest.TestCase):
+
+  def setUp(self):
+    self.temp_dir = tempfile.mkdtemp()
+    self.default_backend = parsers.get_backend().name
+
+  def tearDown(self):
+    shutil.rmtree(self.temp_dir)
+    parsers.set_default_backend(self.default_backend)
+
+  def testBackendsAgree(self, mock_get):
+    self.assertIn('html.parser', parsers.available_backends())
+    truth = truthsaver.TruthSaver(video_root=self.temp_dir)
+    results = []
+    for name in parsers.available_backends():
+      parsers.set_default_backend(name)
+      self.assertEqual(parsers.get_backend().name, name)
+      results.append((truth.get_ltk_level_data((36, 'attack-ship')),
+                      truth.get_ltk_level_data((6, 'silo')),
+                      [resolve(url) for url in TIME_URLS]))
+    for result in results[1:]:
+      self.assertEqual(results[0], result)
+
+  def testUnknownBackend(self, mock_get):
+    self.assertRaises(ValueError, parsers.get_backend, 'regex')
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Tests for the pipelined downloader."""
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from mock import patch
+
+from truthsaver import pipeline
+from truthsaver import truthsaver
+
+from tests.helpers import make_entries
+
+
+class TestDownloadPipeline(unittest.TestCase):
+
+  def testOverlapsStages(self):
+    entries = make_entries(20)
+    resolving = threading.Event()
+    downloaded = []
+    progress = []
+
+    def resolve(entry):
+      if entry.time_id == 0:
+        return None
+      if entry.time_id == 2:
+        # Only returns once a download ran while resolving continued.
+        resolving.wait(5)
+      return 'link%d' % entry.time_id
+
+    def download(entry, link):
+      resolving.set()
+      downloaded.append(link)
+
+    download_pipeline = pipeline.DownloadPipeline(
+        resolve, download, resolve_workers=3, download_workers=2,
+        on_done=lambda n, entry: progress.append(n))
+    self.assertEqual(download_pipeline.run(entries), 20)
+    self.assertTrue(resolving.is_set())
+    self.assertEqual(sorted(downloaded),
+                     sorted('link%d' % i for i in range(1, 20)))
+    self.assertEqual(progress, list(range(1, 21)))
+
+  def testKeepsFeedOrder(self):
+    entries = make_entries(20)
+    downloaded = []
+
+    def resolve(entry):
+      # Earlier entries take longer, so resolvers finish out of order.
+      time.sleep(0.001 * (20 - entry.time_id))
+      return None if entry.time_id % 6 == 0 else entry.time_id
+
+    download_pipeline = pipeline.DownloadPipeline(
+        resolve, lambda entry, link: downloaded.append(link),
+        resolve_workers=4, download_workers=1)
+    self.assertEqual(download_pipeline.run(entries), 20)
+    self.assertEqual(downloaded, [i for i in range(20) if i % 6])
+
+  def testErrorStops(self):
+    def download(entry, link):
+      raise RuntimeError('disk on fire')
+    download_pipeline = pipeline.DownloadPipeline(
+        lambda entry: 'link', download, download_workers=2)
+    self.assertRaises(RuntimeError, download_pipeline.run, make_entries(50))
+
+
+class TestDownloadVideos(unittest.TestCase):
+
+  def setUp(self):
+    self.temp_dir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.temp_dir)
+
+  def testStatuses(self):
+    record_path = os.path.join(self.temp_dir, 'record.json')
+    truthsaver.TruthSaver.save_entries(record_path, {})
+    truth = truthsaver.TruthSaver(record_path, video_root=self.temp_dir,
+                                  resolve_workers=4, download_workers=3)
+    entries = make_entries(30)
+    for entry in entries:
+      truth.saved_entries[entry.url] = entry
+
+    def get_yt_link(entry):
+      if entry.time_id % 5 == 0:
+        raise ValueError('Expected video link, found nothing.')
+      return 'https://youtu.be/%d' % entry.time_id
+
+    def download_yt_video(link, entry):
+      if entry.time_id % 7 == 0:
+        raise AttributeError('no streams')
+      if entry.time_id % 11 == 0:
+        raise IOError('connection reset')
+
+    with patch.object(truth, 'get_yt_link', side_effect=get_yt_link), \
+         patch.object(truth, 'download_yt_video',
+                      side_effect=download_yt_video):
+      truth.download_videos()
+
+    saved = truth.saved_entries
+    self.assertEqual(saved.count(truth.BAD_LINK), 6)
+    self.assertEqual(saved.count(truth.BAD_VIDEO), 4)
+    self.assertEqual(saved.count(truth.NEW_URL), 2)
+    self.assertEqual(saved.count(truth.DOWNLOADED), 18)
+    changes = [change for _, change in truth.journal.replay()]
+    self.assertEqual(sum(isinstance(change, int) for change in changes), 28)
+    self.assertEqual(sum(isinstance(change, dict) for change in changes), 30)
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Tests for the per-phase profiler."""
+
+import os
+import pstats
+import shutil
+import sys
+import tempfile
+import threading
+import tracemalloc
+import unittest
+
+from truthsaver import profiling
+
+
+def busy_resolver():
+  return sorted(str(i) for i in range(2000))
+
+
+class TestProfiler(unittest.TestCase):
+
+  def setUp(self):
+    self.temp_dir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.temp_dir)
+    if tracemalloc.is_tracing():
+      tracemalloc.stop()
+
+  def testPhases(self):
+    out_dir = os.path.join(self.temp_dir, 'profile')
+    profiler = profiling.Profiler(out_dir, top_n=5)
+    with profiler.phase('download', thread_phases={'resolver': 'resolve'}):
+      thread = threading.Thread(target=busy_resolver, name='resolver-0')
+      thread.start()
+      thread.join()
+      held = [bytes(1000) for _ in range(100)]
+    self.assertEqual(len(held), 100)
+
+    # Python 3.12+ cannot profile threads apart, so they stay in download.
+    merged = sys.version_info >= (3, 12)
+    for ext in ('.prof', '.tracemalloc', '.txt'):
+      self.assertTrue(os.path.exists(os.path.join(out_dir, 'download' + ext)))
+      self.assertEqual(os.path.exists(os.path.join(out_dir, 'resolve' + ext)),
+                       not merged)
+    stats = pstats.Stats(os.path.join(
+        out_dir, ('download' if merged else 'resolve') + '.prof'))
+    self.assertIn('busy_resolver',
+                  [func[2] for func in stats.stats])
+    tracemalloc.Snapshot.load(os.path.join(out_dir, 'download.tracemalloc'))
+
+    with open(profiler.write_summary()) as fh:
+      summary = fh.read().splitlines()
+    self.assertEqual(len(summary), 2)
+    self.assertTrue(summary[1].startswith('download'))
+
+  def testDisabled(self):
+    out_dir = os.path.join(self.temp_dir, 'profile')
+    profiler = profiling.Profiler(out_dir, enabled=False)
+    with profiler.phase('load'):
+      pass
+    self.assertIsNone(profiler.write_summary())
+    self.assertFalse(os.path.exists(out_dir))
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Tests for reconciling the record with the video tree."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from mock import patch
+
+from truthsaver import events
+from truthsaver import reconcile
+from truthsaver import truthsaver
+
+from tests.helpers import make_entries
+
+
+class TestReconcile(unittest.TestCase):
+
+  def setUp(self):
+    self.temp_dir = tempfile.mkdtemp()
+    self.video_dir = os.path.join(self.temp_dir, 'vids')
+    os.mkdir(self.video_dir)
+
+  def tearDown(self):
+    shutil.rmtree(self.temp_dir)
+
+  def touch(self, rel_path, content=b'video'):
+    path = os.path.join(self.video_dir, rel_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as fh:
+      fh.write(content)
+    return path
+
+  def testReconcile(self):
+    entries = make_entries(6)
+    entries[0] = entries[0]._replace(link='https://youtu.be/QtvECUNjszU')
+    entries[4] = entries[4]._replace(status=truthsaver.TruthSaver.DOWNLOADED)
+    entries[5] = entries[5]._replace(status=truthsaver.TruthSaver.DOWNLOADED)
+    record_path = os.path.join(self.temp_dir, 'record.json')
+    truthsaver.TruthSaver.save_entries(
+        record_path, {e.url: e for e in entries})
+    for entry in entries[:2] + entries[4:5]:
+      self.touch(entry.vid_path() + '.mp4')
+    self.touch(entries[2].vid_path() + '.mp4.part')
+    self.touch('Nobody/ge.dam.Agent.0100.Nobody.mp4')
+    truth = truthsaver.TruthSaver(record_path, video_root=self.video_dir)
+
+    report = reconcile.reconcile(truth, workers=2)
+    self.assertEqual(report['videos'], 4)
+    self.assertEqual(report['marked_downloaded'], 2)
+    self.assertEqual(report['orphans'],
+                     [os.path.join('Nobody', 'ge.dam.Agent.0100.Nobody.mp4')])
+    self.assertEqual(report['missing'], [entries[5].vid_path()])
+    self.assertEqual(truth.video_index.lookup('QtvECUNjszU'), os.path.join(
+        self.video_dir, entries[0].vid_path() + '.mp4'))
+
+    # The statuses were saved to the record, without any journal left.
+    loaded = truthsaver.TruthSaver.get_saved_list(record_path)
+    self.assertEqual([loaded[e.url].status for e in entries],
+                     [1, 1, 0, 0, 1, 1])
+    self.assertFalse(os.path.exists(truth.journal.path)
+                     and os.path.getsize(truth.journal.path))
+
+  def testIncomplete(self):
+    entries = make_entries(3)
+    record_path = os.path.join(self.temp_dir, 'record.json')
+    truthsaver.TruthSaver.save_entries(
+        record_path, {e.url: e for e in entries})
+    events_path = os.path.join(self.temp_dir, 'events.jsonl')
+    truth = truthsaver.TruthSaver(record_path, video_root=self.video_dir,
+                                  events_path=events_path)
+    self.touch(entries[0].vid_path() + '.mp4')
+    self.touch(entries[1].vid_path() + '.mp4', content=b'')
+    # Downloaded at 10 bytes, cut off since.
+    path = self.touch(entries[2].vid_path() + '.mp4')
+    truth.events.emit(events.DOWNLOADED, url=entries[2].url, path=path,
+                      size=10)
+
+    report = reconcile.reconcile(truth, workers=2)
+    self.assertEqual(report['marked_downloaded'], 1)
+    self.assertEqual(report['incomplete'],
+                     sorted(e.vid_path() for e in entries[1:]))
+    self.assertEqual(report['orphans'], [])
+    self.assertEqual([truth.saved_entries[e.url].status for e in entries],
+                     [1, 0, 0])
+
+  def testScanCache(self):
+    self.touch('Player_1/a.mp4')
+    self.touch('Player_2/b.mp4')
+    videos = reconcile.scan_tree(self.video_dir)
+    self.assertEqual(sorted(videos), [os.path.join('Player_1', 'a'),
+                                      os.path.join('Player_2', 'b')])
+    with patch('truthsaver.reconcile._scan_dir',
+               side_effect=reconcile._scan_dir) as mock_scan:
+      self.assertEqual(reconcile.scan_tree(self.video_dir), videos)
+      self.assertEqual(mock_scan.call_count, 0)
+      self.touch('Player_2/c.mp4')
+      # Force a new mtime, the filesystem's resolution may be coarse.
+      os.utime(os.path.join(self.video_dir, 'Player_2'), (1, 1))
+      self.assertEqual(len(reconcile.scan_tree(self.video_dir)), 3)
+      self.assertEqual(mock_scan.call_count, 1)
+
+
+if __name__ == '__main__':
+  unittest.main()
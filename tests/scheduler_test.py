@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Tests for the download scheduler and run budgets."""
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from mock import patch
+
+from truthsaver import entry_store
+from truthsaver import scheduler
+from truthsaver import truthsaver
+
+from tests.helpers import make_entries
+
+
+class TestScheduler(unittest.TestCase):
+
+  def testOrder(self):
+    entries = make_entries(12)
+    # Entries in insertion order are passed through without being read.
+    feed = iter(entries)
+    self.assertIs(scheduler.Scheduler().order(feed), feed)
+    newest = scheduler.Scheduler(scheduler.NEWEST).order(entries)
+    self.assertEqual([e.time_id for e in newest], list(range(11, -1, -1)))
+
+    # Slowest times first, so the fastest are the oldest entries.
+    entries = [e._replace(time=100 - e.time_id) for e in entries]
+    top = scheduler.Scheduler(scheduler.TOP_N, top_n=1).order(entries)
+    # The fastest time of each of the 6 stage and mode pairs goes first.
+    self.assertEqual([e.time_id for e in top[:6]], [11, 10, 9, 8, 7, 6])
+    self.assertEqual([e.time_id for e in top[6:]], [5, 4, 3, 2, 1, 0])
+
+    watched = scheduler.Scheduler(scheduler.NEWEST,
+                                  watchlist=['Player 2']).order(entries)
+    self.assertEqual([e.time_id for e in watched[:2]], [9, 2])
+    self.assertRaises(ValueError, scheduler.Scheduler, 'oldest')
+
+  def testTopNAgainstRecord(self):
+    # The fastest time of each stage and mode is the oldest entry.
+    entries = make_entries(12)
+    record = entry_store.EntryStore(truthsaver.TimeEntry,
+                                    {e.url: e for e in entries})
+    for entry in entries[:3]:
+      record.set_status(entry.url, truthsaver.TruthSaver.DOWNLOADED)
+    top = scheduler.Scheduler(scheduler.TOP_N, top_n=1).order(
+        entries[3:], record)
+    # Only 3 of the fastest times are still pending, the other 3 stage and
+    # mode pairs have none in their top 1.
+    self.assertEqual([e.time_id for e in top], [5, 4, 3, 11, 10, 9, 8, 7, 6])
+
+  def testBudget(self):
+    budget = scheduler.Budget(max_videos=2)
+    self.assertTrue(budget.start())
+    self.assertTrue(budget.start())
+    # The last videos are in flight, a third download waits for them.
+    started = []
+    waiting = threading.Thread(target=lambda: started.append(budget.start()))
+    waiting.start()
+    self.assertIsNone(budget.used_up())
+    self.assertEqual(list(budget.limit(range(2))), [0, 1])
+    budget.finish(downloaded=False)
+    waiting.join()
+    self.assertEqual(started, [True])
+    budget.finish(100)
+    budget.finish(100)
+    self.assertEqual(budget.used_up(), 'downloaded 2 videos')
+    self.assertFalse(budget.start())
+    self.assertEqual(list(budget.limit(range(5))), [])
+
+    budget = scheduler.Budget(max_bytes=150)
+    self.assertEqual(list(budget.limit(range(3))), [0, 1, 2])
+    budget.start()
+    budget.finish(200)
+    self.assertFalse(budget.start())
+
+    with patch('time.time', return_value=1000):
+      budget = scheduler.Budget(max_runtime=60)
+    with patch('time.time', return_value=1059):
+      self.assertIsNone(budget.exhausted())
+    with patch('time.time', return_value=1060):
+      self.assertFalse(budget.start())
+
+
+class TestScheduledDownloads(unittest.TestCase):
+
+  def setUp(self):
+    self.temp_dir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.temp_dir)
+
+  def testMaxVideos(self):
+    record_path = os.path.join(self.temp_dir, 'record.json')
+    truthsaver.TruthSaver.save_entries(record_path, {})
+    truth = truthsaver.TruthSaver(record_path, video_root=self.temp_dir,
+                                  priority=scheduler.NEWEST, max_videos=3,
+                                  resolve_workers=2, download_workers=2)
+    for entry in make_entries(20):
+      truth.saved_entries[entry.url] = entry
+    with patch.object(truth, 'get_yt_link', return_value='https://youtu.be/'), \
+         patch.object(truth, 'download_yt_video', return_value=1024):
+      truth.download_videos()
+
+    downloaded = truth.saved_entries.with_status(truth.DOWNLOADED)
+    self.assertEqual(sorted(e.time_id for e in downloaded), [17, 18, 19])
+    self.assertEqual(truth.saved_entries.count(truth.NEW_URL), 17)
+    self.assertEqual(truth.budget.n_bytes, 3072)
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Tests for the binary record snapshot format."""
+
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+
+from mock import patch
+
+from truthsaver import snapshot
+from truthsaver import truthsaver
+
+from tests.helpers import make_entries
+
+TimeEntry = truthsaver.TimeEntry
+
+
+class TestSnapshot(unittest.TestCase):
+
+  def setUp(self):
+    self.temp_dir = tempfile.mkdtemp()
+    self.path = os.path.join(self.temp_dir, 'record.snap')
+
+  def tearDown(self):
+    shutil.rmtree(self.temp_dir)
+
+  def testRoundTrip(self):
+    entries = make_entries(40)
+    entries[5] = entries[5]._replace(status=truthsaver.TruthSaver.BAD_LINK,
+                                     player='Marc Rützou')
+    truthsaver.TruthSaver.save_entries(
+        self.path, {e.url: e for e in entries})
+    store = truthsaver.TruthSaver.get_saved_list(self.path)
+    self.assertIsInstance(store, snapshot.SnapshotEntryStore)
+    self.assertEqual(len(store), 40)
+    self.assertEqual(store[entries[5].url], entries[5])
+    self.assertNotIn('https://bad.com', store)
+    self.assertEqual(list(store.rows()), [tuple(e) for e in entries])
+    self.assertEqual(store.watermarks(),
+                     truthsaver.TruthSaver.get_watermarks(entries))
+    self.assertEqual(store.count(truthsaver.TruthSaver.BAD_LINK), 1)
+    self.assertEqual(store.count(truthsaver.TruthSaver.NEW_URL), 39)
+
+  def testLazyDecoding(self):
+    entries = make_entries(1000)
+    truthsaver.TruthSaver.save_entries(
+        self.path, {e.url: e for e in entries[:-1]})
+    store = truthsaver.TruthSaver.get_saved_list(self.path)
+    for entry in entries[10:20]:
+      store.set_status(entry.url, truthsaver.TruthSaver.BAD_VIDEO)
+    store[entries[-1].url] = entries[-1]._replace(
+        status=truthsaver.TruthSaver.BAD_VIDEO)
+    del store[entries[0].url]
+    store[entries[15].url] = entries[15]._replace(time=1)
+
+    with patch.object(store, 'entry_type',
+                      side_effect=TimeEntry) as mock_entry:
+      pending = list(store.with_status(truthsaver.TruthSaver.BAD_VIDEO))
+      # Only the 9 matching snapshot records are decoded.
+      self.assertEqual(mock_entry.call_count, 9)
+    self.assertEqual([e.time_id for e in pending],
+                     list(range(10, 15)) + list(range(16, 20)) + [999])
+    self.assertEqual(len(store), 999)
+    self.assertEqual(store[entries[15].url].time, 1)
+
+    truthsaver.TruthSaver.save_entries(self.path, store)
+    reloaded = truthsaver.TruthSaver.get_saved_list(self.path)
+    self.assertEqual(reloaded, store)
+    self.assertEqual(reloaded.count(truthsaver.TruthSaver.BAD_VIDEO), 10)
+
+  def testVersionCheck(self):
+    truthsaver.TruthSaver.save_entries(self.path, {})
+    with open(self.path, 'r+b') as fh:
+      fh.seek(4)
+      fh.write(struct.pack('<H', snapshot.VERSION + 1))
+    self.assertRaises(ValueError, snapshot.SnapshotEntryStore,
+                      TimeEntry, self.path)
+
+  def testLinks(self):
+    entries = make_entries(5)
+    entries[1] = entries[1]._replace(link='https://youtu.be/1',
+                                     resolved_at=1000.0)
+    truthsaver.TruthSaver.save_entries(
+        self.path, {e.url: e for e in entries})
+    store = truthsaver.TruthSaver.get_saved_list(self.path)
+    self.assertEqual(store[entries[1].url], entries[1])
+    self.assertIsNone(store[entries[2].url].link)
+    store.set_link(entries[2].url, None, 'twitch video', 1001.0)
+    self.assertEqual(store[entries[2].url].link_error, 'twitch video')
+    self.assertEqual(store[entries[2].url].resolved_at, 1001.0)
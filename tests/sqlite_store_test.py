@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Tests for the SQLite record backend."""
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from mock import patch
+
+from truthsaver import sqlite_store
+from truthsaver import truthsaver
+
+from tests.helpers import make_entries
+
+TEST_DIR = './tests/testdata/'
+TimeEntry = truthsaver.TimeEntry
+
+
+class TestSqliteEntryStore(unittest.TestCase):
+
+  def setUp(self):
+    self.temp_dir = tempfile.mkdtemp()
+    self.path = os.path.join(self.temp_dir, 'record.sqlite')
+
+  def tearDown(self):
+    shutil.rmtree(self.temp_dir)
+
+  def testMapping(self):
+    entries = make_entries(30)
+    store = sqlite_store.SqliteEntryStore(TimeEntry, self.path, batch_size=7)
+    for entry in entries:
+      store[entry.url] = entry
+    self.assertEqual(len(store), 30)
+    self.assertEqual(store[entries[3].url], entries[3])
+    self.assertIn(entries[29].url, store)
+    del store[entries[0].url]
+    self.assertNotIn(entries[0].url, store)
+    self.assertEqual(len(store.for_stage('silo')), 15)
+    self.assertEqual(len(store.for_player('Player 1')), 5)
+    self.assertEqual(store.watermarks()['silo'],
+                     {'Agent': 27, 'SA': 25, '00A': 29})
+    store.close()
+
+    reopened = sqlite_store.SqliteEntryStore(TimeEntry, self.path)
+    self.assertEqual(reopened, {e.url: e for e in entries[1:]})
+
+  @patch.object(sqlite_store, 'PAGE_SIZE', 4)
+  def testStreamWhileUpdating(self):
+    store = sqlite_store.SqliteEntryStore(TimeEntry, self.path, batch_size=3)
+    store.add_rows(make_entries(25))
+    seen = []
+    for entry in store.with_status(truthsaver.TruthSaver.NEW_URL):
+      seen.append(entry.time_id)
+      store.set_status(entry.url, truthsaver.TruthSaver.DOWNLOADED)
+    self.assertEqual(seen, list(range(25)))
+    self.assertEqual(store.count(truthsaver.TruthSaver.DOWNLOADED), 25)
+    self.assertEqual(store.count(truthsaver.TruthSaver.NEW_URL), 0)
+
+  def testMigration(self):
+    json_path = os.path.join(TEST_DIR, 'test.json')
+    json_entries = truthsaver.TruthSaver.get_saved_list(json_path)
+    self.assertEqual(
+        truthsaver.TruthSaver.migrate_record(json_path, self.path),
+        len(json_entries))
+    self.assertEqual(truthsaver.TruthSaver.get_saved_list(self.path),
+                     json_entries)
+
+    pkl_path = os.path.join(self.temp_dir, 'record.pkl')
+    truthsaver.TruthSaver.migrate_record(self.path, pkl_path)
+    self.assertEqual(truthsaver.TruthSaver.get_saved_list(pkl_path),
+                     json_entries)
+
+  def testTruthSaverRecord(self):
+    truth = truthsaver.TruthSaver(self.path, video_root=self.temp_dir)
+    entry = make_entries(1)[0]
+    with patch.object(truth, 'get_all_time_entries',
+                      return_value={entry.url: entry}):
+      truth.update_download_list()
+    truth.set_entry_status(entry.url, truthsaver.TruthSaver.BAD_LINK)
+    truth.save()
+    self.assertEqual(
+        truthsaver.TruthSaver.get_saved_list(self.path)[entry.url].status,
+        truthsaver.TruthSaver.BAD_LINK)
+
+  def testUpgradeSchema(self):
+    conn = sqlite3.connect(self.path)
+    conn.execute('CREATE TABLE entries (url TEXT PRIMARY KEY, time_id INTEGER,'
+                 ' player TEXT, mode TEXT, stage TEXT, time INTEGER,'
+                 ' status INTEGER)')
+    entries = make_entries(3)
+    conn.executemany('INSERT INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)',
+                     [tuple(e)[:7] for e in entries])
+    conn.commit()
+    conn.close()
+
+    store = sqlite_store.SqliteEntryStore(TimeEntry, self.path)
+    self.assertEqual(store, {e.url: e for e in entries})
+    store.set_link(entries[1].url, 'https://youtu.be/1', None, 1000.0)
+    store.close()
+    reopened = sqlite_store.SqliteEntryStore(TimeEntry, self.path)
+    self.assertEqual(reopened[entries[1].url].link, 'https://youtu.be/1')
+    self.assertEqual(reopened[entries[1].url].resolved_at, 1000.0)
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Tests for placing player directories over several video roots."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from mock import patch
+
+from truthsaver import reconcile
+from truthsaver import storage
+from truthsaver import truthsaver
+
+from tests.helpers import make_entries
+
+
+class TestVideoStorage(unittest.TestCase):
+
+  def setUp(self):
+    self.temp_dir = tempfile.mkdtemp()
+    self.roots = [os.path.join(self.temp_dir, name)
+                  for name in ('a', 'b', 'c')]
+    self.free = {root: 100 * 2**30 for root in self.roots}
+
+  def tearDown(self):
+    shutil.rmtree(self.temp_dir)
+
+  def storage(self):
+    video_storage = storage.VideoStorage(self.roots)
+    patcher = patch.object(video_storage, 'free_bytes',
+                           side_effect=lambda root: self.free[root])
+    patcher.start()
+    self.addCleanup(patcher.stop)
+    return video_storage
+
+  def testPlacement(self):
+    video_storage = self.storage()
+    players = ['Player_%d' % i for i in range(300)]
+    placed = {p: video_storage.root_for(p) for p in players}
+    counts = [list(placed.values()).count(root) for root in self.roots]
+    self.assertTrue(all(count > 60 for count in counts), counts)
+
+    # Placements are pinned, even once free space changes.
+    self.free[self.roots[0]] = 0
+    reopened = self.storage()
+    self.assertEqual({p: reopened.root_for(p) for p in players}, placed)
+    self.assertNotIn(self.roots[0], [reopened.root_for('New_%d' % i)
+                                     for i in range(50)])
+
+    # A player directory already on a root stays there.
+    os.makedirs(os.path.join(self.roots[0], 'Old_Player'))
+    self.assertEqual(reopened.player_dir('Old_Player'),
+                     os.path.join(self.roots[0], 'Old_Player'))
+
+    for root in self.roots:
+      self.free[root] = storage.DEFAULT_MIN_FREE
+    self.assertRaises(IOError, reopened.root_for, 'No_Space')
+
+  def testReconcileRoots(self):
+    record_path = os.path.join(self.temp_dir, 'record.json')
+    entries = make_entries(2)
+    truthsaver.TruthSaver.save_entries(
+        record_path, {e.url: e for e in entries})
+    for root, entry in zip(self.roots[1:], entries):
+      path = os.path.join(root, entry.vid_path() + '.mp4')
+      os.makedirs(os.path.dirname(path))
+      with open(path, 'w') as fh:
+        fh.write('video')
+    truth = truthsaver.TruthSaver(record_path, video_root=self.roots)
+    self.assertEqual(truth.videos_dir_root, self.roots[0])
+
+    report = reconcile.reconcile(truth)
+    self.assertEqual(report['marked_downloaded'], 2)
+    for root, entry in zip(self.roots[1:], entries):
+      player_dirname = os.path.dirname(entry.vid_path())
+      self.assertEqual(truth.storage.placement()[player_dirname], root)
+
+
+if __name__ == '__main__':
+  unittest.main()
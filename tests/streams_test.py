@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Tests for picking the stream of a video to download."""
+
+import unittest
+
+from truthsaver import streams
+
+
+class MockStream(object):
+
+  def __init__(self, res, ext='mp4', codec='avc1.64001F', size=None):
+    self.resolution = res
+    self.extension = ext
+    self.video_codec = codec
+    if size is not None:
+      self.filesize = size
+    self.url = 'https://example.com/%s.%s' % (res, ext)
+
+  def __repr__(self):
+    return '%s.%s' % (self.resolution, self.extension)
+
+
+class TestStreams(unittest.TestCase):
+
+  def testResolution(self):
+    self.assertEqual(streams.resolution(MockStream('720p60')), 720)
+    self.assertEqual(streams.resolution(MockStream(None)), 0)
+    self.assertEqual(streams.advertised_size(MockStream('720p')), None)
+    self.assertEqual(streams.advertised_size(MockStream('720p', size=9)), 9)
+    self.assertEqual(streams.stream_key(MockStream('720p')), '720p')
+    stream = MockStream('720p', size=9)
+    stream.itag = 22
+    self.assertEqual(streams.stream_key(stream), '22-9')
+
+  def testSelect(self):
+    videos = [MockStream('360p'), MockStream('720p', size=2**30),
+              MockStream('1080p', ext='webm', codec='vp9'),
+              MockStream('480p', ext='webm', codec='vp9', size=2**20),
+              MockStream('480p', size=2**21)]
+    select = lambda **kwargs: streams.StreamPolicy(**kwargs).select(videos)
+    # Numerically, a string sort would put 720p above 1080p.
+    self.assertIs(select(), videos[2])
+    self.assertIs(select(lowest=True), videos[0])
+    self.assertIs(select(max_resolution=720), videos[1])
+    self.assertIs(select(max_resolution=600), videos[4])
+    self.assertIs(select(max_resolution=600, containers=['webm']), videos[3])
+    self.assertIs(select(max_resolution=720, max_size=2**29), videos[4])
+    self.assertIs(select(max_resolution=240), videos[0])
+    # Streams of unknown size are never skipped.
+    self.assertIs(select(max_size=100), videos[2])
+    self.assertRaises(streams.NoStreamError,
+                      streams.StreamPolicy(max_size=100).select, videos[3:])
+    self.assertRaises(streams.NoStreamError,
+                      streams.StreamPolicy().select, [])
+
+
+if __name__ == '__main__':
+  unittest.main()
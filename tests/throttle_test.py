@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Tests for the download bandwidth cap and concurrency controller."""
+
+import unittest
+
+from mock import patch
+
+from truthsaver import throttle
+
+
+class FakeClock(object):
+
+  def __init__(self):
+    self.now = 1000.0
+
+  def time(self):
+    return self.now
+
+  def sleep(self, seconds):
+    self.now += seconds
+
+
+class TestThrottle(unittest.TestCase):
+
+  def setUp(self):
+    self.clock = FakeClock()
+    patchers = [patch('time.time', side_effect=self.clock.time),
+                patch('time.sleep', side_effect=self.clock.sleep)]
+    for patcher in patchers:
+      patcher.start()
+      self.addCleanup(patcher.stop)
+
+  def testTokenBucket(self):
+    bucket = throttle.TokenBucket(1000)
+    bucket.consume(1000)
+    self.assertEqual(self.clock.now, 1000.0)
+    for _ in range(10):
+      bucket.consume(500)
+    # 5000 bytes over the burst take 5 seconds at 1000 B/s.
+    self.assertAlmostEqual(self.clock.now, 1005.0)
+
+  def run_round(self, controller, n_bytes, seconds, errors=0, throttled=0):
+    for _ in range(throttled):
+      controller.on_status(429)
+    n_transfers = controller.limit
+    slots = [controller.transfer() for _ in range(n_transfers)]
+    for slot in slots:
+      slot.__enter__()
+    self.clock.now += seconds
+    for n, slot in enumerate(slots):
+      slot.n_bytes = n_bytes // n_transfers
+      if n < errors:
+        slot.__exit__(IOError, IOError(), None)
+      else:
+        slot.__exit__(None, None, None)
+    return controller.limit
+
+  def testAimd(self):
+    controller = throttle.AimdController(8, initial=2)
+    self.assertEqual(self.run_round(controller, 2000, 1), 3)
+    self.assertEqual(self.run_round(controller, 3000, 1), 4)
+    # One more transfer gained nothing, step back and stay there.
+    self.assertEqual(self.run_round(controller, 3000, 1), 3)
+    self.assertEqual(self.run_round(controller, 3000, 1), 3)
+    self.assertEqual(self.run_round(controller, 3000, 1, throttled=1), 1)
+    self.assertEqual(self.run_round(controller, 1000, 1), 2)
+    self.assertEqual(self.run_round(controller, 2000, 1, errors=1), 1)
+
+    controller = throttle.AimdController(2)
+    self.assertEqual(self.run_round(controller, 2000, 1), 2)
+    self.assertEqual(self.run_round(controller, 4000, 1), 2)
+
+  def testErrorReleasesSlot(self):
+    controller = throttle.AimdController(1)
+    with self.assertRaises(IOError):
+      with controller.transfer():
+        raise IOError('reset')
+    with controller.transfer() as slot:
+      slot.n_bytes = 10
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Tests for resumable downloads."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from mock import patch
+import requests
+
+from truthsaver import transfer
+
+VIDEO = bytes(range(256)) * 40
+
+
+class FakeResponse(object):
+  """Serves VIDEO honoring Range, optionally cutting off after cut_at."""
+
+  def __init__(self, headers, cut_at=None, ignore_range=False):
+    start = 0
+    if 'Range' in headers and not ignore_range:
+      start = int(headers['Range'][len('bytes='):-1])
+    self.body = VIDEO[start:]
+    self.cut_at = cut_at
+    if start >= len(VIDEO):
+      self.status_code = 416
+      self.headers = {'Content-Range': 'bytes */%d' % len(VIDEO)}
+    elif start:
+      self.status_code = 206
+      self.headers = {'Content-Range': 'bytes %d-%d/%d'
+                                       % (start, len(VIDEO) - 1, len(VIDEO))}
+    else:
+      self.status_code = 200
+      self.headers = {'Content-Length': str(len(VIDEO))}
+
+  def raise_for_status(self):
+    pass
+
+  def iter_content(self, chunk_size):
+    for i in range(0, len(self.body), 1000):
+      if self.cut_at is not None and i >= self.cut_at:
+        raise requests.exceptions.ChunkedEncodingError('connection reset')
+      yield self.body[i:i + 1000]
+
+  def close(self):
+    pass
+
+
+@patch('time.sleep')
+class TestDownloadFile(unittest.TestCase):
+
+  def setUp(self):
+    self.temp_dir = tempfile.mkdtemp()
+    self.path = os.path.join(self.temp_dir, 'vid.mp4')
+
+  def tearDown(self):
+    shutil.rmtree(self.temp_dir)
+
+  def read(self):
+    with open(self.path, 'rb') as fh:
+      return fh.read()
+
+  def testResumes(self, mock_sleep):
+    requested = []
+
+    def get(url, headers=None, stream=False, on_status=None):
+      requested.append(dict(headers))
+      return FakeResponse(headers, cut_at=None if requested[1:] else 3000)
+
+    with patch('truthsaver.http_client.get', side_effect=get):
+      self.assertEqual(transfer.download_file('http://v', self.path),
+                       len(VIDEO))
+    self.assertEqual(requested, [{}, {'Range': 'bytes=3000-'}])
+    self.assertEqual(self.read(), VIDEO)
+    self.assertFalse(os.path.exists(self.path + transfer.PART_SUFFIX))
+
+  def testPartKeptBetweenRuns(self, mock_sleep):
+    with patch('truthsaver.http_client.get',
+               side_effect=lambda url, headers, stream, on_status: FakeResponse(
+                   headers, cut_at=2000)):
+      self.assertRaises(IOError, transfer.download_file, 'http://v',
+                        self.path, max_tries=1)
+    self.assertFalse(os.path.exists(self.path))
+    self.assertEqual(
+        os.path.getsize(self.path + transfer.PART_SUFFIX), 2000)
+
+    with patch('truthsaver.http_client.get',
+               side_effect=lambda url, headers, stream, on_status: FakeResponse(
+                   headers, ignore_range=True)):
+      transfer.download_file('http://v', self.path)
+    self.assertEqual(self.read(), VIDEO)
+
+  def testPartOfOtherStreamDiscarded(self, mock_sleep):
+    requested = []
+
+    def get(url, headers=None, stream=False, on_status=None):
+      requested.append(dict(headers))
+      return FakeResponse(headers)
+
+    for key in (None, '18'):
+      with open(transfer.part_path_for(self.path, key), 'wb') as fh:
+        fh.write(b'other stream')
+    with patch('truthsaver.http_client.get', side_effect=get):
+      transfer.download_file('http://v', self.path, part_key='22')
+    self.assertEqual(requested, [{}])
+    self.assertEqual(self.read(), VIDEO)
+    self.assertEqual(os.listdir(self.temp_dir), ['vid.mp4'])
+
+  def testCompletePartFile(self, mock_sleep):
+    with open(self.path + transfer.PART_SUFFIX, 'wb') as fh:
+      fh.write(VIDEO[:3000])
+    with patch('truthsaver.http_client.get',
+               side_effect=lambda url, headers, stream, on_status: FakeResponse(
+                   headers)):
+      # Only the bytes received count, not those resumed from the part.
+      self.assertEqual(transfer.download_file('http://v', self.path),
+                       len(VIDEO) - 3000)
+      os.rename(self.path, self.path + transfer.PART_SUFFIX)
+      self.assertEqual(transfer.download_file('http://v', self.path), 0)
+    self.assertEqual(self.read(), VIDEO)
+
+  def testLengthMismatch(self, mock_sleep):
+    def get(url, headers=None, stream=False, on_status=None):
+      response = FakeResponse(headers)
+      response.headers['Content-Length'] = str(len(VIDEO) + 10)
+      return response
+
+    with patch('truthsaver.http_client.get', side_effect=get):
+      self.assertRaises(transfer.IncompleteDownload, transfer.download_file,
+                        'http://v', self.path, max_tries=1)
+    self.assertFalse(os.path.exists(self.path))
+
+  def testUnknownLength(self, mock_sleep):
+    def get(url, headers=None, stream=False, on_status=None):
+      response = FakeResponse(headers)
+      response.headers.pop('Content-Length', None)
+      return response
+
+    with patch('truthsaver.http_client.get', side_effect=get):
+      self.assertRaises(transfer.IncompleteDownload, transfer.download_file,
+                        'http://v', self.path)
+      self.assertFalse(os.path.exists(self.path))
+      self.assertEqual(
+          os.path.getsize(self.path + transfer.PART_SUFFIX), len(VIDEO))
+      os.remove(self.path + transfer.PART_SUFFIX)
+      transfer.download_file('http://v', self.path, expected_size=len(VIDEO))
+    self.assertEqual(self.read(), VIDEO)
+
+  def testExistingFileChecked(self, mock_sleep):
+    requested = []
+
+    def get(url, headers=None, stream=False, on_status=None):
+      requested.append(dict(headers))
+      return FakeResponse(headers)
+
+    with patch('truthsaver.http_client.get', side_effect=get):
+      for content, expected_size in ((b'', None), (VIDEO[:100], len(VIDEO))):
+        with open(self.path, 'wb') as fh:
+          fh.write(content)
+        transfer.download_file('http://v', self.path,
+                               expected_size=expected_size)
+        self.assertEqual(self.read(), VIDEO)
+      self.assertEqual(transfer.download_file(
+          'http://v', self.path, expected_size=len(VIDEO)), 0)
+    self.assertEqual(requested, [{}, {}])
@@ -11,8 +11,11 @@ import unittest
 
 from mock import patch
 
+from truthsaver import events
 from truthsaver import truthsaver
 
+from tests.helpers import make_entries
+
 TEST_DIR = './tests/testdata/'
 
 def mock_request_get(*args, **kwargs):
@@ -25,6 +28,8 @@ def mock_request_get(*args, **kwargs):
       else:
         self.text = ''
       self.status = status
+      self.status_code = status
+      self.headers = {}
 
     def raise_for_status(self):
       if self.status != 200:
@@ -159,7 +164,7 @@ class TestTruth(unittest.TestCase):
     self.assertEqual(pd_times[illu_entry.url], illu_entry)
     self.assertEqual(pd_times[karl_entry.url], karl_entry)
 
-  @patch('requests.get', side_effect=mock_request_get)
+  @patch('requests.Session.get', side_effect=mock_request_get)
   def testLtkToEntries(self, mock_get):
     truth = truthsaver.TruthSaver()
     attack_ship_entries = truth.get_ltk_level_data((36, 'attack-ship'))
@@ -200,7 +205,7 @@ class TestTruth(unittest.TestCase):
     self.assertEqual(silo_entries[ab_entry.url], ab_entry)
     self.assertEqual(silo_entries[bb_entry.url], bb_entry)
 
-  @patch('requests.get', side_effect=mock_request_get)
+  @patch('requests.Session.get', side_effect=mock_request_get)
   def testYtLink(self, mock_request):
 
     bb_entry = truthsaver.TimeEntry(
@@ -254,10 +259,135 @@ class TestTruth(unittest.TestCase):
     else:
       self.fail('Link should fail.')
 
-    def testSaveDownloadedPaths(self):
-      test_out = os.path.join(self.tmp_dir, 'foo')
-      truth = truthsaver.TruthSaver(new_times_path=test_out)
-      test_vid_paths = ['SomeSavedPath.mp4', 'SomeOtherSavedPath.mp4']
-      truth.new_times_list.extend(test_vid_paths)
-      truth.save_downloaded_paths()
-      self.assertEqual(open(test_out).read(), '\n'.join(test_vid_paths))
+  def testSaveDownloadedPaths(self):
+    record_path = os.path.join(self.temp_dir, 'record.json')
+    entries = make_entries(3)
+    truthsaver.TruthSaver.save_entries(
+        record_path, {e.url: e for e in entries})
+    test_out = os.path.join(self.temp_dir, 'foo')
+    truth = truthsaver.TruthSaver(record_path, video_root=self.temp_dir,
+                                  new_times_path=test_out)
+    truth.emit_event(events.DOWNLOADED, entries[0])
+    truth.emit_event(events.FAILED, entries[1], error='Bad video')
+    truth.emit_event(events.DOWNLOADED, entries[2])
+    # Paths are written as the downloads happen.
+    with open(test_out) as fh:
+      self.assertEqual(fh.read().splitlines(),
+                       [entries[0].vid_path(), entries[2].vid_path()])
+    truth.save_downloaded_paths()
+
+  def testConcurrentCrawl(self):
+
+    def fake_regular(stage):
+      if stage[1] == 'silo':
+        raise ValueError('Bad status')
+      url = 'https://rankings.the-elite.net/~p/time/%d' % stage[0]
+      return {url: truthsaver.TimeEntry(
+          url=url, time_id=stage[0], player='p', mode='Agent',
+          stage=stage[1], time=60, status=0)}
+
+    def fake_ltk(stage):
+      url = 'https://rankings.the-elite.net/goldeneye/ltk/%d' % stage[0]
+      return {url: truthsaver.TimeEntry(
+          url=url, time_id=stage[0], player='p', mode='LTK',
+          stage=stage[1], time=60, status=0)}
+
+    serial = truthsaver.TruthSaver(video_root=self.temp_dir)
+    threaded = truthsaver.TruthSaver(video_root=self.temp_dir,
+                                     crawl_workers=8)
+    results = []
+    for truth in (serial, threaded):
+      with patch.object(truth, 'get_regular_level_data',
+                        side_effect=fake_regular), \
+           patch.object(truth, 'get_ltk_level_data', side_effect=fake_ltk):
+        results.append(truth.get_all_time_entries())
+      self.assertEqual(list(truth.stage_errors), ['silo'])
+
+    # One regular and one LTK time for each stage but the failed one.
+    self.assertEqual(len(results[0]), 78)
+    self.assertEqual(list(results[0].items()), list(results[1].items()))
+
+  @patch('requests.Session.get', side_effect=mock_request_get)
+  def testWatermarks(self, mock_get):
+    with open(os.path.join(TEST_DIR, 'test_data.json')) as json_file:
+      ge_data = json.load(json_file)
+    truth = truthsaver.TruthSaver(video_root=self.temp_dir)
+    all_times = truth.stage_data_to_times((19, 'aztec'), ge_data)
+    all_silo = truth.get_ltk_level_data((6, 'silo'))
+
+    truth.watermarks = truth.get_watermarks(
+        list(all_times.values()) + list(all_silo.values()))
+    self.assertEqual(truth.watermarks['aztec']['SA'], 110547)
+    self.assertEqual(truth.stage_data_to_times((19, 'aztec'), ge_data), {})
+    self.assertEqual(truth.get_ltk_level_data((6, 'silo')), {})
+
+    truth.watermarks['aztec']['SA'] = 110356
+    new_times = truth.stage_data_to_times((19, 'aztec'), ge_data)
+    self.assertEqual(
+        sorted(e.time_id for e in new_times.values()), [110357, 110547])
+
+    truth.full_update = True
+    self.assertEqual(truth.get_ltk_level_data((6, 'silo')), all_silo)
+
+  def testUpdateRaisesWatermarks(self):
+    record_path = os.path.join(self.temp_dir, 'record.json')
+    with open(record_path, 'w') as fh:
+      fh.write('{}')
+    truth = truthsaver.TruthSaver(record_path=record_path,
+                                  video_root=self.temp_dir)
+    entry = truthsaver.TimeEntry(
+        url='https://rankings.the-elite.net/~Illu/time/20761',
+        time_id=20761, player='Illu', mode='Agent',
+        stage='defection', time=5, status=0)
+    with patch.object(truth, 'get_all_time_entries',
+                      return_value={entry.url: entry}):
+      truth.update_download_list()
+    self.assertEqual(truth.watermarks, {'defection': {'Agent': 20761}})
+    self.assertEqual(truth.get_saved_list(truth.record_path),
+                     {entry.url: entry})
+
+  @patch('requests.Session.get', side_effect=mock_request_get)
+  def testResolveLinks(self, mock_get):
+    record_path = os.path.join(self.temp_dir, 'record.json')
+    bb_entry = truthsaver.TimeEntry(
+        url='https://rankings.the-elite.net/~Big+Bossman/time/10',
+        time_id=10, player='Bryan Bosshardt', mode='Agent',
+        stage='dam', time=53, status=0)
+    tara_entry = truthsaver.TimeEntry(
+        url='https://rankings.the-elite.net/~Tara/time/113844',
+        time_id=11384, player='Tara Kate', mode='Agent',
+        stage='dam', time=53, status=0)
+    # Records saved before links were stored still load.
+    with open(record_path, 'w') as fh:
+      json.dump({e.url: list(e)[:7] for e in (bb_entry, tara_entry)}, fh)
+    truth = truthsaver.TruthSaver(record_path, video_root=self.temp_dir,
+                                  try_all=True)
+    self.assertEqual(truth.resolve_links(), 2)
+
+    saved = truthsaver.TruthSaver.get_saved_list(record_path)
+    self.assertEqual(saved[bb_entry.url].link,
+                     'https://www.youtube.com/watch?v=WA4jUsCRrfs')
+    self.assertIn('twitch', saved[tara_entry.url].link_error)
+    self.assertEqual(saved[tara_entry.url].status, truth.BAD_LINK)
+
+    # Stored links are reused until they are older than link_ttl.
+    mock_get.reset_mock()
+    truth = truthsaver.TruthSaver(record_path, video_root=self.temp_dir,
+                                  try_all=True)
+    self.assertEqual(truth.resolve_links(), 0)
+    self.assertEqual(truth.resolve_entry(saved[bb_entry.url]),
+                     'https://www.youtube.com/watch?v=WA4jUsCRrfs')
+    self.assertIsNone(truth.resolve_entry(saved[tara_entry.url]))
+    self.assertFalse(mock_get.called)
+    truth.link_ttl = 0
+    self.assertEqual(truth.resolve_links(), 2)
+    self.assertEqual(mock_get.call_count, 2)
+
+  @patch('time.sleep')
+  def testPytubeRetries(self, mock_sleep):
+    truthsaver.http_client.configure(max_tries=2)
+    self.addCleanup(truthsaver.http_client.configure,
+                    max_tries=truthsaver.http_client.MAX_TRIES)
+    with patch('pytube.YouTube', side_effect=IOError('reset')) as mock_yt:
+      self.assertRaises(IOError, truthsaver.pytubeRetry, 'https://youtu.be/')
+    self.assertEqual(mock_yt.call_count, 2)
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Tests for the work queue shared by several download processes."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from mock import patch
+
+from truthsaver import dedup
+from truthsaver import storage
+from truthsaver import truthsaver
+from truthsaver import work_queue
+
+from tests.helpers import make_entries
+
+
+class TestWorkQueue(unittest.TestCase):
+
+  def setUp(self):
+    self.temp_dir = tempfile.mkdtemp()
+    self.queue_path = os.path.join(self.temp_dir, 'queue.sqlite')
+
+  def tearDown(self):
+    shutil.rmtree(self.temp_dir)
+
+  def queue(self, worker_id, **kwargs):
+    queue = work_queue.WorkQueue(self.queue_path, worker_id=worker_id,
+                                 **kwargs)
+    self.addCleanup(queue.close)
+    return queue
+
+  def testLeases(self):
+    first = self.queue('first', lease_seconds=60)
+    second = self.queue('second', lease_seconds=60)
+    with patch('time.time', return_value=1000):
+      self.assertEqual(first.claim(['a', 'b', 'c']), {'a', 'b', 'c'})
+      self.assertEqual(second.claim(['b', 'c', 'd']), {'d'})
+      first.complete('a', 1)
+      first.release(['b'])
+      self.assertEqual(second.claim(['a', 'b']), {'b'})
+    with patch('time.time', return_value=1030):
+      self.assertEqual(first.renew(), 1)
+    # c was renewed, d expired and goes back to the pool.
+    with patch('time.time', return_value=1080):
+      self.assertEqual(first.claim(['c', 'd']), {'c', 'd'})
+    self.assertEqual(second.results(), {'a': 1})
+    first.release()
+    self.assertEqual(second.claim(['c', 'd']), {'c', 'd'})
+
+  def testClaimedBatches(self):
+    first = self.queue('first', claim_batch=2)
+    second = self.queue('second')
+    entries = make_entries(5)
+    second.claim([entries[1].url, entries[4].url])
+    self.assertEqual(list(first.claimed(iter(entries))),
+                     [entries[0], entries[2], entries[3]])
+
+  def testSharedPlacement(self):
+    roots = [os.path.join(self.temp_dir, name) for name in ('a', 'b')]
+    placed = []
+    # Each process sees only its own root as having free space.
+    for worker_id, free_root in (('first', roots[0]), ('second', roots[1])):
+      video_storage = storage.SharedVideoStorage(roots, self.queue(worker_id))
+      with patch.object(video_storage, 'free_bytes',
+                        side_effect=lambda root, free_root=free_root: (
+                            2**40 if root == free_root else 0)):
+        placed.append(video_storage.root_for('Player'))
+    self.assertEqual(placed, [roots[0], roots[0]])
+    self.assertEqual(self.queue('third').placement(), {'Player': roots[0]})
+
+  def testSharedVideoIndex(self):
+    path = os.path.join(self.temp_dir, 'video.mp4')
+    with open(path, 'wb') as fh:
+      fh.write(b'video')
+    first = dedup.SharedVideoIndex(self.temp_dir, self.queue('first'))
+    second = dedup.SharedVideoIndex(self.temp_dir, self.queue('second'))
+    with first.lock_for('QtvECUNjszU'):
+      # The video is leased to the first process while it downloads it.
+      self.assertFalse(second.queue.lease_video('QtvECUNjszU'))
+      first.add('QtvECUNjszU', path)
+    with second.lock_for('QtvECUNjszU'):
+      self.assertEqual(second.lookup('QtvECUNjszU'), path)
+    self.assertEqual(len(first), 1)
+    os.remove(path)
+    self.assertIsNone(first.lookup('QtvECUNjszU'))
+    self.assertEqual(len(second), 0)
+
+  def testSharedDownloads(self):
+    record_path = os.path.join(self.temp_dir, 'record.json')
+    entries = make_entries(6)
+    truthsaver.TruthSaver.save_entries(
+        record_path, {e.url: e for e in entries})
+    other = self.queue('other')
+    other.claim([e.url for e in entries[:2]])
+    other.complete(entries[0].url, truthsaver.TruthSaver.BAD_VIDEO)
+
+    truth = truthsaver.TruthSaver(record_path, video_root=self.temp_dir,
+                                  work_queue_path=self.queue_path)
+    self.addCleanup(truth.work_queue.close)
+    self.assertEqual(truth.saved_entries[entries[0].url].status,
+                     truthsaver.TruthSaver.BAD_VIDEO)
+    downloaded = []
+
+    def fake_download(link, entry):
+      if entry.url == entries[5].url:
+        raise IOError('connection reset')
+      downloaded.append(entry.url)
+      return 10
+
+    with patch.object(truth, 'get_yt_link',
+                      return_value='https://youtu.be/'), \
+        patch.object(truth, 'download_yt_video', side_effect=fake_download):
+      truth.download_videos()
+    self.assertEqual(downloaded, [e.url for e in entries[2:5]])
+
+    # The failed entry was released, the downloaded ones completed.
+    self.assertEqual(other.claim([entries[5].url]), {entries[5].url})
+    results = other.results()
+    self.assertEqual([results.get(e.url) for e in entries],
+                     [-2, None, 1, 1, 1, None])
+
+  def testTryAllReleasesSkipped(self):
+    record_path = os.path.join(self.temp_dir, 'record.json')
+    entries = make_entries(2)
+    entries[0] = entries[0]._replace(status=truthsaver.TruthSaver.BAD_VIDEO)
+    entries[1] = entries[1]._replace(status=truthsaver.TruthSaver.BAD_LINK)
+    truthsaver.TruthSaver.save_entries(
+        record_path, {e.url: e for e in entries})
+    truth = truthsaver.TruthSaver(record_path, video_root=self.temp_dir,
+                                  work_queue_path=self.queue_path,
+                                  try_all=True)
+    self.addCleanup(truth.work_queue.close)
+
+    with patch.object(truth, 'get_yt_link',
+                      return_value='https://youtu.be/'), \
+        patch.object(truth, 'download_yt_video',
+                     side_effect=IOError('connection reset')):
+      truth.download_videos()
+    # Both kept their old status, but neither was finished with it.
+    other = self.queue('other')
+    self.assertEqual(other.claim([e.url for e in entries]),
+                     set(e.url for e in entries))
+    self.assertEqual(other.results(), {})
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -4,8 +4,20 @@
 
 import argparse
 import atexit
+import json
+import logging
+import signal
 
-import truthsaver
+try:
+  from . import daemon
+  from . import profiling
+  from . import reconcile
+  from . import truthsaver
+except ImportError:
+  import daemon
+  import profiling
+  import reconcile
+  import truthsaver
 
 def main():
   parser = argparse.ArgumentParser()
@@ -16,39 +28,281 @@ def main():
   parser.add_argument('--download_only',
                       help='Only download saved times, no update.',
                       action='store_true')
+  parser.add_argument('--resolve_only',
+                      help='Only resolve and store the video links of saved'
+                      ' times, skip downloading.',
+                      action='store_true')
+  parser.add_argument('--watch',
+                      help='Keep running, polling each stage on its own'
+                      ' schedule and downloading new times as they are'
+                      ' found. --update_only only records them.',
+                      action='store_true')
+  parser.add_argument('--min_poll_interval', type=float,
+                      default=daemon.DEFAULT_MIN_INTERVAL / 60,
+                      help='Minutes between polls of the most active stages'
+                      ' with --watch.')
+  parser.add_argument('--max_poll_interval', type=float,
+                      default=daemon.DEFAULT_MAX_INTERVAL / 60,
+                      help='Minutes stages without new times back off to'
+                      ' with --watch.')
+  parser.add_argument('--reconcile',
+                      help='Before the run, scan --video_dir and mark the'
+                      ' times whose video is already there as downloaded.'
+                      ' Empty videos, and videos whose size differs from'
+                      ' the one in --events_path, are left pending.',
+                      action='store_true')
+  parser.add_argument('--reconcile_report', type=str,
+                      help='Path to write the --reconcile counts, orphan'
+                      ' videos, missing videos and incomplete videos to as'
+                      ' JSON.')
+  parser.add_argument('--reconcile_workers', type=int,
+                      default=reconcile.DEFAULT_WORKERS,
+                      help='Number of player directories scanned at once'
+                      ' by --reconcile.')
   parser.add_argument('--try_all',
                       help='Try to download all videos which are,'
                       ' not in a good status.',
                       action='store_true')
   parser.add_argument('--times_path',
-                      help='Path to ".json" or ".pkl" file containing a record'
-                      ' of saved time entries',
+                      help='Path to ".json", ".pkl", ".sqlite" or ".snap"'
+                      ' file containing a record of saved time entries',
                       type=str)
+  parser.add_argument('--migrate_to', type=str,
+                      help='Copy the --times_path record to this path, in the'
+                      ' format given by its extension, then exit.')
   parser.add_argument('--new_downloads_path', type=str,
                       help='Path to textfile containing all newly downloaded'
                       ' videos.')
+  parser.add_argument('--events_path', type=str,
+                      help='Path of a JSONL file each downloaded, failed or'
+                      ' skipped time is appended to as it happens.')
   parser.add_argument('--video_dir', help='Directory for were to save'
-                      ' downloaded videos.', type=str)
+                      ' downloaded videos. Repeat it to spread players over'
+                      ' several directories, e.g. one per disk.', type=str,
+                      action='append')
   parser.add_argument('--low_quality', help='Download lowest quality videos.',
                       action='store_true')
+  parser.add_argument('--max_resolution', type=int,
+                      help='Download the best stream at or below this many'
+                      ' lines, e.g. 480.')
+  parser.add_argument('--max_video_size', type=int,
+                      help='Skip streams advertising more than this many'
+                      ' bytes, videos without a smaller stream are marked'
+                      ' bad.')
+  parser.add_argument('--containers', type=str,
+                      default=','.join(truthsaver.streams.DEFAULT_CONTAINERS),
+                      help='Comma separated containers preferred between'
+                      ' streams of the same resolution, best first.')
+  parser.add_argument('--codecs', type=str,
+                      default=','.join(truthsaver.streams.DEFAULT_CODECS),
+                      help='Comma separated video codecs preferred between'
+                      ' streams of the same resolution and container, best'
+                      ' first.')
+  parser.add_argument('--no_dedup', action='store_true',
+                      help='Download every time\'s video, even when it was'
+                      ' already downloaded for another time.')
+  parser.add_argument('--crawl_workers', type=int,
+                      default=truthsaver.DEFAULT_CRAWL_WORKERS,
+                      help='Number of stages to fetch concurrently when'
+                      ' updating the times list.')
+  parser.add_argument('--cache_dir', type=str,
+                      default=truthsaver.DEFAULT_CACHE_DIR,
+                      help='Directory for caching stage pages between runs.')
+  parser.add_argument('--no_cache', action='store_true',
+                      help='Bypass the stage page cache.')
+  parser.add_argument('--http_pool_size', type=int,
+                      default=truthsaver.http_client.DEFAULT_POOL_SIZE,
+                      help='Number of keep-alive connections kept per host.')
+  parser.add_argument('--http_timeout', type=float,
+                      default=truthsaver.http_client.DEFAULT_TIMEOUT[1],
+                      help='Seconds to wait for a server response.')
+  parser.add_argument('--http_retries', type=int,
+                      default=truthsaver.http_client.MAX_TRIES,
+                      help='Max attempts for a request which fails with a'
+                      ' connection error, 429 or 5xx.')
+
+  parser.add_argument('--full_update', action='store_true',
+                      help='Check every time on the site, not only the ones'
+                      ' newer than the newest saved time of each stage.')
+  parser.add_argument('--compact_every', type=int,
+                      default=truthsaver.DEFAULT_COMPACT_EVERY,
+                      help='Rewrite the times record after this many'
+                      ' journaled status changes.')
+  parser.add_argument('--resolve_workers', type=int,
+                      default=truthsaver.DEFAULT_RESOLVE_WORKERS,
+                      help='Number of threads resolving video links.')
+  parser.add_argument('--download_workers', type=int,
+                      default=truthsaver.DEFAULT_DOWNLOAD_WORKERS,
+                      help='Max number of videos downloaded at once, the'
+                      ' number actually used adapts to errors and'
+                      ' throughput.')
+  parser.add_argument('--work_queue', type=str,
+                      help='Path to a SQLite work queue shared by several'
+                      ' processes downloading the same record, each'
+                      ' downloads only the times it claims.')
+  parser.add_argument('--lease_seconds', type=float,
+                      default=truthsaver.work_queue.DEFAULT_LEASE_SECONDS,
+                      help='Seconds a claimed time stays claimed by a'
+                      ' --work_queue process which stopped renewing it.')
+  parser.add_argument('--claim_batch', type=int,
+                      default=truthsaver.work_queue.DEFAULT_CLAIM_BATCH,
+                      help='Number of times claimed from the --work_queue'
+                      ' at once.')
+  parser.add_argument('--link_ttl_days', type=float,
+                      default=truthsaver.DEFAULT_LINK_TTL / (24 * 3600),
+                      help='Days before a stored video link is resolved'
+                      ' again.')
+  parser.add_argument('--priority', type=str,
+                      default=truthsaver.scheduler.INSERTION,
+                      choices=truthsaver.scheduler.PRIORITIES,
+                      help='Order to download pending times in: as saved,'
+                      ' newest first or the --top_n fastest times of each'
+                      ' stage first.')
+  parser.add_argument('--top_n', type=int,
+                      default=truthsaver.scheduler.DEFAULT_TOP_N,
+                      help='Number of fastest times per stage and mode'
+                      ' downloaded first with --priority=top_n.')
+  parser.add_argument('--watchlist', type=str,
+                      help='Comma separated players whose times are'
+                      ' downloaded before anyone else\'s.')
+  parser.add_argument('--max_runtime', type=float,
+                      help='Stop starting downloads after this many minutes.')
+  parser.add_argument('--max_bytes', type=int,
+                      help='Stop starting downloads after this many bytes'
+                      ' were downloaded.')
+  parser.add_argument('--max_videos', type=int,
+                      help='Download at most this many videos.')
+  parser.add_argument('--max_bytes_per_second', type=int,
+                      help='Cap the combined bandwidth of all video'
+                      ' downloads.')
+  parser.add_argument('--metrics_path', type=str,
+                      help='Path to write a JSON report of the run\'s'
+                      ' counters, latencies and throughput to.')
+  parser.add_argument('--prometheus_path', type=str,
+                      help='Path to write the run\'s metrics to in the'
+                      ' Prometheus textfile format.')
+  parser.add_argument('--profile', action='store_true',
+                      help='Write CPU and memory profiles of each phase of'
+                      ' the run to --profile_dir.')
+  parser.add_argument('--profile_dir', type=str,
+                      default='./truth_saver_profile_%s'
+                      % truthsaver.datetime_ts(),
+                      help='Directory for the --profile output.')
+  parser.add_argument('--profile_top_n', type=int,
+                      default=profiling.DEFAULT_TOP_N,
+                      help='Number of functions and allocation sites listed'
+                      ' per phase by --profile.')
+  parser.add_argument('--parser', type=str,
+                      choices=truthsaver.parsers.available_backends(),
+                      help='HTML parser backend, defaults to lxml when it is'
+                      ' installed.')
 
   args = parser.parse_args()
+  if args.migrate_to and not args.times_path:
+    parser.error('--migrate_to requires --times_path')
+
+  logging.basicConfig(
+      level=logging.INFO,
+      format='%(asctime)s %(name)-12s %(levelname)-8s %(message)s',
+      datefmt='%m-%d %H:%M',
+      filename='/tmp/truth_saver_%s.log' % truthsaver.datetime_ts(),
+      filemode='w')
+
+  if args.parser:
+    truthsaver.parsers.set_default_backend(args.parser)
+
+  truthsaver.http_client.configure(
+      pool_size=args.http_pool_size,
+      timeout=(truthsaver.http_client.DEFAULT_TIMEOUT[0], args.http_timeout),
+      max_tries=args.http_retries)
+
+  if args.migrate_to:
+    n_entries = truthsaver.TruthSaver.migrate_record(args.times_path,
+                                                     args.migrate_to)
+    print('Migrated %d entries to %s' % (n_entries, args.migrate_to))
+    return
+
+  profiler = profiling.Profiler(
+      args.profile_dir, top_n=args.profile_top_n, enabled=args.profile)
+  with profiler.phase('load'):
+    truth = truthsaver.TruthSaver(
+        record_path=args.times_path,
+        video_root=args.video_dir,
+        new_times_path=args.new_downloads_path,
+        update_only=args.update_only,
+        try_all=args.try_all,
+        low_quality=args.low_quality,
+        crawl_workers=args.crawl_workers,
+        cache_dir=None if args.no_cache else args.cache_dir,
+        full_update=args.full_update,
+        compact_every=args.compact_every,
+        resolve_workers=args.resolve_workers,
+        download_workers=args.download_workers,
+        link_ttl=args.link_ttl_days * 24 * 3600,
+        priority=args.priority,
+        top_n=args.top_n,
+        watchlist=([player.strip() for player in args.watchlist.split(',')]
+                   if args.watchlist else None),
+        max_runtime=(args.max_runtime * 60
+                     if args.max_runtime is not None else None),
+        max_bytes=args.max_bytes,
+        max_videos=args.max_videos,
+        max_bytes_per_second=args.max_bytes_per_second,
+        dedup_videos=not args.no_dedup,
+        max_resolution=args.max_resolution,
+        max_video_size=args.max_video_size,
+        containers=[c.strip() for c in args.containers.split(',')],
+        codecs=[c.strip() for c in args.codecs.split(',')],
+        work_queue_path=args.work_queue,
+        lease_seconds=args.lease_seconds,
+        claim_batch=args.claim_batch,
+        events_path=args.events_path)
 
-  truth = truthsaver.TruthSaver(
-      record_path=args.times_path,
-      video_root=args.video_dir,
-      new_times_path=args.new_downloads_path,
-      update_only=args.update_only,
-      try_all=args.try_all,
-      low_quality=args.low_quality)
-
-  if not args.download_only:
-    truth.update_download_list()
-  if not args.update_only:
-    atexit.register(truth.save)
-    truth.download_videos()
-  if args.new_downloads_path:
+  try:
+    if args.reconcile:
+      with profiler.phase('reconcile'):
+        report = reconcile.reconcile(truth, workers=args.reconcile_workers)
+      print('Found %d videos, marked %d times downloaded, %d orphan, %d'
+            ' missing and %d incomplete videos.'
+            % (report['videos'], report['marked_downloaded'],
+               len(report['orphans']), len(report['missing']),
+               len(report['incomplete'])))
+      if args.reconcile_report:
+        with open(args.reconcile_report, 'w') as fh:
+          json.dump(report, fh, indent=2, sort_keys=True)
+    if args.watch:
+      watch = daemon.WatchDaemon(
+          truth, min_interval=args.min_poll_interval * 60,
+          max_interval=args.max_poll_interval * 60,
+          download=not args.update_only)
+      signal.signal(signal.SIGTERM, lambda *_: watch.stop())
+      try:
+        with profiler.phase('watch', thread_phases={'resolver': 'resolve'}):
+          watch.run()
+      except KeyboardInterrupt:
+        print('')
+    else:
+      if not args.download_only:
+        with profiler.phase('update'):
+          truth.update_download_list()
+      if args.resolve_only:
+        with profiler.phase('resolve'):
+          truth.resolve_links()
+      elif not args.update_only:
+        atexit.register(truth.save)
+        with profiler.phase('download',
+                            thread_phases={'resolver': 'resolve'}):
+          truth.download_videos()
+        with profiler.phase('save'):
+          truth.save()
+        atexit.unregister(truth.save)
+  finally:
     truth.save_downloaded_paths()
+    truth.events.close()
+    truth.write_metrics(args.metrics_path, args.prometheus_path)
+    summary_path = profiler.write_summary()
+    if summary_path:
+      print('Wrote profiles to %s' % args.profile_dir)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Long running watch mode polling each stage on its own schedule."""
+
+import concurrent.futures
+import heapq
+import itertools
+import logging
+import queue
+import random
+import threading
+import time
+
+try:
+  from . import lazy
+  from . import pipeline
+  from . import truthsaver
+except ImportError:
+  import lazy
+  import pipeline
+  import truthsaver
+
+requests = lazy.LazyModule('requests')
+
+# Shortest and longest seconds between two polls of a stage
+DEFAULT_MIN_INTERVAL = 5 * 60
+DEFAULT_MAX_INTERVAL = 6 * 3600
+
+# Factor a stage's interval grows by after a poll finding nothing new
+BACKOFF_FACTOR = 1.5
+
+# Share of an interval a poll may randomly be moved by, so stages polled
+# together drift apart
+JITTER = 0.1
+
+# Queue priorities, new times are downloaded before the saved backlog
+_STOP, _NEW, _BACKLOG = range(3)
+
+
+class StageSchedule(object):
+  """When a stage is polled next and how often it had new times."""
+
+  def __init__(self, stage, interval, next_poll_at):
+    self.stage = stage
+    self.interval = interval
+    self.next_poll_at = next_poll_at
+    self.n_polls = 0
+    self.n_new = 0
+
+
+class WatchDaemon(object):
+  """Keeps a TruthSaver's record in memory, downloading new times as found.
+
+  Every stage is polled on its own interval, between min_interval and
+  max_interval seconds. A poll finding new times halves the stage's
+  interval, a poll finding nothing or failing multiplies it by
+  BACKOFF_FACTOR, so active stages are checked often and stale ones back
+  off. New entries are journaled as they are found and queued for the
+  download pipeline ahead of the pending entries saved before the daemon
+  started. Due stages are polled by truth.crawl_workers threads. The record
+  is compacted by the journal as usual and saved once run() returns.
+
+  run() returns once stop() is called or truth.budget is used up.
+  """
+
+  def __init__(self, truth, min_interval=DEFAULT_MIN_INTERVAL,
+               max_interval=DEFAULT_MAX_INTERVAL, download=True):
+    self.truth = truth
+    self.min_interval = min_interval
+    self.max_interval = max(min_interval, max_interval)
+    self.download = download
+    self._stop = threading.Event()
+    self._lock = threading.Lock()
+    self._feed = queue.PriorityQueue()
+    self._feed_order = itertools.count()
+    self._downloads = None
+    now = time.time()
+    # Every stage is due at once, so the first cycle is a full sweep.
+    self.schedules = {
+        stage[1]: StageSchedule(stage, min_interval, now)
+        for game in truthsaver.GAMES for stage in truthsaver.STAGES[game]}
+    self._heap = [(schedule.next_poll_at, name)
+                  for name, schedule in self.schedules.items()]
+    heapq.heapify(self._heap)
+
+  def _jitter(self, interval):
+    return interval * (1 + random.uniform(-JITTER, JITTER))
+
+  def _reschedule(self, schedule, n_new, now):
+    schedule.n_polls += 1
+    if n_new:
+      schedule.n_new += n_new
+      schedule.interval = max(self.min_interval, schedule.interval / 2.0)
+    else:
+      schedule.interval = min(self.max_interval,
+                              schedule.interval * BACKOFF_FACTOR)
+    schedule.next_poll_at = now + self._jitter(schedule.interval)
+    with self._lock:
+      heapq.heappush(self._heap, (schedule.next_poll_at, schedule.stage[1]))
+
+  def poll_stage(self, schedule, now=None):
+    """Fetches a stage, adds and queues its new entries, returns how many."""
+
+    truth = self.truth
+    stage = schedule.stage
+    n_new = 0
+    try:
+      times = truth.get_stage_entries(stage)
+    except (requests.exceptions.RequestException, ValueError) as e:
+      logging.error('Failed to poll stage %s: %r', stage[1], e)
+      truth.metrics.count('poll_errors', **truthsaver.stage_labels(
+          stage, 'all'))
+    else:
+      for url, entry in sorted(times.items(), key=lambda t: t[1].time_id):
+        if url in truth.saved_entries:
+          continue
+        truth.add_entry(entry)
+        self._feed.put((_NEW, next(self._feed_order), entry))
+        n_new += 1
+    self._reschedule(schedule, n_new, time.time() if now is None else now)
+    logging.info('Stage %s: %d new times, next poll in %ds', stage[1], n_new,
+                 schedule.interval)
+    return n_new
+
+  def poll_due(self, now=None):
+    """Polls every stage due by now, returns the number of new entries."""
+
+    now = time.time() if now is None else now
+    due = []
+    with self._lock:
+      while self._heap and self._heap[0][0] <= now:
+        due.append(self.schedules[heapq.heappop(self._heap)[1]])
+    if len(due) < 2:
+      return sum(self.poll_stage(schedule, now) for schedule in due)
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=self.truth.crawl_workers) as pool:
+      return sum(pool.map(lambda schedule: self.poll_stage(schedule, now),
+                          due))
+
+  def seconds_to_next_poll(self, now=None):
+    """Returns the seconds until the next stage is due."""
+
+    now = time.time() if now is None else now
+    with self._lock:
+      if not self._heap:
+        return self.max_interval
+      return max(0, self._heap[0][0] - now)
+
+  def _next_entry(self):
+    return self._feed.get()[2]
+
+  def start_downloads(self):
+    """Starts the download pipeline on the pending and newly found entries."""
+
+    truth = self.truth
+    for entry in truth.scheduler.order(
+        truth.saved_entries.with_status(*truth.pending_statuses()),
+        truth.saved_entries):
+      self._feed.put((_BACKLOG, next(self._feed_order), entry))
+    download_pipeline = pipeline.DownloadPipeline(
+        truth.resolve_download, truth.download_entry,
+        resolve_workers=truth.resolve_workers,
+        download_workers=truth.download_workers)
+    self._downloads = threading.Thread(
+        target=download_pipeline.run,
+        args=(truth.budget.limit(iter(self._next_entry, None)),),
+        name='watch-downloads')
+    self._downloads.daemon = True
+    self._downloads.start()
+
+  def run(self):
+    """Polls stages and downloads new times until stop() is called."""
+
+    if self.download:
+      self.start_downloads()
+    print('Watching %d stages, Ctrl-C to stop' % len(self.schedules))
+    try:
+      while not self._stop.is_set():
+        self.poll_due()
+        reason = self.truth.budget.used_up()
+        if reason:
+          print('Stopped, run budget used up: %s' % reason)
+          break
+        self._stop.wait(self.seconds_to_next_poll())
+    finally:
+      self._finish()
+
+  def stop(self):
+    """Makes run() return, safe to call from any thread or signal handler."""
+
+    self._stop.set()
+
+  def _finish(self):
+    """Waits for the downloads in flight, leaving the rest pending, saves."""
+
+    if self._downloads is not None:
+      self._feed.put((_STOP, 0, None))
+      self._downloads.join()
+      self._downloads = None
+    self.truth.save()
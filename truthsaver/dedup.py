@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Index of downloaded videos by YouTube id, shared between time entries.
+
+A player may link the same video from several times, e.g. one video of
+multiple stages. Once it is downloaded for one entry, the others get a
+hardlink to the same file, or a copy where the filesystem can not link.
+"""
+
+import contextlib
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+import urllib.parse
+
+# Name of the index file, kept in the root video directory
+INDEX_NAME = '.video_index.json'
+
+_VIDEO_ID = re.compile(r'^[A-Za-z0-9_-]{11}$')
+
+# Path prefixes of youtube.com links followed by the video id
+_ID_PATHS = ('/embed/', '/v/', '/shorts/', '/live/')
+
+# Seconds between checks whether another process finished a video
+LEASE_POLL_INTERVAL = 2
+
+
+def video_id(link):
+  """Returns the YouTube video id of a link, None if it has none."""
+
+  if not link:
+    return None
+  url = urllib.parse.urlsplit(link.strip())
+  host = url.netloc.lower().split(':')[0]
+  if host.startswith('www.') or host.startswith('m.'):
+    host = host.split('.', 1)[1]
+  candidate = None
+  if host == 'youtu.be':
+    candidate = url.path.strip('/').split('/')[0]
+  elif host in ('youtube.com', 'youtube-nocookie.com'):
+    if url.path == '/watch':
+      candidate = urllib.parse.parse_qs(url.query).get('v', [None])[0]
+    else:
+      for prefix in _ID_PATHS:
+        if url.path.startswith(prefix):
+          candidate = url.path[len(prefix):].split('/')[0]
+  if candidate and _VIDEO_ID.match(candidate):
+    return candidate
+  return None
+
+
+def link_file(src, dst):
+  """Hardlinks src to dst, copying it if a link is not possible.
+
+  dst only appears once complete. Returns True if a hardlink was made.
+  """
+
+  tmp_path = '%s.%d.tmp' % (dst, os.getpid())
+  try:
+    os.link(src, tmp_path)
+    linked = True
+  except OSError:
+    shutil.copy2(src, tmp_path)
+    linked = False
+  os.replace(tmp_path, dst)
+  return linked
+
+
+class VideoIndex(object):
+  """Thread safe map of YouTube id -> downloaded file, saved in video_root.
+
+  Paths are stored relative to video_root so the archive can be moved.
+  Hold lock_for(video_id) while looking up and downloading a video, so two
+  entries of the same video are not downloaded at once.
+  """
+
+  def __init__(self, video_root):
+    self.video_root = video_root
+    self.path = os.path.join(video_root, INDEX_NAME)
+    self._lock = threading.Lock()
+    self._id_locks = {}
+    self._files = {}
+    if os.path.exists(self.path):
+      try:
+        with open(self.path) as fh:
+          self._files = json.load(fh)
+      except ValueError as e:
+        logging.error('Ignoring unreadable video index %s: %r', self.path, e)
+
+  def __len__(self):
+    with self._lock:
+      return len(self._files)
+
+  def lock_for(self, vid_id):
+    """Returns the lock serializing downloads of one video."""
+
+    with self._lock:
+      return self._id_locks.setdefault(vid_id, threading.Lock())
+
+  def lookup(self, vid_id):
+    """Returns the path of the video's file, None if it is not downloaded.
+
+    Files deleted since they were indexed are dropped from the index.
+    """
+
+    with self._lock:
+      rel_path = self._files.get(vid_id)
+      if rel_path is None:
+        return None
+      path = os.path.join(self.video_root, rel_path)
+      if os.path.isfile(path):
+        return path
+      del self._files[vid_id]
+      self._save()
+    return None
+
+  def add(self, vid_id, path):
+    """Records path as the file of the video and saves the index."""
+
+    with self._lock:
+      self._files[vid_id] = os.path.relpath(path, self.video_root)
+      self._save()
+
+  def update(self, files):
+    """Records many video id -> path pairs, saving the index once."""
+
+    with self._lock:
+      for vid_id, path in files.items():
+        self._files[vid_id] = os.path.relpath(path, self.video_root)
+      self._save()
+
+  def _save(self):
+    tmp_path = '%s.%d.tmp' % (self.path, os.getpid())
+    with open(tmp_path, 'w') as fh:
+      json.dump(self._files, fh, sort_keys=True)
+    os.replace(tmp_path, self.path)
+
+
+class SharedVideoIndex(VideoIndex):
+  """VideoIndex kept in a work_queue.WorkQueue shared by several processes.
+
+  Paths are recorded in the queue as soon as a video is downloaded, and
+  lock_for(video_id) also leases the video in the queue, waiting while
+  another process downloads it. The index file is only read, to seed the
+  queue.
+  """
+
+  def __init__(self, video_root, queue):
+    super(SharedVideoIndex, self).__init__(video_root)
+    self.queue = queue
+    if self._files:
+      queue.set_video_paths(self._files, replace=False)
+
+  def __len__(self):
+    return self.queue.count_videos()
+
+  @contextlib.contextmanager
+  def lock_for(self, vid_id):
+    """Holds the video, in this process and in the queue, for the block."""
+
+    with super(SharedVideoIndex, self).lock_for(vid_id):
+      while not self.queue.lease_video(vid_id):
+        logging.info('Waiting for another process downloading video %s',
+                     vid_id)
+        time.sleep(LEASE_POLL_INTERVAL)
+      try:
+        yield
+      finally:
+        self.queue.release_video(vid_id)
+
+  def lookup(self, vid_id):
+    rel_path = self.queue.video_path(vid_id)
+    if rel_path is None:
+      return None
+    path = os.path.join(self.video_root, rel_path)
+    if os.path.isfile(path):
+      return path
+    self.queue.forget_video(vid_id, rel_path)
+    return None
+
+  def update(self, files):
+    self.queue.set_video_paths({
+        vid_id: os.path.relpath(path, self.video_root)
+        for vid_id, path in files.items()})
+
+  def add(self, vid_id, path):
+    self.update({vid_id: path})
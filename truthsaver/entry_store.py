@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Compact column store for TimeEntry records with secondary indexes."""
+
+import array
+import bisect
+import collections.abc
+
+# Same value as TruthSaver.DOWNLOADED. The bulk of a record is downloaded so
+# this status is not kept in the status index, it would cost memory without
+# speeding anything up.
+DOWNLOADED = 1
+
+
+class EntryStore(collections.abc.MutableMapping):
+  """Mapping of url -> TimeEntry, stored column wise.
+
+  Player, mode and stage strings are interned in a single string table and
+  stored as ints, status is a signed byte and numbers live in arrays. A
+  TimeEntry is only materialized when one is read from the store. Resolved
+  links and link errors are kept in plain lists, as they are mostly None.
+
+  Rows are indexed by url, by status (except DOWNLOADED), by player and by
+  stage. Looking up every entry with a pending status costs the number of
+  pending entries, not the record size.
+
+  Entries keep their insertion order, replacing an entry keeps its place.
+  Deleted rows are left empty until they make up half of the rows, then the
+  columns are compacted in order.
+
+  entry_type must be the TimeEntry namedtuple, with the fields
+  (url, time_id, player, mode, stage, time, status, link, link_error,
+  resolved_at).
+  """
+
+  def __init__(self, entry_type, entries=None):
+    self.entry_type = entry_type
+    self._strings = []
+    self._string_ids = {}
+
+    self._urls = []
+    self._time_ids = array.array('q')
+    self._players = array.array('I')
+    self._modes = array.array('I')
+    self._stages = array.array('I')
+    self._times = array.array('q')
+    self._statuses = array.array('b')
+    self._links = []
+    self._link_errors = []
+    # 0 when the entry was never resolved
+    self._resolved_at = array.array('d')
+
+    self._rows = {}
+    self._by_status = {}
+    self._by_player = {}
+    self._by_stage = {}
+    # Number of deleted rows, whose url is None, not compacted yet
+    self._n_deleted = 0
+
+    if entries:
+      self.update(entries)
+
+  @classmethod
+  def from_rows(cls, entry_type, rows):
+    """Returns a store holding rows of (url, time_id, ...) fields."""
+
+    store = cls(entry_type)
+    for row in rows:
+      store.add_row(*row)
+    return store
+
+  def _intern(self, string):
+    string_id = self._string_ids.get(string)
+    if string_id is None:
+      string_id = len(self._strings)
+      self._strings.append(string)
+      self._string_ids[string] = string_id
+    return string_id
+
+  def _index_status(self, row, status):
+    if status != DOWNLOADED:
+      self._by_status.setdefault(status, set()).add(row)
+
+  def _unindex_status(self, row, status):
+    if status != DOWNLOADED:
+      rows = self._by_status[status]
+      rows.discard(row)
+      if not rows:
+        del self._by_status[status]
+
+  def _columns(self):
+    return ('_urls', '_time_ids', '_players', '_modes', '_stages', '_times',
+            '_statuses', '_links', '_link_errors', '_resolved_at')
+
+  def _entry(self, row):
+    strings = self._strings
+    return self.entry_type(
+        self._urls[row], self._time_ids[row], strings[self._players[row]],
+        strings[self._modes[row]], strings[self._stages[row]],
+        self._times[row], self._statuses[row], self._links[row],
+        self._link_errors[row], self._resolved_at[row] or None)
+
+  def add_row(self, url, time_id, player, mode, stage, time, status,
+              link=None, link_error=None, resolved_at=None):
+    """Adds or replaces the entry for url without building a TimeEntry."""
+
+    row = self._rows.get(url)
+    if row is not None:
+      self._replace_row(row, time_id, player, mode, stage, time, status,
+                        link, link_error, resolved_at)
+      return
+    row = len(self._urls)
+    player_id = self._intern(player)
+    stage_id = self._intern(stage)
+    self._urls.append(url)
+    self._time_ids.append(time_id)
+    self._players.append(player_id)
+    self._modes.append(self._intern(mode))
+    self._stages.append(stage_id)
+    self._times.append(int(time))
+    self._statuses.append(status)
+    self._links.append(link)
+    self._link_errors.append(link_error)
+    self._resolved_at.append(resolved_at or 0)
+    self._rows[url] = row
+    self._index_status(row, status)
+    self._by_player.setdefault(player_id, array.array('I')).append(row)
+    self._by_stage.setdefault(stage_id, array.array('I')).append(row)
+
+  def _unindex(self, index, key, row):
+    rows = index[key]
+    rows.remove(row)
+    if not rows:
+      del index[key]
+
+  def _replace_row(self, row, time_id, player, mode, stage, time, status,
+                   link, link_error, resolved_at):
+    """Updates row in place, moving it between the indexes that changed."""
+
+    for index, column, key in ((self._by_player, self._players, player),
+                               (self._by_stage, self._stages, stage)):
+      key_id = self._intern(key)
+      if column[row] != key_id:
+        self._unindex(index, column[row], row)
+        # Indexes are kept in row order.
+        bisect.insort(index.setdefault(key_id, array.array('I')), row)
+        column[row] = key_id
+    self._time_ids[row] = time_id
+    self._modes[row] = self._intern(mode)
+    self._times[row] = int(time)
+    self._links[row] = link
+    self._link_errors[row] = link_error
+    self._resolved_at[row] = resolved_at or 0
+    self._unindex_status(row, self._statuses[row])
+    self._statuses[row] = status
+    self._index_status(row, status)
+
+  def _remove_row(self, row):
+    """Removes row, leaving its slot empty until the store is compacted."""
+
+    del self._rows[self._urls[row]]
+    self._unindex_status(row, self._statuses[row])
+    self._unindex(self._by_player, self._players[row], row)
+    self._unindex(self._by_stage, self._stages[row], row)
+    self._urls[row] = None
+    self._links[row] = self._link_errors[row] = None
+    self._n_deleted += 1
+    if self._n_deleted * 2 >= len(self._urls):
+      self._compact()
+
+  def _compact(self):
+    """Drops the deleted rows, keeping the order of the others."""
+
+    kept = [row for row, url in enumerate(self._urls) if url is not None]
+    for name in self._columns():
+      column = getattr(self, name)
+      values = [column[row] for row in kept]
+      if isinstance(column, array.array):
+        values = array.array(column.typecode, values)
+      setattr(self, name, values)
+    self._n_deleted = 0
+    self._rows = {}
+    self._by_status = {}
+    self._by_player = {}
+    self._by_stage = {}
+    for row, url in enumerate(self._urls):
+      self._rows[url] = row
+      self._index_status(row, self._statuses[row])
+      self._by_player.setdefault(self._players[row],
+                                 array.array('I')).append(row)
+      self._by_stage.setdefault(self._stages[row],
+                                array.array('I')).append(row)
+
+  def __getitem__(self, url):
+    return self._entry(self._rows[url])
+
+  def __setitem__(self, url, entry):
+    if url != entry.url:
+      raise KeyError('Key %s does not match entry url %s' % (url, entry.url))
+    self.add_row(*entry)
+
+  def __delitem__(self, url):
+    self._remove_row(self._rows[url])
+
+  def __contains__(self, url):
+    return url in self._rows
+
+  def __iter__(self):
+    return iter([url for url in self._urls if url is not None])
+
+  def __len__(self):
+    return len(self._rows)
+
+  def get_status(self, url):
+    """Returns the status of the entry for url."""
+
+    return self._statuses[self._rows[url]]
+
+  def set_status(self, url, status):
+    """Sets the status of the entry for url in place."""
+
+    row = self._rows[url]
+    old_status = self._statuses[row]
+    if old_status != status:
+      self._unindex_status(row, old_status)
+      self._statuses[row] = status
+      self._index_status(row, status)
+
+  def set_link(self, url, link, link_error, resolved_at):
+    """Sets the resolved link or link error of the entry for url."""
+
+    row = self._rows[url]
+    self._links[row] = link
+    self._link_errors[row] = link_error
+    self._resolved_at[row] = resolved_at or 0
+
+  def count(self, status):
+    """Returns the number of entries with status."""
+
+    if status == DOWNLOADED:
+      return len(self) - sum(len(rows) for rows in self._by_status.values())
+    return len(self._by_status.get(status, ()))
+
+  def with_status(self, *statuses):
+    """Yields entries with one of statuses, in insertion order.
+
+    The matching rows are collected up front, so statuses may be changed
+    while iterating.
+    """
+
+    if DOWNLOADED in statuses:
+      rows = [row for row, status in enumerate(self._statuses)
+              if status in statuses and self._urls[row] is not None]
+    else:
+      rows = sorted(row for status in statuses
+                    for row in self._by_status.get(status, ()))
+    urls = [self._urls[row] for row in rows]
+    for url in urls:
+      if url in self._rows:
+        yield self[url]
+
+  def for_player(self, player):
+    """Returns all entries of a player."""
+
+    player_id = self._string_ids.get(player)
+    return [self._entry(row) for row in self._by_player.get(player_id, ())]
+
+  def for_stage(self, stage):
+    """Returns all entries of a stage."""
+
+    stage_id = self._string_ids.get(stage)
+    return [self._entry(row) for row in self._by_stage.get(stage_id, ())]
+
+  def rows(self):
+    """Yields every entry as a plain tuple of its fields."""
+
+    strings = self._strings
+    rows = zip(self._urls, self._time_ids,
+               (strings[i] for i in self._players),
+               (strings[i] for i in self._modes),
+               (strings[i] for i in self._stages),
+               self._times, self._statuses, self._links, self._link_errors,
+               (resolved_at or None for resolved_at in self._resolved_at))
+    return (row for row in rows if row[0] is not None)
+
+  def watermarks(self):
+    """Returns dictonary of stage -> mode -> highest time_id."""
+
+    marks = {}
+    for url, time_id, mode_id, stage_id in zip(
+        self._urls, self._time_ids, self._modes, self._stages):
+      if url is None:
+        continue
+      key = (stage_id, mode_id)
+      if time_id > marks.get(key, 0):
+        marks[key] = time_id
+    watermarks = {}
+    for (stage_id, mode_id), time_id in marks.items():
+      watermarks.setdefault(
+          self._strings[stage_id], {})[self._strings[mode_id]] = time_id
+    return watermarks
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Feed of download events, appended to a JSONL file and passed to hooks.
+
+Every entry a download run finishes with is one event, written and flushed
+as soon as it happens so other jobs can follow the file, e.g. with tail -f.
+Events are dictionaries of:
+  event: 'downloaded', 'failed' or 'skipped'
+  url, time_id, player, stage, mode, time: the time entry
+  status: the entry's status after the event
+  path: the video file, None unless downloaded
+  size: size in bytes of the video file, None unless downloaded
+  bytes: bytes downloaded, 0 for a video linked from another entry's file
+  seconds: duration of the download
+  error: why the entry failed or was skipped, None if downloaded
+  at: unix time of the event
+"""
+
+import json
+import logging
+import threading
+import time
+
+DOWNLOADED = 'downloaded'
+FAILED = 'failed'
+SKIPPED = 'skipped'
+
+
+def read_events(path):
+  """Yields the events of a feed file, skipping lines cut off mid write."""
+
+  with open(path) as fh:
+    for line in fh:
+      try:
+        yield json.loads(line)
+      except ValueError:
+        logging.warning('Skipping unreadable event in %s: %r', path, line)
+
+
+class EventFeed(object):
+  """Appends events to path, if given, and calls every hook with them.
+
+  Hooks are called with the event dictionary on the thread which emitted
+  it, usually a download thread, so they should hand long work off to
+  their own threads. A hook raising is logged and does not stop the run.
+  """
+
+  def __init__(self, path=None):
+    self.path = path
+    self._lock = threading.Lock()
+    self._hooks = []
+    self._fh = open(path, 'a') if path else None
+
+  def add_hook(self, hook):
+    """Calls hook(event) for every event from now on."""
+
+    with self._lock:
+      self._hooks.append(hook)
+
+  def remove_hook(self, hook):
+    with self._lock:
+      self._hooks.remove(hook)
+
+  def emit(self, event, **fields):
+    """Records an event of type event with fields, returns it."""
+
+    fields['event'] = event
+    fields['at'] = time.time()
+    with self._lock:
+      if self._fh is not None:
+        self._fh.write(json.dumps(fields, sort_keys=True) + '\n')
+        self._fh.flush()
+      hooks = list(self._hooks)
+    for hook in hooks:
+      try:
+        hook(fields)
+      except Exception:  # pylint: disable=broad-except
+        logging.exception('Download hook %r failed on %s', hook,
+                          fields.get('url'))
+    return fields
+
+  def close(self):
+    with self._lock:
+      if self._fh is not None:
+        self._fh.close()
+        self._fh = None
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""On-disk HTTP response cache driven by conditional GET validators."""
+
+import hashlib
+import json
+import logging
+import os
+import time
+
+try:
+  from . import lazy
+except ImportError:
+  import lazy
+
+requests = lazy.LazyModule('requests')
+
+# Cached responses not revalidated within this many seconds are dropped.
+DEFAULT_TTL = 7 * 24 * 3600
+
+# Maximum size of all cached files before the oldest are evicted.
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+
+class ResponseCache(object):
+  """Stores response bodies along with their ETag / Last-Modified headers.
+
+  Every url is kept as a single JSON file named after the sha1 of the url.
+  Besides the body the file may hold a parsed payload set by the caller, so a
+  304 Not Modified response can skip parsing the page altogether.
+
+  Entries which have not been revalidated within ttl seconds are discarded,
+  and once the cache grows over max_bytes the least recently validated
+  entries are evicted.
+  """
+
+  def __init__(self, cache_dir, ttl=DEFAULT_TTL, max_bytes=DEFAULT_MAX_BYTES):
+    self.cache_dir = cache_dir
+    self.ttl = ttl
+    self.max_bytes = max_bytes
+    if not os.path.isdir(self.cache_dir):
+      os.makedirs(self.cache_dir)
+
+  def _path(self, url):
+    digest = hashlib.sha1(url.encode('utf-8')).hexdigest()
+    return os.path.join(self.cache_dir, digest + '.json')
+
+  def _load(self, url):
+    path = self._path(url)
+    try:
+      with open(path, 'r') as fh:
+        entry = json.load(fh)
+    except (IOError, ValueError):
+      return None
+    if entry.get('url') != url:
+      return None
+    if time.time() - entry['validated_at'] > self.ttl:
+      logging.info('Cache entry for %s expired', url)
+      self._remove(path)
+      return None
+    return entry
+
+  def _store(self, url, entry):
+    path = self._path(url)
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+    with open(tmp_path, 'w') as fh:
+      json.dump(entry, fh)
+    os.replace(tmp_path, path)
+
+  @staticmethod
+  def _remove(path):
+    try:
+      os.remove(path)
+    except OSError:
+      pass
+
+  def conditional_headers(self, url):
+    """Returns the If-None-Match / If-Modified-Since headers for url."""
+
+    entry = self._load(url)
+    headers = {}
+    if entry:
+      if entry.get('etag'):
+        headers['If-None-Match'] = entry['etag']
+      if entry.get('last_modified'):
+        headers['If-Modified-Since'] = entry['last_modified']
+    return headers
+
+  def update(self, url, response):
+    """Records a fresh response, or resolves a 304 into the cached response.
+
+    Returns the response to use, which has from_cache set to True when the
+    body came from the cache. Returns None if the server answered 304 but the
+    cache entry no longer exists, in which case the request must be redone
+    without validators.
+    """
+
+    if response.status_code == 304:
+      entry = self._load(url)
+      if entry is None:
+        return None
+      entry['validated_at'] = time.time()
+      self._store(url, entry)
+      logging.info('Not modified, using cached %s', url)
+      return self._to_response(url, entry)
+
+    response.from_cache = False
+    etag = response.headers.get('ETag')
+    last_modified = response.headers.get('Last-Modified')
+    if response.status_code != 200 or not (etag or last_modified):
+      return response
+    self._store(url, {
+        'url': url,
+        'etag': etag,
+        'last_modified': last_modified,
+        'encoding': response.encoding,
+        'body': response.content.decode('latin-1'),
+        'validated_at': time.time(),
+        'parsed': None,
+    })
+    self.evict()
+    return response
+
+  def get_parsed(self, url):
+    """Returns the parsed payload stored for url, None if there is none."""
+
+    entry = self._load(url)
+    if entry is None:
+      return None
+    return entry.get('parsed')
+
+  def set_parsed(self, url, parsed):
+    """Stores a JSON serializable parsed payload for an already cached url."""
+
+    entry = self._load(url)
+    if entry is not None:
+      entry['parsed'] = parsed
+      self._store(url, entry)
+
+  def evict(self):
+    """Removes the least recently validated entries until under max_bytes."""
+
+    files = []
+    total = 0
+    for dir_entry in os.scandir(self.cache_dir):
+      if not dir_entry.name.endswith('.json'):
+        continue
+      try:
+        stat = dir_entry.stat()
+      except OSError:
+        continue
+      files.append((stat.st_mtime, stat.st_size, dir_entry.path))
+      total += stat.st_size
+    for _, size, path in sorted(files):
+      if total <= self.max_bytes:
+        break
+      logging.info('Evicting cached response %s', path)
+      self._remove(path)
+      total -= size
+
+  @staticmethod
+  def _to_response(url, entry):
+    response = requests.models.Response()
+    response.url = url
+    response.status_code = 200
+    response.encoding = entry['encoding']
+    response._content = entry['body'].encode('latin-1')
+    response.from_cache = True
+    return response
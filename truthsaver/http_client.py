@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Shared pooled HTTP session with a retry engine for all fetches."""
+
+import email.utils
+import logging
+import random
+import threading
+import time
+
+try:
+  from . import lazy
+except ImportError:
+  import lazy
+
+requests = lazy.LazyModule('requests')
+
+# Max number of attempts for a single request
+MAX_TRIES = 5
+
+# Number of keep-alive connections kept per host
+DEFAULT_POOL_SIZE = 10
+
+# (connect, read) timeouts in seconds
+DEFAULT_TIMEOUT = (10, 60)
+
+# Base and cap in seconds of the exponential backoff between attempts
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+
+# Response statuses which are worth retrying
+RETRY_STATUSES = frozenset([429, 500, 502, 503, 504])
+
+# Names of the requests.exceptions which are worth retrying
+RETRY_EXCEPTIONS = ('ConnectionError', 'Timeout')
+
+_config = {
+    'pool_size': DEFAULT_POOL_SIZE,
+    'timeout': DEFAULT_TIMEOUT,
+    'max_tries': MAX_TRIES,
+}
+_session = None
+_session_lock = threading.Lock()
+
+
+def configure(pool_size=None, timeout=None, max_tries=None):
+  """Sets the pool size, timeouts and retries used by the shared session."""
+
+  global _session
+  with _session_lock:
+    if pool_size is not None:
+      _config['pool_size'] = pool_size
+    if timeout is not None:
+      _config['timeout'] = timeout
+    if max_tries is not None:
+      _config['max_tries'] = max(1, max_tries)
+    if _session is not None:
+      _session.close()
+      _session = None
+
+
+def max_tries():
+  """Returns the number of tries set by configure()."""
+
+  return _config['max_tries']
+
+
+def retry_exceptions():
+  """Returns the connection level errors which are worth retrying."""
+
+  return tuple(getattr(requests.exceptions, name)
+               for name in RETRY_EXCEPTIONS)
+
+
+def get_session():
+  """Returns the process wide requests.Session, creating it on first use."""
+
+  global _session
+  with _session_lock:
+    if _session is None:
+      session = requests.Session()
+      adapter = requests.adapters.HTTPAdapter(
+          pool_connections=_config['pool_size'],
+          pool_maxsize=_config['pool_size'])
+      session.mount('http://', adapter)
+      session.mount('https://', adapter)
+      _session = session
+    return _session
+
+
+def parse_retry_after(value):
+  """Returns the seconds to wait given a Retry-After header, or None."""
+
+  if not value:
+    return None
+  try:
+    return max(0.0, float(value))
+  except ValueError:
+    pass
+  retry_date = email.utils.parsedate_tz(value)
+  if retry_date is None:
+    return None
+  return max(0.0, email.utils.mktime_tz(retry_date) - time.time())
+
+
+def backoff_delay(tries, retry_after=None):
+  """Returns seconds to sleep before attempt tries + 1.
+
+  Uses exponential backoff with full jitter, unless the server asked for a
+  specific delay through Retry-After.
+  """
+
+  if retry_after is not None:
+    return min(retry_after, BACKOFF_MAX)
+  return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2**(tries + 1)))
+
+
+def retry_call(func, retry_on, max_tries=None):
+  """Calls func until it stops raising one of retry_on, with backoff."""
+
+  max_tries = max_tries or _config['max_tries']
+  for tries in range(max_tries):
+    try:
+      return func()
+    except retry_on as e:
+      if tries + 1 == max_tries:
+        raise
+      delay = backoff_delay(tries)
+      logging.warning('Attempt %d failed with %r, retrying in %.1fs',
+                      tries + 1, e, delay)
+      time.sleep(delay)
+
+
+def get(url, headers=None, stream=False, max_tries=None, on_status=None):
+  """GETs url through the shared session retrying transient failures.
+
+  Connection errors, timeouts, 429 and 5xx responses are retried with
+  jittered exponential backoff, honoring Retry-After. Once out of attempts
+  the last error is raised, or the last bad response returned so callers
+  can raise_for_status() as usual. on_status(status_code) is called for
+  every response received, including the retried ones.
+  """
+
+  max_tries = max_tries or _config['max_tries']
+  session = get_session()
+  for tries in range(max_tries):
+    last_try = tries + 1 == max_tries
+    try:
+      response = session.get(url, headers=headers, stream=stream,
+                             timeout=_config['timeout'])
+    except retry_exceptions() as e:
+      if last_try:
+        raise
+      delay = backoff_delay(tries)
+      logging.warning('Error fetching %s: %r, retrying in %.1fs',
+                      url, e, delay)
+      time.sleep(delay)
+      continue
+
+    if on_status:
+      on_status(response.status_code)
+    if response.status_code not in RETRY_STATUSES or last_try:
+      return response
+    delay = backoff_delay(
+        tries, parse_retry_after(response.headers.get('Retry-After')))
+    logging.warning('Status %d fetching %s, retrying in %.1fs',
+                    response.status_code, url, delay)
+    response.close()
+    time.sleep(delay)
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Append-only journal of entry status transitions kept next to a record."""
+
+import json
+import logging
+import os
+import threading
+
+# Journal files live next to the record with this suffix appended.
+JOURNAL_SUFFIX = '.journal'
+
+# Bytes read at a time looking back for the end of the last whole line
+_TAIL_BLOCK = 4096
+
+
+class StatusJournal(object):
+  """Appends one JSON line of [url, status] per status transition.
+
+  Resolved links are journaled the same way, as [url, link] lines where link
+  is an object of the link, link_error and resolved_at fields, and new
+  entries as [url, fields] lines where fields is the list of the entry's
+  fields. Every line is flushed as it is written, so the transitions survive the
+  process being killed. Replaying the journal over the last saved record
+  restores the statuses, and truncate() is called once they have been
+  compacted into a new record snapshot.
+  """
+
+  def __init__(self, path, fsync=False):
+    self.path = path
+    self.fsync = fsync
+    self._fh = None
+    self._lock = threading.Lock()
+    self.n_appended = 0
+
+  @staticmethod
+  def path_for(record_path):
+    """Returns the journal path used for a record path."""
+
+    return record_path + JOURNAL_SUFFIX
+
+  def append(self, url, status):
+    """Appends a status transition, flushing it to the file."""
+
+    self._write(json.dumps([url, status]) + '\n')
+
+  def append_link(self, url, link, link_error, resolved_at):
+    """Appends the resolved link or link error of url."""
+
+    self._write(json.dumps([url, {'link': link, 'link_error': link_error,
+                                  'resolved_at': resolved_at}]) + '\n')
+
+  def append_entry(self, entry):
+    """Appends a new entry, given as a TimeEntry."""
+
+    self._write(json.dumps([entry.url, list(entry)]) + '\n')
+
+  def _write(self, line):
+    with self._lock:
+      if self._fh is None:
+        if os.path.exists(self.path):
+          self._drop_torn_line()
+        self._fh = open(self.path, 'a')
+      self._fh.write(line)
+      self._fh.flush()
+      if self.fsync:
+        os.fsync(self._fh.fileno())
+      self.n_appended += 1
+
+  def _drop_torn_line(self):
+    """Truncates a torn last line, so appends start on a line of their own."""
+
+    with open(self.path, 'rb+') as fh:
+      end = fh.seek(0, os.SEEK_END)
+      pos = end
+      while pos > 0:
+        start = max(0, pos - _TAIL_BLOCK)
+        fh.seek(start)
+        newline = fh.read(pos - start).rfind(b'\n')
+        if newline != -1:
+          pos = start + newline + 1
+          break
+        pos = start
+      if pos != end:
+        logging.warning('Dropping torn last line of journal %s', self.path)
+        fh.truncate(pos)
+
+  def replay(self):
+    """Yields the (url, status) transitions in the journal, oldest first.
+
+    Link changes are yielded as (url, dict of the link fields) and new
+    entries as (url, list of the entry fields). A torn last line, left by a
+    crash in the middle of a write, is skipped.
+    """
+
+    if not os.path.exists(self.path):
+      return
+    with open(self.path, 'r') as fh:
+      for n, line in enumerate(fh, 1):
+        try:
+          url, status = json.loads(line)
+        except ValueError:
+          logging.warning('Skipping corrupt line %d of journal %s',
+                          n, self.path)
+          continue
+        yield url, status
+
+  def truncate(self):
+    """Empties the journal, once its transitions are saved in the record."""
+
+    with self._lock:
+      if self._fh is not None:
+        self._fh.close()
+        self._fh = None
+      if os.path.exists(self.path):
+        os.remove(self.path)
+      self.n_appended = 0
+
+  def close(self):
+    with self._lock:
+      if self._fh is not None:
+        self._fh.close()
+        self._fh = None
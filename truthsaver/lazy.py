@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Modules imported on first use, keeping heavy dependencies off startup."""
+
+import importlib
+import importlib.util
+
+
+class LazyModule(object):
+  """Stands in for the module called name until an attribute is read.
+
+  The first attribute read imports the module, e.g.
+    requests = LazyModule('requests')
+    requests.get(url)  # requests is imported here
+  """
+
+  def __init__(self, name):
+    self.__dict__['_name'] = name
+    self.__dict__['_module'] = None
+
+  def _load(self):
+    module = self.__dict__['_module']
+    if module is None:
+      module = importlib.import_module(self.__dict__['_name'])
+      self.__dict__['_module'] = module
+    return module
+
+  def __getattr__(self, attr):
+    return getattr(self._load(), attr)
+
+  def __setattr__(self, attr, value):
+    setattr(self._load(), attr, value)
+
+  def __repr__(self):
+    return '<lazy module %r>' % self.__dict__['_name']
+
+
+def is_available(name):
+  """Returns True if module name can be imported, without importing it."""
+
+  try:
+    return importlib.util.find_spec(name) is not None
+  except (ImportError, ValueError):
+    return False
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Counters and latency histograms of a run, reported as JSON or Prometheus."""
+
+import contextlib
+import json
+import os
+import threading
+import time
+
+# Upper bounds in seconds of the latency histogram buckets
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+# Prefix of every metric name in the Prometheus textfile
+PROMETHEUS_PREFIX = 'truthsaver_'
+
+
+def _label_key(labels):
+  return tuple(sorted(labels.items()))
+
+
+class _Histogram(object):
+
+  def __init__(self):
+    self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+    self.count = 0
+    self.sum = 0.0
+
+  def observe(self, value):
+    for i, bound in enumerate(LATENCY_BUCKETS):
+      if value <= bound:
+        break
+    else:
+      i = len(LATENCY_BUCKETS)
+    self.counts[i] += 1
+    self.count += 1
+    self.sum += value
+
+  def cumulative(self):
+    """Returns (upper bound, count of observations <= it) pairs."""
+
+    total = 0
+    buckets = []
+    for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), self.counts):
+      total += count
+      buckets.append((bound, total))
+    return buckets
+
+
+class Metrics(object):
+  """Thread safe registry of labelled counters and latency histograms.
+
+  Metrics are identified by name and a set of keyword labels, e.g.
+  count('download_bytes', 1024, game='ge', stage='dam', mode='SA').
+  """
+
+  def __init__(self):
+    self.started_at = time.time()
+    self._lock = threading.Lock()
+    # name -> label key -> value
+    self._counters = {}
+    self._histograms = {}
+
+  def count(self, name, value=1, **labels):
+    """Adds value to a counter."""
+
+    key = _label_key(labels)
+    with self._lock:
+      counters = self._counters.setdefault(name, {})
+      counters[key] = counters.get(key, 0) + value
+
+  def observe(self, name, seconds, **labels):
+    """Records a latency in a histogram."""
+
+    key = _label_key(labels)
+    with self._lock:
+      histograms = self._histograms.setdefault(name, {})
+      if key not in histograms:
+        histograms[key] = _Histogram()
+      histograms[key].observe(seconds)
+
+  @contextlib.contextmanager
+  def timer(self, name, **labels):
+    """Times the block into histogram name, e.g. 'download_seconds'.
+
+    A block left with an exception also counts one error of the phase, e.g.
+    'download_errors'.
+    """
+
+    phase = name[:-len('_seconds')] if name.endswith('_seconds') else name
+    start = time.time()
+    try:
+      yield
+    except BaseException:
+      self.count(phase + '_errors', **labels)
+      raise
+    finally:
+      self.observe(name, time.time() - start, **labels)
+
+  def counter_value(self, name, **labels):
+    """Returns the value of a counter, summed over any labels not given."""
+
+    with self._lock:
+      return sum(value for key, value in self._counters.get(name, {}).items()
+                 if set(labels.items()) <= set(key))
+
+  def histogram_count(self, name, **labels):
+    """Returns the observations of a histogram, summed like counter_value."""
+
+    with self._lock:
+      return sum(histogram.count for key, histogram
+                 in self._histograms.get(name, {}).items()
+                 if set(labels.items()) <= set(key))
+
+  def throughput(self, bytes_name, seconds_name):
+    """Returns [(labels, bytes / second)] of a byte counter and a histogram.
+
+    The seconds are the summed latencies of the histogram with the same
+    labels, so it is the rate of each transfer, not of the whole run.
+    """
+
+    rates = []
+    with self._lock:
+      histograms = self._histograms.get(seconds_name, {})
+      for key, n_bytes in sorted(self._counters.get(bytes_name, {}).items()):
+        histogram = histograms.get(key)
+        if histogram and histogram.sum > 0:
+          rates.append((dict(key), n_bytes / histogram.sum))
+    return rates
+
+  def report(self):
+    """Returns every metric as a JSON serializable dictonary.
+
+    For every <phase>_bytes counter with a <phase>_seconds histogram the
+    throughput of the phase is included as well.
+    """
+
+    finished_at = time.time()
+    with self._lock:
+      counters = [{'name': name, 'labels': dict(key), 'value': value}
+                  for name, values in sorted(self._counters.items())
+                  for key, value in sorted(values.items())]
+      histograms = [{'name': name, 'labels': dict(key),
+                     'count': histogram.count, 'sum': histogram.sum,
+                     'buckets': [[str(bound), count] for bound, count
+                                 in histogram.cumulative()]}
+                    for name, values in sorted(self._histograms.items())
+                    for key, histogram in sorted(values.items())]
+      phases = [name[:-len('_bytes')] for name in sorted(self._counters)
+                if name.endswith('_bytes')
+                and name[:-len('_bytes')] + '_seconds' in self._histograms]
+    throughput = [{'name': phase, 'labels': labels, 'bytes_per_second': rate}
+                  for phase in phases for labels, rate
+                  in self.throughput(phase + '_bytes', phase + '_seconds')]
+    return {
+        'started_at': self.started_at,
+        'finished_at': finished_at,
+        'duration': finished_at - self.started_at,
+        'counters': counters,
+        'histograms': histograms,
+        'throughput': throughput,
+    }
+
+  def prometheus_text(self):
+    """Returns the metrics in the Prometheus text exposition format."""
+
+    def labels_text(labels, **extra):
+      labels = dict(labels, **extra)
+      if not labels:
+        return ''
+      return '{%s}' % ','.join(
+          '%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"')
+                       .replace('\n', '\\n'))
+          for k, v in sorted(labels.items()))
+
+    lines = []
+    with self._lock:
+      for name, values in sorted(self._counters.items()):
+        metric = PROMETHEUS_PREFIX + name + '_total'
+        lines.append('# TYPE %s counter' % metric)
+        for key, value in sorted(values.items()):
+          lines.append('%s%s %s' % (metric, labels_text(key), value))
+      for name, values in sorted(self._histograms.items()):
+        metric = PROMETHEUS_PREFIX + name
+        lines.append('# TYPE %s histogram' % metric)
+        for key, histogram in sorted(values.items()):
+          for bound, count in histogram.cumulative():
+            lines.append('%s_bucket%s %d' % (
+                metric, labels_text(key, le=bound), count))
+          lines.append('%s_sum%s %f' % (metric, labels_text(key),
+                                        histogram.sum))
+          lines.append('%s_count%s %d' % (metric, labels_text(key),
+                                          histogram.count))
+    return '\n'.join(lines) + '\n'
+
+  def write_json(self, path):
+    """Writes report() to path."""
+
+    _write_atomic(path, json.dumps(self.report(), indent=2, sort_keys=True))
+
+  def write_prometheus(self, path):
+    """Writes prometheus_text() to path, e.g. for a node exporter."""
+
+    _write_atomic(path, self.prometheus_text())
+
+
+def _write_atomic(path, text):
+  tmp_path = '%s.%d.tmp' % (path, os.getpid())
+  with open(tmp_path, 'w') as fh:
+    fh.write(text)
+  os.replace(tmp_path, path)
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Parser backends which only extract the elements TruthSaver reads.
+
+LTK stage pages only need the rows of each <table>, and time pages only need
+the links inside <p> tags. A backend exposes exactly those two lookups:
+
+  ltk_tables(html) -> [[(player, time_href, time_text), ...], ...]
+    One list per <table>, holding the rows which have a video link.
+  paragraph_links(html) -> [(link_text, href), ...]
+    Every <a href> inside a <p>, in document order.
+
+lxml is used when it is installed, otherwise BeautifulSoup with html.parser
+restricted by a SoupStrainer to the target elements.
+"""
+
+try:
+  from . import lazy
+except ImportError:
+  import lazy
+
+bs4 = lazy.LazyModule('bs4')
+lxml_html = lazy.LazyModule('lxml.html')
+_HAVE_LXML = lazy.is_available('lxml')
+
+
+def _class_xpath(class_name):
+  return ('.//*[contains(concat(" ", normalize-space(@class), " "), " %s ")]'
+          % class_name)
+
+
+class SoupBackend(object):
+  """BeautifulSoup html.parser backend, only building the target tags."""
+
+  name = 'html.parser'
+
+  def ltk_tables(self, html):
+    soup = bs4.BeautifulSoup(html, 'html.parser',
+                             parse_only=bs4.SoupStrainer('table'))
+    tables = []
+    for table in soup.find_all('table'):
+      rows = []
+      for tr in table.find_all('tr'):
+        if tr.find(class_='video-link'):
+          time_tag = tr.find(class_='time')
+          rows.append((tr.find(class_='user').text, time_tag['href'],
+                       time_tag.text))
+      tables.append(rows)
+    return tables
+
+  def paragraph_links(self, html):
+    soup = bs4.BeautifulSoup(html, 'html.parser',
+                             parse_only=bs4.SoupStrainer('p'))
+    return [(link.text, link['href'])
+            for tag in soup.find_all('p')
+            for link in tag.find_all('a', href=True)]
+
+
+class LxmlBackend(object):
+  """lxml backend, the page is parsed in C and queried with XPath."""
+
+  name = 'lxml'
+
+  _VIDEO_LINK = _class_xpath('video-link')
+  _USER = _class_xpath('user')
+  _TIME = _class_xpath('time')
+
+  def ltk_tables(self, html):
+    tables = []
+    for table in lxml_html.fromstring(html).iter('table'):
+      rows = []
+      for tr in table.iter('tr'):
+        if tr.xpath(self._VIDEO_LINK):
+          time_tag = tr.xpath(self._TIME)[0]
+          rows.append((tr.xpath(self._USER)[0].text_content(),
+                       time_tag.get('href'), time_tag.text_content()))
+      tables.append(rows)
+    return tables
+
+  def paragraph_links(self, html):
+    return [(link.text_content(), link.get('href'))
+            for tag in lxml_html.fromstring(html).iter('p')
+            for link in tag.iter('a') if link.get('href') is not None]
+
+
+BACKENDS = {
+    SoupBackend.name: SoupBackend,
+    LxmlBackend.name: LxmlBackend,
+}
+
+_instances = {}
+_default_name = LxmlBackend.name if _HAVE_LXML else SoupBackend.name
+
+
+def available_backends():
+  """Returns the names of the backends usable in this environment."""
+
+  return [name for name in sorted(BACKENDS)
+          if name != LxmlBackend.name or _HAVE_LXML]
+
+
+def set_default_backend(name):
+  """Sets the backend returned by get_backend() when given no name."""
+
+  global _default_name
+  get_backend(name)
+  _default_name = name
+
+
+def get_backend(name=None):
+  """Returns the parser backend called name, or the default backend."""
+
+  name = name or _default_name
+  if name not in available_backends():
+    raise ValueError('Parser backend must be one of %s given %s'
+                     % (', '.join(available_backends()), name))
+  if name not in _instances:
+    _instances[name] = BACKENDS[name]()
+  return _instances[name]
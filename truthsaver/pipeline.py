@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Two stage pipeline overlapping link resolution with video downloads."""
+
+import logging
+import queue
+import threading
+
+
+class DownloadPipeline(object):
+  """Resolves links and downloads videos on two separate pools of threads.
+
+  resolve(entry) returns the link to download or None to skip the entry,
+  download(entry, link) downloads it. Resolver threads feed resolved links
+  through a queue of at most queue_size items to the download threads, so
+  resolution runs ahead of the downloads without piling up. Links resolved
+  out of turn wait in a reorder buffer, so downloads start in the order of
+  entries whatever order the resolvers finish in.
+
+  on_done(n_done, entry) is called, one call at a time, once each entry is
+  skipped or downloaded. Both callables are expected to handle their own
+  errors; anything they raise stops the pipeline and is raised by run().
+  """
+
+  def __init__(self, resolve, download, resolve_workers=1, download_workers=1,
+               queue_size=None, on_done=None):
+    self.resolve = resolve
+    self.download = download
+    self.resolve_workers = max(1, resolve_workers)
+    self.download_workers = max(1, download_workers)
+    self.queue_size = queue_size or 2 * self.download_workers
+    self.on_done = on_done
+
+    self._done_lock = threading.Lock()
+    self._n_done = 0
+    # Entries resolved out of turn, keyed by feed index. The window bounds
+    # how far resolution runs ahead of the entry next in turn.
+    self._order_lock = threading.Lock()
+    self._resolved = {}
+    self._next_index = 0
+    self._window = threading.Semaphore(self.queue_size + self.resolve_workers)
+    self._stop = threading.Event()
+    self._errors = []
+
+  def _done(self, entry):
+    with self._done_lock:
+      self._n_done += 1
+      if self.on_done:
+        self.on_done(self._n_done, entry)
+
+  def _fail(self, entry, error):
+    logging.error('Stopping downloads, unexpected error on %s: %r',
+                  entry.url, error)
+    self._errors.append(error)
+    self._stop.set()
+
+  def _release(self, index, entry, link, links):
+    """Queues the resolved entries which are next in feed order.
+
+    An entry of None releases the place of an entry which failed.
+    """
+
+    with self._order_lock:
+      self._resolved[index] = (entry, link)
+      while self._next_index in self._resolved:
+        entry, link = self._resolved.pop(self._next_index)
+        self._next_index += 1
+        if link is not None:
+          links.put((entry, link))
+        elif entry is not None:
+          self._done(entry)
+        self._window.release()
+
+  def _resolver(self, entries, feed_lock, links):
+    while not self._stop.is_set():
+      self._window.acquire()
+      with feed_lock:
+        index, entry = next(entries, (None, None))
+      if entry is None:
+        self._window.release()
+        return
+      try:
+        link = self.resolve(entry)
+      except Exception as e:  # pylint: disable=broad-except
+        self._fail(entry, e)
+        self._release(index, None, None, links)
+        return
+      self._release(index, entry, link, links)
+
+  def _downloader(self, links):
+    while True:
+      item = links.get()
+      if item is None:
+        return
+      if self._stop.is_set():
+        continue
+      entry, link = item
+      try:
+        self.download(entry, link)
+      except Exception as e:  # pylint: disable=broad-except
+        self._fail(entry, e)
+        continue
+      self._done(entry)
+
+  def run(self, entries):
+    """Runs every entry through the pipeline, returns the number done."""
+
+    feed_lock = threading.Lock()
+    links = queue.Queue(maxsize=self.queue_size)
+    entries = enumerate(entries)
+    resolvers = [threading.Thread(target=self._resolver,
+                                  name='resolver-%d' % n,
+                                  args=(entries, feed_lock, links))
+                 for n in range(self.resolve_workers)]
+    downloaders = [threading.Thread(target=self._downloader,
+                                    name='downloader-%d' % n, args=(links,))
+                   for n in range(self.download_workers)]
+    for thread in resolvers + downloaders:
+      thread.daemon = True
+      thread.start()
+
+    try:
+      for thread in resolvers:
+        thread.join()
+      for _ in downloaders:
+        links.put(None)
+      for thread in downloaders:
+        thread.join()
+    except KeyboardInterrupt:
+      self._stop.set()
+      raise
+
+    if self._errors:
+      raise self._errors[0]
+    return self._n_done
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""CPU and memory profiles of each phase of a run.
+
+For every phase a cProfile dump (<phase>.prof, load it with pstats) and a
+tracemalloc snapshot (<phase>.tracemalloc, load it with
+tracemalloc.Snapshot.load) are written, along with <phase>.txt ranking the
+top functions by cumulative time and the top lines by memory allocated
+during the phase. summary.txt lists the wall time and memory of each phase.
+"""
+
+import contextlib
+import cProfile
+import io
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+
+# Number of functions and allocation sites listed per phase
+DEFAULT_TOP_N = 25
+
+# Frames kept per traced allocation
+TRACEMALLOC_FRAMES = 10
+
+
+class Profiler(object):
+  """Profiles phases of a run into out_dir, a no-op unless enabled.
+
+  Threads started during a phase are profiled as well. A thread whose name
+  starts with a prefix in thread_phases is counted towards the phase it is
+  mapped to instead, e.g. {'resolver': 'resolve'} profiles the resolver
+  threads of pipeline.DownloadPipeline as their own phase. On Python 3.12+
+  threads cannot have a profiler of their own, so mapped phases are not
+  written and their threads stay merged into the phase they were started
+  in.
+  """
+
+  def __init__(self, out_dir, top_n=DEFAULT_TOP_N, enabled=True):
+    self.out_dir = out_dir
+    self.top_n = top_n
+    self.enabled = enabled
+    # (phase, wall seconds, KiB allocated and still held, peak KiB)
+    self.phases = []
+    self._lock = threading.Lock()
+    if enabled and not os.path.isdir(out_dir):
+      os.makedirs(out_dir)
+
+  @contextlib.contextmanager
+  def phase(self, name, thread_phases=None):
+    """Profiles the block, and the threads it starts, as phase name."""
+
+    if not self.enabled:
+      yield
+      return
+
+    thread_profiles = []
+
+    def profile_thread(frame, event, arg):
+      sys.setprofile(None)
+      profile = cProfile.Profile()
+      try:
+        profile.enable()
+      except ValueError:
+        # Python 3.12+ allows one active profiler, which already sees every
+        # thread.
+        profile = None
+      with self._lock:
+        thread_profiles.append((threading.current_thread().name, profile))
+
+    if not tracemalloc.is_tracing():
+      tracemalloc.start(TRACEMALLOC_FRAMES)
+    if hasattr(tracemalloc, 'reset_peak'):
+      tracemalloc.reset_peak()
+    before = tracemalloc.take_snapshot()
+    start_memory = tracemalloc.get_traced_memory()[0]
+    profile = cProfile.Profile()
+    threading.setprofile(profile_thread)
+    start = time.time()
+    profile.enable()
+    try:
+      yield
+    finally:
+      profile.disable()
+      elapsed = time.time() - start
+      threading.setprofile(None)
+      memory, peak = tracemalloc.get_traced_memory()
+      after = tracemalloc.take_snapshot()
+      profiles = {name: [profile]}
+      merged = set()
+      for thread_name, thread_profile in thread_profiles:
+        phase_name = name
+        for prefix, mapped_name in (thread_phases or {}).items():
+          if thread_name.startswith(prefix):
+            phase_name = mapped_name
+        if thread_profile is None:
+          merged.add(phase_name)
+        else:
+          profiles.setdefault(phase_name, []).append(thread_profile)
+      for phase_name in sorted(merged - set(profiles)):
+        logging.info('Threads of phase %s are merged into phase %s, they '
+                     'cannot be profiled apart on this Python',
+                     phase_name, name)
+      for phase_name, phase_profiles in profiles.items():
+        self._write_phase(phase_name, phase_profiles, before, after)
+      self.phases.append((name, elapsed, (memory - start_memory) / 1024.0,
+                          peak / 1024.0))
+      logging.info('Profiled phase %s in %.2fs', name, elapsed)
+
+  def _write_phase(self, name, profiles, before, after):
+    stats = None
+    for profile in profiles:
+      profile.create_stats()
+      if not profile.stats:
+        continue
+      if stats is None:
+        stats = pstats.Stats(profile)
+      else:
+        stats.add(profile)
+    base = os.path.join(self.out_dir, name)
+    out = io.StringIO()
+    out.write('# %s: top %d functions by cumulative time\n'
+              % (name, self.top_n))
+    if stats is not None:
+      stats.dump_stats(base + '.prof')
+      stats.stream = out
+      stats.sort_stats('cumulative').print_stats(self.top_n)
+    after.dump(base + '.tracemalloc')
+    out.write('\n# %s: top %d lines by memory allocated\n'
+              % (name, self.top_n))
+    for stat in after.compare_to(before, 'lineno')[:self.top_n]:
+      out.write('%s\n' % stat)
+    with open(base + '.txt', 'w') as fh:
+      fh.write(out.getvalue())
+
+  def write_summary(self):
+    """Writes summary.txt of every phase profiled, returns its path."""
+
+    if not self.enabled:
+      return None
+    path = os.path.join(self.out_dir, 'summary.txt')
+    with open(path, 'w') as fh:
+      fh.write('%-12s %10s %14s %14s\n'
+               % ('phase', 'wall s', 'held KiB', 'peak KiB'))
+      for name, elapsed, held, peak in self.phases:
+        fh.write('%-12s %10.2f %14.1f %14.1f\n' % (name, elapsed, held, peak))
+    return path
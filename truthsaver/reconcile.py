@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Reconciles the record with the videos already in the video tree.
+
+Every video root is scanned once, each player directory by its own thread.
+What was found is cached in each root, keyed by each player directory's
+mtime, so directories which have not changed since the last scan are not
+listed again. Entries whose video exists are marked DOWNLOADED in bulk, and
+videos without an entry (orphans) and DOWNLOADED entries without a video
+(missing) are reported. Videos which are empty, or whose size differs from
+the one the event feed recorded when they were downloaded, are reported as
+incomplete and do not count as downloaded.
+"""
+
+import concurrent.futures
+import json
+import logging
+import os
+import time
+
+try:
+  from . import dedup
+  from . import events
+  from . import transfer
+except ImportError:
+  import dedup
+  import events
+  import transfer
+
+# Name of the scan cache, kept in the root video directory
+CACHE_NAME = '.tree_index.json'
+
+# Number of player directories scanned at once
+DEFAULT_WORKERS = 8
+
+# Suffixes of files which are not finished videos
+_SKIPPED_SUFFIXES = (transfer.PART_SUFFIX, '.tmp')
+
+
+def _is_video(name):
+  return not name.startswith('.') and not name.endswith(_SKIPPED_SUFFIXES)
+
+
+def _scan_dir(path):
+  """Returns [[name, size, mtime], ...] of the videos in a directory."""
+
+  files = []
+  with os.scandir(path) as it:
+    for entry in it:
+      if entry.is_file(follow_symlinks=False) and _is_video(entry.name):
+        stat = entry.stat(follow_symlinks=False)
+        files.append([entry.name, stat.st_size, stat.st_mtime])
+  return files
+
+
+def scan_tree(root, workers=DEFAULT_WORKERS, use_cache=True):
+  """Returns vid_path -> (path relative to root, size, mtime) of the videos.
+
+  vid_path is the path as returned by TimeEntry.vid_path(), the video's
+  path without its extension. Player directories whose mtime matches the
+  cache are taken from it, the rest are scanned by workers threads.
+  """
+
+  cache_path = os.path.join(root, CACHE_NAME)
+  cache = {}
+  if use_cache and os.path.exists(cache_path):
+    try:
+      with open(cache_path) as fh:
+        cache = json.load(fh)
+    except ValueError as e:
+      logging.error('Ignoring unreadable scan cache %s: %r', cache_path, e)
+
+  dirs = {}
+  top_files = []
+  with os.scandir(root) as it:
+    for entry in it:
+      if entry.is_dir(follow_symlinks=False):
+        if not entry.name.startswith('.'):
+          dirs[entry.name] = entry.stat(follow_symlinks=False).st_mtime_ns
+      elif entry.is_file(follow_symlinks=False) and _is_video(entry.name):
+        top_files.append(entry.name)
+  if top_files:
+    logging.info('Ignoring %d files outside of player directories',
+                 len(top_files))
+
+  listing = {}
+  stale = []
+  for name, mtime_ns in dirs.items():
+    cached = cache.get(name)
+    if cached and cached['mtime_ns'] == mtime_ns:
+      listing[name] = cached
+    else:
+      stale.append(name)
+  with concurrent.futures.ThreadPoolExecutor(
+      max_workers=max(1, workers)) as pool:
+    for name, files in zip(stale, pool.map(
+        lambda name: _scan_dir(os.path.join(root, name)), stale)):
+      listing[name] = {'mtime_ns': dirs[name], 'files': files}
+  logging.info('Scanned %d of %d player directories, %d were cached',
+               len(stale), len(dirs), len(dirs) - len(stale))
+
+  if use_cache and (stale or len(listing) != len(cache)):
+    tmp_path = '%s.%d.tmp' % (cache_path, os.getpid())
+    with open(tmp_path, 'w') as fh:
+      json.dump(listing, fh)
+    os.replace(tmp_path, cache_path)
+
+  videos = {}
+  for dir_name, listed in listing.items():
+    for name, size, mtime in listed['files']:
+      rel_path = os.path.join(dir_name, name)
+      videos.setdefault(os.path.splitext(rel_path)[0],
+                        (rel_path, size, mtime))
+  return videos
+
+
+def downloaded_sizes(events_path):
+  """Returns path -> size of the videos downloaded per an event feed file.
+
+  Paths are absolute, the last event of a path wins.
+  """
+
+  sizes = {}
+  if events_path and os.path.exists(events_path):
+    for event in events.read_events(events_path):
+      if event.get('event') == events.DOWNLOADED and event.get('path'):
+        sizes[os.path.abspath(event['path'])] = event.get('size')
+  return sizes
+
+
+def reconcile(truth, workers=DEFAULT_WORKERS, use_cache=True):
+  """Marks the entries of truth whose video exists DOWNLOADED.
+
+  Every root of truth.storage is scanned, player directories found are
+  pinned to their root and videos of entries with a stored link are added to
+  truth.video_index. Returns a report dictionary of the counts, and the
+  orphan, missing and incomplete video paths. With several roots orphans
+  are given by their full path.
+  """
+
+  start = time.time()
+  roots = truth.storage.roots
+  placement = truth.storage.placement()
+  videos = {}
+  new_placement = {}
+  for root in roots:
+    for vid_path, video in scan_tree(
+        root, workers=workers, use_cache=use_cache).items():
+      videos.setdefault(vid_path, (os.path.join(root, video[0]),) + video)
+      player_dirname = video[0].split(os.sep)[0]
+      if player_dirname not in placement:
+        new_placement.setdefault(player_dirname, root)
+  if new_placement:
+    truth.storage.pin(new_placement)
+  sizes = downloaded_sizes(truth.events.path)
+  found = []
+  missing = []
+  incomplete = []
+  indexed = {}
+  seen = set()
+  for entry in truth.saved_entries.values():
+    vid_path = entry.vid_path()
+    video = videos.get(vid_path)
+    if video is None:
+      if entry.status == truth.DOWNLOADED:
+        missing.append(vid_path)
+      continue
+    seen.add(vid_path)
+    known_size = sizes.get(os.path.abspath(video[0]))
+    if not video[2] or known_size not in (None, video[2]):
+      incomplete.append(vid_path)
+      continue
+    if entry.status != truth.DOWNLOADED:
+      found.append(entry.url)
+    vid_id = dedup.video_id(entry.link)
+    if vid_id and truth.video_index is not None:
+      indexed.setdefault(vid_id, video[0])
+  truth.set_entry_statuses(found, truth.DOWNLOADED)
+  if indexed:
+    truth.video_index.update(indexed)
+  orphans = sorted(videos[vid_path][0 if len(roots) > 1 else 1]
+                   for vid_path in set(videos) - seen)
+  report = {
+      'videos': len(videos),
+      'marked_downloaded': len(found),
+      'orphans': orphans,
+      'missing': sorted(missing),
+      'incomplete': sorted(incomplete),
+      'seconds': time.time() - start,
+  }
+  logging.info('Reconciled %d videos in %.1fs: %d marked downloaded, %d '
+               'orphans, %d missing, %d incomplete', len(videos),
+               report['seconds'], len(found), len(orphans), len(missing),
+               len(incomplete))
+  return report
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Orders pending downloads by priority and limits how much a run does."""
+
+import logging
+import threading
+import time
+
+# Priorities pending entries can be ordered by
+INSERTION = 'insertion'
+NEWEST = 'newest'
+TOP_N = 'top_n'
+PRIORITIES = (INSERTION, NEWEST, TOP_N)
+
+# Number of fastest times of each stage and mode put first by TOP_N
+DEFAULT_TOP_N = 10
+
+
+class Scheduler(object):
+  """Orders the entries a run should try, most wanted first.
+
+  INSERTION keeps the order of the record, NEWEST puts the highest time_id
+  first and TOP_N puts the pending times which are among the top_n fastest
+  of their stage and mode in the whole record first, followed by the rest
+  newest first. Entries of players in watchlist go before everyone else,
+  each group in priority order.
+  """
+
+  def __init__(self, priority=INSERTION, top_n=DEFAULT_TOP_N, watchlist=None):
+    if priority not in PRIORITIES:
+      raise ValueError('Unknown priority %s, expected one of %s'
+                       % (priority, ', '.join(PRIORITIES)))
+    self.priority = priority
+    self.top_n = top_n
+    self.watchlist = frozenset(watchlist or ())
+
+  def _ranks(self, entries, record=None):
+    """Returns url -> rank of the top_n fastest times of each stage and mode.
+
+    Times are ranked among every entry of their stage in record, or among
+    entries alone if no record is given.
+    """
+
+    if record is not None:
+      entries = [entry for stage in set(entry.stage for entry in entries)
+                 for entry in record.for_stage(stage)]
+    groups = {}
+    for entry in entries:
+      groups.setdefault((entry.stage, entry.mode), []).append(entry)
+    ranks = {}
+    for group in groups.values():
+      group.sort(key=lambda e: (e.time, e.time_id))
+      for rank, entry in enumerate(group[:self.top_n]):
+        ranks[entry.url] = rank
+    return ranks
+
+  def order(self, entries, record=None):
+    """Returns entries in the order they should be tried.
+
+    record is the store entries were taken from, see
+    entry_store.EntryStore. TOP_N ranks times against all of it.
+
+    With INSERTION priority and no watchlist entries are returned as given,
+    so an iterator streaming the record is not read into memory. Otherwise
+    they are sorted into a list.
+    """
+
+    if self.priority == INSERTION and not self.watchlist:
+      return entries
+    entries = list(entries)
+    if self.priority == NEWEST:
+      entries.sort(key=lambda e: -e.time_id)
+    elif self.priority == TOP_N:
+      ranks = self._ranks(entries, record)
+
+      def top_n_key(entry):
+        rank = ranks.get(entry.url)
+        if rank is not None:
+          return (0, rank, -entry.time_id)
+        return (1, 0, -entry.time_id)
+      entries.sort(key=top_n_key)
+    if self.watchlist:
+      # sort is stable, so each group keeps the priority order.
+      entries.sort(key=lambda e: e.player not in self.watchlist)
+    return entries
+
+
+class Budget(object):
+  """Limits the wall time, bytes and number of videos of a run.
+
+  Every limit left as None is unlimited. A download asks start() before it
+  begins and reports back with finish(), so downloads in flight always run
+  to completion and only new ones are refused. The byte limit is checked
+  against the downloads which have finished, so it may be overshot by the
+  downloads in flight. While the downloads in flight would make up the last
+  of max_videos, start() waits for one of them to finish instead of
+  refusing, so a failed one is replaced by the next entry.
+  """
+
+  def __init__(self, max_runtime=None, max_bytes=None, max_videos=None):
+    self.max_runtime = max_runtime
+    self.max_bytes = max_bytes
+    self.max_videos = max_videos
+    self.started_at = time.time()
+    self.n_bytes = 0
+    self.n_videos = 0
+    self._in_flight = 0
+    self._lock = threading.Lock()
+    self._finished = threading.Condition(self._lock)
+    self._reason = None
+
+  def _exhausted(self):
+    if self._reason:
+      return self._reason
+    if (self.max_runtime is not None
+        and time.time() - self.started_at >= self.max_runtime):
+      self._reason = 'ran for %ds' % self.max_runtime
+    elif self.max_bytes is not None and self.n_bytes >= self.max_bytes:
+      self._reason = 'downloaded %d bytes' % self.n_bytes
+    elif self.max_videos is not None and self.n_videos >= self.max_videos:
+      self._reason = 'downloaded %d videos' % self.n_videos
+    elif (self.max_videos is not None
+          and self.n_videos + self._in_flight >= self.max_videos):
+      # Not final, one of the downloads in flight may still fail.
+      return 'downloading the last of %d videos' % self.max_videos
+    if self._reason:
+      logging.info('Run budget used up, %s', self._reason)
+    return self._reason
+
+  def _seconds_left(self):
+    if self.max_runtime is None:
+      return None
+    return max(0, self.started_at + self.max_runtime - time.time())
+
+  def exhausted(self):
+    """Returns why the budget is used up, None while it is not."""
+
+    with self._lock:
+      return self._exhausted()
+
+  def used_up(self):
+    """Returns why the budget is used up for good, None while it is not.
+
+    Unlike exhausted() it is None while the last videos are downloading, as
+    one of them may still fail.
+    """
+
+    with self._lock:
+      self._exhausted()
+      return self._reason
+
+  def start(self):
+    """Returns True if another download may start, reserving it."""
+
+    with self._finished:
+      while self._exhausted():
+        if self._reason:
+          return False
+        self._finished.wait(self._seconds_left())
+      self._in_flight += 1
+      return True
+
+  def finish(self, n_bytes=0, downloaded=True):
+    """Releases a download started with start(), charging what it used."""
+
+    with self._finished:
+      self._in_flight -= 1
+      self.n_bytes += n_bytes
+      if downloaded:
+        self.n_videos += 1
+      self._finished.notify_all()
+
+  def limit(self, entries):
+    """Yields entries until the budget is used up for good."""
+
+    for entry in entries:
+      if self.used_up():
+        return
+      yield entry
@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Versioned binary record snapshots, memory mapped and decoded lazily.
+
+File layout, all integers little-endian:
+
+  header    magic, version and the offset / count of every section
+  meta      JSON object, holds the stage -> mode -> time_id watermarks
+  strings   u32 end offsets of every string, followed by the UTF-8 blob
+  records   fixed width records, string fields are indexes into strings
+  url index (u64 url hash, u32 record) pairs sorted by hash
+
+Opening a snapshot only reads the header and the meta section. Records and
+strings are decoded from the mapped file when an entry is read.
+"""
+
+import collections.abc
+import hashlib
+import json
+import mmap
+import struct
+
+MAGIC = b'TSNP'
+VERSION = 1
+
+_HEADER = struct.Struct('<4sHxxIIQQQQQ')
+# time_id, time, url, player, mode, stage, status, link, link_error,
+# resolved_at
+_RECORD = struct.Struct('<qqIIIIb3xIId')
+_STATUS_OFFSET = 32
+# String id stored for a missing link or link error
+_NO_STRING = 0xffffffff
+_INDEX = struct.Struct('<QI')
+_OFFSET = struct.Struct('<I')
+
+
+def url_hash(url):
+  digest = hashlib.sha1(url.encode('utf-8')).digest()
+  return struct.unpack('<Q', digest[:8])[0]
+
+
+def write_snapshot(fh, rows):
+  """Writes rows of (url, time_id, ..., resolved_at) fields to fh.
+
+  Rows without the link fields are written as never resolved.
+  """
+
+  strings = []
+  string_ids = {}
+
+  def intern(string):
+    if string is None:
+      return _NO_STRING
+    string_id = string_ids.get(string)
+    if string_id is None:
+      string_id = string_ids[string] = len(strings)
+      strings.append(string)
+    return string_id
+
+  records = bytearray()
+  index = []
+  watermarks = {}
+  for n, row in enumerate(rows):
+    url, time_id, player, mode, stage, time, status = row[:7]
+    link, link_error, resolved_at = tuple(row[7:]) or (None, None, None)
+    records += _RECORD.pack(time_id, int(time), intern(url), intern(player),
+                            intern(mode), intern(stage), status, intern(link),
+                            intern(link_error), resolved_at or 0)
+    index.append((url_hash(url), n))
+    stage_marks = watermarks.setdefault(stage, {})
+    if time_id > stage_marks.get(mode, 0):
+      stage_marks[mode] = time_id
+  index.sort()
+
+  meta = json.dumps({'watermarks': watermarks}).encode('utf-8')
+  blob = bytearray()
+  ends = bytearray()
+  for string in strings:
+    blob += string.encode('utf-8')
+    ends += _OFFSET.pack(len(blob))
+
+  meta_offset = _HEADER.size
+  strings_offset = meta_offset + len(meta)
+  records_offset = strings_offset + len(ends) + len(blob)
+  index_offset = records_offset + len(records)
+  fh.write(_HEADER.pack(MAGIC, VERSION, len(index), len(strings),
+                        meta_offset, len(meta), strings_offset,
+                        records_offset, index_offset))
+  fh.write(meta)
+  fh.write(ends)
+  fh.write(blob)
+  fh.write(records)
+  for url_hash_value, n in index:
+    fh.write(_INDEX.pack(url_hash_value, n))
+
+
+class SnapshotEntryStore(collections.abc.MutableMapping):
+  """Mapping of url -> TimeEntry read lazily from a snapshot file.
+
+  Changes are kept in memory on top of the mapped file: status changes of
+  snapshot records in a dictonary by record number, added or replaced
+  entries as TimeEntrys, and the numbers of the snapshot records which were
+  replaced or deleted. They are written out by saving a new snapshot.
+
+  entry_type must be the TimeEntry namedtuple, with the fields
+  (url, time_id, player, mode, stage, time, status, link, link_error,
+  resolved_at).
+  """
+
+  def __init__(self, entry_type, path):
+    self.entry_type = entry_type
+    self.path = path
+    with open(path, 'rb') as fh:
+      self._mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+    (magic, version, self._n_records, n_strings, meta_offset, meta_len,
+     self._strings_offset, self._records_offset,
+     self._index_offset) = _HEADER.unpack_from(self._mm, 0)
+    if magic != MAGIC:
+      raise ValueError('%s is not a TruthSaver snapshot' % path)
+    if version != VERSION:
+      raise ValueError('Unsupported snapshot version %d in %s, expected %d'
+                       % (version, path, VERSION))
+    self._blob_offset = self._strings_offset + n_strings * _OFFSET.size
+    self._meta = json.loads(
+        self._mm[meta_offset:meta_offset + meta_len].decode('utf-8'))
+
+    self._status_changes = {}
+    self._link_changes = {}
+    self._added = collections.OrderedDict()
+    self._removed = set()
+
+  def _string(self, string_id):
+    if string_id == _NO_STRING:
+      return None
+    end = _OFFSET.unpack_from(
+        self._mm, self._strings_offset + string_id * _OFFSET.size)[0]
+    start = 0
+    if string_id:
+      start = _OFFSET.unpack_from(
+          self._mm, self._strings_offset + (string_id - 1) * _OFFSET.size)[0]
+    return self._mm[self._blob_offset + start:
+                    self._blob_offset + end].decode('utf-8')
+
+  def _record(self, n):
+    return _RECORD.unpack_from(self._mm,
+                               self._records_offset + n * _RECORD.size)
+
+  def _url(self, n):
+    return self._string(self._record(n)[2])
+
+  def _entry(self, n):
+    (time_id, time, url, player, mode, stage, status, link, link_error,
+     resolved_at) = self._record(n)
+    link, link_error, resolved_at = self._link_changes.get(
+        n, (self._string(link), self._string(link_error), resolved_at or None))
+    return self.entry_type(
+        self._string(url), time_id, self._string(player), self._string(mode),
+        self._string(stage), time, self._status_changes.get(n, status), link,
+        link_error, resolved_at)
+
+  def _find(self, url):
+    """Returns the record number of url in the snapshot, or None."""
+
+    target = url_hash(url)
+    lo, hi = 0, self._n_records
+    while lo < hi:
+      mid = (lo + hi) // 2
+      if _INDEX.unpack_from(self._mm, self._index_offset
+                            + mid * _INDEX.size)[0] < target:
+        lo = mid + 1
+      else:
+        hi = mid
+    while lo < self._n_records:
+      url_hash_value, n = _INDEX.unpack_from(
+          self._mm, self._index_offset + lo * _INDEX.size)
+      if url_hash_value != target:
+        return None
+      if self._url(n) == url:
+        return None if n in self._removed else n
+      lo += 1
+    return None
+
+  def _statuses(self):
+    """Returns the status of every snapshot record, read in one pass."""
+
+    size = _RECORD.size
+    start = self._records_offset + _STATUS_OFFSET
+    statuses = bytes(self._mm[start:start + self._n_records * size:size])
+    return [status - 256 if status > 127 else status for status in statuses]
+
+  def _snapshot_rows(self):
+    """Yields the record number of every live snapshot record."""
+
+    for n in range(self._n_records):
+      if n not in self._removed:
+        yield n
+
+  def __getitem__(self, url):
+    if url in self._added:
+      return self._added[url]
+    n = self._find(url)
+    if n is None:
+      raise KeyError(url)
+    return self._entry(n)
+
+  def __setitem__(self, url, entry):
+    if url != entry.url:
+      raise KeyError('Key %s does not match entry url %s' % (url, entry.url))
+    if url not in self._added:
+      n = self._find(url)
+      if n is not None:
+        self._removed.add(n)
+    self._added[url] = entry
+
+  def __delitem__(self, url):
+    if url in self._added:
+      del self._added[url]
+      return
+    n = self._find(url)
+    if n is None:
+      raise KeyError(url)
+    self._removed.add(n)
+
+  def __contains__(self, url):
+    return url in self._added or self._find(url) is not None
+
+  def __iter__(self):
+    for n in self._snapshot_rows():
+      yield self._url(n)
+    for url in list(self._added):
+      yield url
+
+  def __len__(self):
+    return self._n_records - len(self._removed) + len(self._added)
+
+  def add_row(self, *row):
+    """Adds or replaces an entry given its fields."""
+
+    entry = self.entry_type(*row)
+    self[entry.url] = entry
+
+  def get_status(self, url):
+    """Returns the status of the entry for url."""
+
+    return self[url].status
+
+  def set_status(self, url, status):
+    """Sets the status of the entry for url."""
+
+    if url in self._added:
+      self._added[url] = self._added[url]._replace(status=status)
+      return
+    n = self._find(url)
+    if n is None:
+      raise KeyError(url)
+    self._status_changes[n] = status
+
+  def set_link(self, url, link, link_error, resolved_at):
+    """Sets the resolved link or link error of the entry for url."""
+
+    if url in self._added:
+      self._added[url] = self._added[url]._replace(
+          link=link, link_error=link_error, resolved_at=resolved_at)
+      return
+    n = self._find(url)
+    if n is None:
+      raise KeyError(url)
+    self._link_changes[n] = (link, link_error, resolved_at)
+
+  def count(self, status):
+    """Returns the number of entries with status."""
+
+    return sum(1 for _ in self._matching_rows((status,))) + sum(
+        entry.status == status for entry in self._added.values())
+
+  def _matching_rows(self, statuses):
+    for n, status in enumerate(self._statuses()):
+      status = self._status_changes.get(n, status)
+      if status in statuses and n not in self._removed:
+        yield n
+
+  def with_status(self, *statuses):
+    """Yields entries with one of statuses, only decoding those entries.
+
+    The matching records are collected up front, so statuses may be changed
+    while iterating.
+    """
+
+    rows = list(self._matching_rows(statuses))
+    added = [url for url, entry in self._added.items()
+             if entry.status in statuses]
+    for n in rows:
+      if n not in self._removed:
+        yield self._entry(n)
+    for url in added:
+      if url in self._added:
+        yield self._added[url]
+
+  def for_player(self, player):
+    """Returns all entries of a player."""
+
+    return [entry for entry in self.values() if entry.player == player]
+
+  def for_stage(self, stage):
+    """Returns all entries of a stage."""
+
+    return [entry for entry in self.values() if entry.stage == stage]
+
+  def rows(self):
+    """Yields every entry as a plain tuple of its fields."""
+
+    for n in self._snapshot_rows():
+      yield tuple(self._entry(n))
+    for entry in list(self._added.values()):
+      yield tuple(entry)
+
+  def watermarks(self):
+    """Returns dictonary of stage -> mode -> highest time_id."""
+
+    watermarks = {stage: dict(marks) for stage, marks
+                  in self._meta['watermarks'].items()}
+    for entry in self._added.values():
+      stage_marks = watermarks.setdefault(entry.stage, {})
+      if entry.time_id > stage_marks.get(entry.mode, 0):
+        stage_marks[entry.mode] = entry.time_id
+    return watermarks
+
+  def close(self):
+    self._mm.close()
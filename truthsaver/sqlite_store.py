@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""SQLite backed store of TimeEntry records."""
+
+import collections.abc
+import itertools
+import sqlite3
+import threading
+
+# Number of queued writes which are committed together in one transaction
+DEFAULT_BATCH_SIZE = 200
+
+# Number of rows fetched per query when streaming entries
+PAGE_SIZE = 500
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    url TEXT PRIMARY KEY,
+    time_id INTEGER NOT NULL,
+    player TEXT NOT NULL,
+    mode TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    time INTEGER NOT NULL,
+    status INTEGER NOT NULL,
+    link TEXT,
+    link_error TEXT,
+    resolved_at REAL
+);
+CREATE INDEX IF NOT EXISTS entries_status ON entries (status);
+CREATE INDEX IF NOT EXISTS entries_player ON entries (player);
+CREATE INDEX IF NOT EXISTS entries_stage_time_id
+    ON entries (stage, mode, time_id);
+"""
+
+# Columns added after the first version of the schema, with their types
+_ADDED_COLUMNS = (('link', 'TEXT'), ('link_error', 'TEXT'),
+                  ('resolved_at', 'REAL'))
+
+_COLUMNS = ('url, time_id, player, mode, stage, time, status, link, '
+            'link_error, resolved_at')
+
+_INSERT = ('INSERT OR REPLACE INTO entries (%s) '
+           'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)' % _COLUMNS)
+_UPDATE_STATUS = 'UPDATE entries SET status = ? WHERE url = ?'
+_UPDATE_LINK = ('UPDATE entries SET link = ?, link_error = ?, resolved_at = ? '
+                'WHERE url = ?')
+
+
+class SqliteEntryStore(collections.abc.MutableMapping):
+  """Mapping of url -> TimeEntry kept in a SQLite database.
+
+  Nothing is loaded up front, entries are read with queries as they are
+  needed. Writes are queued and committed in transactions of batch_size, or
+  when flush() is called. Reads flush the queue first so they always see
+  every write.
+
+  entry_type must be the TimeEntry namedtuple, with the fields
+  (url, time_id, player, mode, stage, time, status, link, link_error,
+  resolved_at). Databases written before the link columns existed are
+  upgraded when opened.
+  """
+
+  def __init__(self, entry_type, path, batch_size=DEFAULT_BATCH_SIZE):
+    self.entry_type = entry_type
+    self.path = path
+    self.batch_size = batch_size
+    self._lock = threading.RLock()
+    # Queued (sql, params) writes, in the order they were made.
+    self._pending = []
+    self._conn = sqlite3.connect(path, check_same_thread=False)
+    self._conn.executescript(_SCHEMA)
+    self._upgrade()
+    self._conn.commit()
+
+  def _upgrade(self):
+    columns = set(row[1] for row in
+                  self._conn.execute('PRAGMA table_info(entries)'))
+    for name, column_type in _ADDED_COLUMNS:
+      if name not in columns:
+        self._conn.execute('ALTER TABLE entries ADD COLUMN %s %s'
+                           % (name, column_type))
+
+  def _query(self, sql, params=()):
+    with self._lock:
+      self._flush()
+      return self._conn.execute(sql, params).fetchall()
+
+  def _flush(self):
+    if not self._pending:
+      return
+    with self._conn:
+      for sql, writes in itertools.groupby(self._pending, lambda w: w[0]):
+        self._conn.executemany(sql, [params for _, params in writes])
+    self._pending = []
+
+  def _queue(self, sql, params):
+    with self._lock:
+      self._pending.append((sql, params))
+      if len(self._pending) >= self.batch_size:
+        self._flush()
+
+  def flush(self):
+    """Commits every queued write."""
+
+    with self._lock:
+      self._flush()
+
+  def close(self):
+    with self._lock:
+      self._flush()
+      self._conn.close()
+
+  def add_row(self, url, time_id, player, mode, stage, time, status,
+              link=None, link_error=None, resolved_at=None):
+    """Adds or replaces the entry for url."""
+
+    self._queue(_INSERT, (url, time_id, player, mode, stage, int(time),
+                          status, link, link_error, resolved_at))
+
+  def add_rows(self, rows):
+    """Adds many rows in a single transaction."""
+
+    with self._lock:
+      self._flush()
+      with self._conn:
+        self._conn.executemany(
+            _INSERT, (tuple(self.entry_type(*row)) for row in rows))
+
+  def __getitem__(self, url):
+    rows = self._query('SELECT %s FROM entries WHERE url = ?' % _COLUMNS,
+                       (url,))
+    if not rows:
+      raise KeyError(url)
+    return self.entry_type(*rows[0])
+
+  def __setitem__(self, url, entry):
+    if url != entry.url:
+      raise KeyError('Key %s does not match entry url %s' % (url, entry.url))
+    self.add_row(*entry)
+
+  def __delitem__(self, url):
+    with self._lock:
+      self._flush()
+      with self._conn:
+        if not self._conn.execute('DELETE FROM entries WHERE url = ?',
+                                  (url,)).rowcount:
+          raise KeyError(url)
+
+  def __contains__(self, url):
+    return bool(self._query('SELECT 1 FROM entries WHERE url = ?', (url,)))
+
+  def __iter__(self):
+    for row in self._stream('1', ()):
+      yield row[0]
+
+  def __len__(self):
+    return self._query('SELECT COUNT(*) FROM entries')[0][0]
+
+  def _stream(self, where, params):
+    """Yields rows matching where a page at a time, in insertion order.
+
+    Pages are fetched by rowid so rows may be updated while streaming.
+    """
+
+    last_rowid = -1
+    while True:
+      page = self._query(
+          'SELECT rowid, %s FROM entries WHERE (%s) AND rowid > ? '
+          'ORDER BY rowid LIMIT %d' % (_COLUMNS, where, PAGE_SIZE),
+          tuple(params) + (last_rowid,))
+      for row in page:
+        yield row[1:]
+      if len(page) < PAGE_SIZE:
+        return
+      last_rowid = page[-1][0]
+
+  def get_status(self, url):
+    """Returns the status of the entry for url."""
+
+    return self[url].status
+
+  def set_status(self, url, status):
+    """Queues a status update of the entry for url."""
+
+    self._queue(_UPDATE_STATUS, (status, url))
+
+  def set_link(self, url, link, link_error, resolved_at):
+    """Queues an update of the resolved link or link error of url."""
+
+    self._queue(_UPDATE_LINK, (link, link_error, resolved_at, url))
+
+  def count(self, status):
+    """Returns the number of entries with status."""
+
+    return self._query('SELECT COUNT(*) FROM entries WHERE status = ?',
+                       (status,))[0][0]
+
+  def with_status(self, *statuses):
+    """Yields entries with one of statuses, in insertion order."""
+
+    where = 'status IN (%s)' % ', '.join('?' * len(statuses))
+    for row in self._stream(where, statuses):
+      yield self.entry_type(*row)
+
+  def for_player(self, player):
+    """Returns all entries of a player."""
+
+    return [self.entry_type(*row) for row in self._query(
+        'SELECT %s FROM entries WHERE player = ? ORDER BY rowid' % _COLUMNS,
+        (player,))]
+
+  def for_stage(self, stage):
+    """Returns all entries of a stage."""
+
+    return [self.entry_type(*row) for row in self._query(
+        'SELECT %s FROM entries WHERE stage = ? ORDER BY rowid' % _COLUMNS,
+        (stage,))]
+
+  def rows(self):
+    """Yields every entry as a plain tuple of its fields."""
+
+    return self._stream('1', ())
+
+  def watermarks(self):
+    """Returns dictonary of stage -> mode -> highest time_id."""
+
+    watermarks = {}
+    for stage, mode, time_id in self._query(
+        'SELECT stage, mode, MAX(time_id) FROM entries GROUP BY stage, mode'):
+      watermarks.setdefault(stage, {})[mode] = time_id
+    return watermarks
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Placement of player directories over several video roots.
+
+Each player's videos are kept together in one directory, on one of the
+roots. A player new to the archive is placed by rendezvous hashing weighted
+by each root's free space, so players spread over the roots in proportion
+to their free space, and a root filling up only takes fewer new players.
+Once placed a player is pinned to its root in the placement index, kept in
+the first root, so its later videos follow it there.
+"""
+
+import hashlib
+import json
+import logging
+import math
+import os
+import shutil
+import threading
+
+# Name of the placement index, kept in the first root
+INDEX_NAME = '.placement_index.json'
+
+# Free bytes a root must keep to be given new players
+DEFAULT_MIN_FREE = 1024**3
+
+
+def _score(key, root, weight):
+  digest = hashlib.sha1(('%s\0%s' % (root, key)).encode('utf-8')).digest()
+  # Uniform in (0, 1), never 0 or 1 so the log is finite and negative.
+  uniform = (int.from_bytes(digest[:8], 'big') + 1) / float(2**64 + 1)
+  return weight / -math.log(uniform)
+
+
+class VideoStorage(object):
+  """Maps player directories to one of roots, see the module docstring.
+
+  The first root also holds the archive's metadata files, e.g. this
+  index. Players already on a root, e.g. of an archive which had a single
+  root before, are pinned to it when first looked up.
+  """
+
+  def __init__(self, roots, min_free=DEFAULT_MIN_FREE):
+    if not roots:
+      raise ValueError('At least one video root is required')
+    self.roots = list(roots)
+    self.primary = self.roots[0]
+    self.min_free = min_free
+    self.path = os.path.join(self.primary, INDEX_NAME)
+    self._lock = threading.Lock()
+    self._placement = {}
+    for root in self.roots:
+      if not os.path.isdir(root):
+        os.makedirs(root)
+    if os.path.exists(self.path):
+      try:
+        with open(self.path) as fh:
+          self._placement = json.load(fh)
+      except ValueError as e:
+        logging.error('Ignoring unreadable placement index %s: %r',
+                      self.path, e)
+
+  def free_bytes(self, root):
+    """Returns the bytes free on the device of root."""
+
+    return shutil.disk_usage(root).free
+
+  def _place(self, player_dirname):
+    if len(self.roots) == 1:
+      return self.primary
+    for root in self.roots:
+      if os.path.isdir(os.path.join(root, player_dirname)):
+        return root
+    weights = {root: self.free_bytes(root) - self.min_free
+               for root in self.roots}
+    candidates = [root for root, weight in weights.items() if weight > 0]
+    if not candidates:
+      raise IOError('No video root has %d bytes free for %s'
+                    % (self.min_free, player_dirname))
+    return max(candidates,
+               key=lambda root: _score(player_dirname, root, weights[root]))
+
+  def root_for(self, player_dirname):
+    """Returns the root holding a player's directory, placing new players.
+
+    Raises IOError if the player is new and no root has min_free bytes.
+    """
+
+    with self._lock:
+      root = self._placement.get(player_dirname)
+      if root is not None and root in self.roots:
+        return root
+      root = self._place(player_dirname)
+      self._placement[player_dirname] = root
+      self._save()
+    logging.info('Placed player directory %s on %s', player_dirname, root)
+    return root
+
+  def player_dir(self, player_dirname):
+    """Returns the path of a player's directory, see root_for()."""
+
+    return os.path.join(self.root_for(player_dirname), player_dirname)
+
+  def pin(self, placement):
+    """Pins player directories to roots, given as player -> root."""
+
+    with self._lock:
+      self._placement.update(placement)
+      self._save()
+
+  def placement(self):
+    """Returns a copy of the player directory -> root index."""
+
+    with self._lock:
+      return dict(self._placement)
+
+  def _save(self):
+    tmp_path = '%s.%d.tmp' % (self.path, os.getpid())
+    with open(tmp_path, 'w') as fh:
+      json.dump(self._placement, fh, sort_keys=True)
+    os.replace(tmp_path, self.path)
+
+
+class SharedVideoStorage(VideoStorage):
+  """VideoStorage keeping its placements in a work_queue.WorkQueue.
+
+  A new player is looked up and placed in one transaction of the queue, so
+  processes sharing the queue place it on the same root even when they see
+  different free space. The index file is only read, to seed the queue.
+  """
+
+  def __init__(self, roots, queue, min_free=DEFAULT_MIN_FREE):
+    super(SharedVideoStorage, self).__init__(roots, min_free=min_free)
+    self.queue = queue
+    if self._placement:
+      queue.pin(self._placement, replace=False)
+    self._placement = queue.placement()
+
+  def root_for(self, player_dirname):
+    with self._lock:
+      root = self._placement.get(player_dirname)
+    if root is not None and root in self.roots:
+      return root
+
+    def place():
+      root = self._place(player_dirname)
+      logging.info('Placed player directory %s on %s', player_dirname, root)
+      return root
+
+    root = self.queue.place(player_dirname, place, self.roots)
+    with self._lock:
+      self._placement[player_dirname] = root
+    return root
+
+  def pin(self, placement):
+    self.queue.pin(placement)
+    with self._lock:
+      self._placement.update(placement)
+
+  def placement(self):
+    return self.queue.placement()
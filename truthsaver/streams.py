@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Picks the stream of a YouTube video to download.
+
+Streams are pytube stream objects. Only what they advertise is used, e.g.
+the size from the stream metadata, so choosing a stream makes no requests.
+"""
+
+import re
+
+# Containers and codecs preferred between streams of the same resolution,
+# most preferred first. Codecs match by prefix, e.g. 'avc1' matches
+# 'avc1.64001F'.
+DEFAULT_CONTAINERS = ('mp4', 'webm', '3gp', 'flv')
+DEFAULT_CODECS = ('avc1', 'vp9', 'vp8', 'av01')
+
+_RESOLUTION = re.compile(r'(\d+)p')
+
+
+class NoStreamError(ValueError):
+  """None of a video's streams are within the size cap."""
+
+
+def resolution(stream):
+  """Returns the vertical resolution of a stream as an int, 0 if unknown."""
+
+  match = _RESOLUTION.match(str(getattr(stream, 'resolution', None) or ''))
+  return int(match.group(1)) if match else 0
+
+
+def container(stream):
+  """Returns the container, i.e. file extension, of a stream."""
+
+  return (getattr(stream, 'extension', None)
+          or getattr(stream, 'subtype', None) or 'mp4')
+
+
+def advertised_size(stream):
+  """Returns the size in bytes a stream advertises, None if unknown.
+
+  Only plain attributes are read, pytube's filesize property may make a
+  request to find the size.
+  """
+
+  attrs = getattr(stream, '__dict__', {})
+  for name in ('_filesize', 'filesize'):
+    size = attrs.get(name)
+    if size:
+      return int(size)
+  return None
+
+
+def stream_key(stream):
+  """Returns a name telling a stream apart from the video's other streams.
+
+  It is the stream's itag, followed by its advertised size when known.
+  """
+
+  key = str(getattr(stream, 'itag', None) or '%dp' % resolution(stream))
+  size = advertised_size(stream)
+  return '%s-%d' % (key, size) if size else key
+
+
+def video_streams(yt_handle):
+  """Returns the streams holding both video and audio of a pytube handle."""
+
+  videos = getattr(yt_handle, 'videos', None)
+  if videos is not None:
+    return list(videos)
+  return list(yt_handle.streams.filter(progressive=True))
+
+
+def _rank(preferred, value):
+  for i, prefix in enumerate(preferred):
+    if value and value.startswith(prefix):
+      return i
+  return len(preferred)
+
+
+class StreamPolicy(object):
+  """Chooses the stream to download out of those of a video.
+
+  The highest resolution at or below max_resolution is chosen, the lowest
+  resolution if lowest is set. If every stream is above max_resolution the
+  lowest one is chosen. Streams advertising more than max_size bytes are
+  skipped. Between streams of the same resolution the earliest of
+  containers, then of codecs, wins, then the smallest.
+  """
+
+  def __init__(self, max_resolution=None, lowest=False, max_size=None,
+               containers=DEFAULT_CONTAINERS, codecs=DEFAULT_CODECS):
+    self.max_resolution = max_resolution
+    self.lowest = lowest
+    self.max_size = max_size
+    self.containers = tuple(containers or ())
+    self.codecs = tuple(codecs or ())
+
+  def _key(self, stream):
+    size = advertised_size(stream)
+    return (_rank(self.containers, container(stream)),
+            _rank(self.codecs, getattr(stream, 'video_codec', None)),
+            size if size is not None else float('inf'))
+
+  def select(self, streams):
+    """Returns the stream to download, raises NoStreamError if none fit."""
+
+    streams = list(streams)
+    if not streams:
+      raise NoStreamError('Video has no streams')
+    fitting = [s for s in streams if self.max_size is None
+               or (advertised_size(s) or 0) <= self.max_size]
+    if not fitting:
+      raise NoStreamError('Every stream of the video is over %d bytes'
+                          % self.max_size)
+    allowed = [s for s in fitting if self.max_resolution is None
+               or resolution(s) <= self.max_resolution]
+    if allowed and not self.lowest:
+      best = max(resolution(s) for s in allowed)
+    else:
+      best = min(resolution(s) for s in (allowed or fitting))
+    return min((s for s in (allowed or fitting) if resolution(s) == best),
+               key=self._key)
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Bandwidth cap and adaptive concurrency limit shared by video downloads."""
+
+import logging
+import threading
+import time
+
+# Share of transfers in a round which may fail before concurrency is cut
+MAX_ERROR_RATE = 0.2
+
+# Factor the concurrency limit is multiplied by on errors or throttling
+DECREASE_FACTOR = 0.5
+
+# Relative throughput gain expected from one more concurrent transfer
+MIN_GAIN = 0.1
+
+
+class TokenBucket(object):
+  """Caps the rate of bytes consumed across every thread to rate per second.
+
+  Up to burst bytes, one second worth by default, may be consumed at once.
+  Past that consume() sleeps the calling thread until the bucket refills.
+  """
+
+  def __init__(self, rate, burst=None):
+    self.rate = float(rate)
+    self.burst = float(burst or rate)
+    self._tokens = self.burst
+    self._updated_at = time.time()
+    self._lock = threading.Lock()
+
+  def consume(self, n_bytes):
+    """Takes n_bytes out of the bucket, sleeping off any deficit."""
+
+    with self._lock:
+      now = time.time()
+      self._tokens = min(self.burst, self._tokens
+                         + (now - self._updated_at) * self.rate)
+      self._updated_at = now
+      self._tokens -= n_bytes
+      deficit = -self._tokens
+    if deficit > 0:
+      time.sleep(deficit / self.rate)
+
+
+class _Slot(object):
+  """A transfer holding a slot of an AimdController, see transfer()."""
+
+  def __init__(self, controller):
+    self.controller = controller
+    self.n_bytes = 0
+
+  def __enter__(self):
+    self.controller.acquire()
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.controller.release(self.n_bytes, error=exc_type is not None)
+    return False
+
+
+class AimdController(object):
+  """Adapts the number of concurrent transfers to what the network allows.
+
+  Transfers take a slot with transfer(), at most self.limit run at once.
+  Each round of self.limit finished transfers the limit is adjusted, as
+  TCP adjusts its window: it is multiplied by DECREASE_FACTOR if a 429 was
+  seen or more than MAX_ERROR_RATE of the transfers failed, and grows by one
+  otherwise. If the last increase did not raise the throughput by MIN_GAIN
+  the limit steps back down by one and stays below that level, until the
+  next decrease lets it probe again. Every change is logged.
+
+  When bytes_per_second is given, self.bucket is a TokenBucket holding all
+  transfers to that rate.
+  """
+
+  def __init__(self, max_limit, min_limit=1, initial=None,
+               bytes_per_second=None):
+    self.max_limit = max(1, max_limit)
+    self.min_limit = max(1, min(min_limit, self.max_limit))
+    self.limit = initial or max(self.min_limit, self.max_limit // 2)
+    self.bucket = TokenBucket(bytes_per_second) if bytes_per_second else None
+    self._active = 0
+    self._cond = threading.Condition()
+    # Limit no increase may reach, set when adding a transfer did not help.
+    self._ceiling = None
+    self._last_round = None
+    self._new_round()
+
+  def _new_round(self):
+    self._round_started_at = time.time()
+    self._round_done = 0
+    self._round_bytes = 0
+    self._round_errors = 0
+    self._round_throttled = 0
+
+  def transfer(self):
+    """Returns a context manager holding a slot for one transfer.
+
+    Set n_bytes on it to the bytes transferred, leaving the block with an
+    exception counts the transfer as failed.
+    """
+
+    return _Slot(self)
+
+  def acquire(self):
+    """Blocks until fewer than self.limit transfers are running."""
+
+    with self._cond:
+      while self._active >= self.limit:
+        self._cond.wait()
+      self._active += 1
+
+  def release(self, n_bytes, error=False):
+    """Records a finished transfer, adjusting the limit once a round ends."""
+
+    with self._cond:
+      self._active -= 1
+      self._round_done += 1
+      self._round_bytes += n_bytes
+      if error:
+        self._round_errors += 1
+      if self._round_done >= self.limit:
+        self._adjust()
+      self._cond.notify_all()
+
+  def on_status(self, status_code):
+    """Records a response status, to be passed on to http_client.get."""
+
+    if status_code == 429:
+      with self._cond:
+        self._round_throttled += 1
+
+  def _adjust(self):
+    elapsed = max(time.time() - self._round_started_at, 1e-6)
+    throughput = self._round_bytes / elapsed
+    error_rate = self._round_errors / float(self._round_done)
+    limit = self.limit
+    if self._round_throttled or error_rate > MAX_ERROR_RATE:
+      new_limit = max(self.min_limit, int(limit * DECREASE_FACTOR))
+      reason = 'throttled or failing'
+      self._ceiling = None
+    elif (self._last_round and limit > self._last_round[0]
+          and throughput < self._last_round[1] * (1 + MIN_GAIN)):
+      new_limit = max(self.min_limit, limit - 1)
+      reason = 'no throughput gained over %d transfers' % self._last_round[0]
+      self._ceiling = limit
+    elif limit + 1 < (self._ceiling or self.max_limit + 1):
+      new_limit = limit + 1
+      reason = 'transfers healthy'
+    else:
+      new_limit = limit
+      reason = 'at the limit'
+    if new_limit != limit:
+      logging.info('Download concurrency %d -> %d, %s: %.0f B/s, %d/%d '
+                   'transfers failed, %d throttled', limit, new_limit, reason,
+                   throughput, self._round_errors, self._round_done,
+                   self._round_throttled)
+    self._last_round = (limit, throughput)
+    self.limit = new_limit
+    self._new_round()
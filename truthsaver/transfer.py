@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Resumable file downloads verified against the expected length."""
+
+import glob
+import logging
+import os
+import re
+import time
+
+try:
+  from . import http_client
+  from . import lazy
+except ImportError:
+  import http_client
+  import lazy
+
+requests = lazy.LazyModule('requests')
+
+# Suffix of the file a download is written to until it is complete
+PART_SUFFIX = '.part'
+
+# Bytes read from the response at a time
+CHUNK_SIZE = 256 * 1024
+
+_CONTENT_RANGE = re.compile(r'bytes (\d+)-(\d+)/(\d+|\*)')
+_UNSATISFIED_RANGE = re.compile(r'bytes \*/(\d+)')
+
+
+class IncompleteDownload(IOError):
+  """The transfer ended before the expected number of bytes arrived."""
+
+
+def _expected_length(response, offset):
+  """Returns the full length of the file being sent, None if unknown."""
+
+  if response.status_code == 206:
+    match = _CONTENT_RANGE.match(response.headers.get('Content-Range', ''))
+    if not match or int(match.group(1)) != offset:
+      raise IncompleteDownload('Unexpected Content-Range %r resuming at %d'
+                               % (response.headers.get('Content-Range'),
+                                  offset))
+    if match.group(3) != '*':
+      return int(match.group(3))
+    return None
+  length = response.headers.get('Content-Length')
+  return int(length) if length is not None else None
+
+
+def part_path_for(path, part_key=None):
+  """Returns the part file a download of path is written to."""
+
+  if part_key is None:
+    return path + PART_SUFFIX
+  return '%s.%s%s' % (path, part_key, PART_SUFFIX)
+
+
+def _discard_other_parts(path, keep_path):
+  """Removes the part files of path other than keep_path."""
+
+  stale = glob.glob(glob.escape(path) + '.*' + PART_SUFFIX)
+  stale.append(path + PART_SUFFIX)
+  for stale_path in stale:
+    if stale_path != keep_path and os.path.exists(stale_path):
+      logging.info('Discarding %s, it is not the part of this download',
+                   stale_path)
+      os.remove(stale_path)
+
+
+def _transfer(url, part_path, chunk_size, consume, on_status):
+  """Appends the rest of url to part_path, returns (size, expected size).
+
+  consume(n_bytes) is called with every chunk read.
+  """
+
+  offset = 0
+  if os.path.exists(part_path):
+    offset = os.path.getsize(part_path)
+  headers = {'Range': 'bytes=%d-' % offset} if offset else {}
+  response = http_client.get(url, headers=headers, stream=True,
+                             on_status=on_status)
+  try:
+    if response.status_code == 416:
+      # Nothing left to send, the part file may already be complete.
+      match = _UNSATISFIED_RANGE.match(
+          response.headers.get('Content-Range', ''))
+      if match:
+        return offset, int(match.group(1))
+      os.remove(part_path)
+      raise IncompleteDownload('Cannot resume %s at %d, restarting'
+                               % (url, offset))
+    response.raise_for_status()
+    if offset and response.status_code == 200:
+      logging.info('Server ignored the range request for %s, restarting',
+                   url)
+      offset = 0
+    expected = _expected_length(response, offset)
+    with open(part_path, 'ab' if offset else 'wb') as fh:
+      for chunk in response.iter_content(chunk_size):
+        consume(len(chunk))
+        fh.write(chunk)
+        offset += len(chunk)
+    return offset, expected
+  finally:
+    response.close()
+
+
+def download_file(url, path, chunk_size=CHUNK_SIZE, max_tries=None,
+                  rate_limiter=None, on_status=None, part_key=None,
+                  expected_size=None):
+  """Downloads url to path, resuming interrupted transfers.
+
+  Data is written to a PART_SUFFIX file, which is only renamed to path once
+  its size matches the length the server advertised. A transfer cut off
+  half way is resumed with a Range request, up to max_tries times. If it
+  still fails the part file is kept, so a later call resumes from it.
+  Returns the number of bytes received by this call, which leaves out what
+  was resumed from the part file and is 0 for a file already at path.
+
+  expected_size is the length to check against when the server does not
+  send one. If neither is known the part file is kept and
+  IncompleteDownload raised, as there is no telling whether it is whole.
+  A file already at path is only kept if it is not empty and matches
+  expected_size when given, otherwise it is downloaded again.
+
+  part_key names what is being downloaded, e.g. which stream of a video.
+  It is part of the part file's name, and the part files of path left by
+  downloads with another key are removed, so bytes of different files are
+  never joined.
+
+  Every chunk read is first passed to rate_limiter.consume(n_bytes), see
+  throttle.TokenBucket, and on_status is passed on to http_client.get.
+  """
+
+  if os.path.exists(path):
+    size = os.path.getsize(path)
+    if size and (expected_size is None or size == expected_size):
+      return 0
+    logging.warning('%s holds %d bytes, expected %s, downloading it again',
+                    path, size, expected_size)
+    os.remove(path)
+  part_path = part_path_for(path, part_key)
+  if part_key is not None:
+    _discard_other_parts(path, part_path)
+  max_tries = max_tries or http_client.max_tries()
+  received = 0
+
+  def consume(n_bytes):
+    nonlocal received
+    received += n_bytes
+    if rate_limiter:
+      rate_limiter.consume(n_bytes)
+
+  for tries in range(max_tries):
+    try:
+      size, expected = _transfer(url, part_path, chunk_size, consume,
+                                 on_status)
+    except IncompleteDownload as e:
+      error = e
+    except (requests.exceptions.ChunkedEncodingError,
+            requests.exceptions.ConnectionError,
+            requests.exceptions.Timeout) as e:
+      error = IncompleteDownload('Transfer of %s cut off: %r' % (url, e))
+    else:
+      if expected is None:
+        expected = expected_size
+      if expected is None:
+        raise IncompleteDownload('Length of %s is unknown, keeping %s'
+                                 % (url, part_path))
+      if size == expected:
+        os.replace(part_path, path)
+        return received
+      if size > expected:
+        os.remove(part_path)
+        raise IncompleteDownload('Got %d bytes from %s, expected %d'
+                                 % (size, url, expected))
+      error = IncompleteDownload('Got %d bytes from %s, expected %d'
+                                 % (size, url, expected))
+    if tries + 1 < max_tries:
+      delay = http_client.backoff_delay(tries)
+      logging.warning('%s, resuming in %.1fs', error, delay)
+      time.sleep(delay)
+  raise error
@@ -3,38 +3,86 @@
 """Saves all videos found on rankings.the-elite.net"""
 
 import collections
+import concurrent.futures
 import datetime
 import json
 import logging
 import os
 import pickle
+import threading
 import time
 
-import requests
-import pytube
 # TODO(dc): Add python2.x support.
-from bs4 import BeautifulSoup
+
+try:
+  from . import dedup
+  from . import entry_store
+  from . import events
+  from . import http_cache
+  from . import http_client
+  from . import journal
+  from . import lazy
+  from . import metrics
+  from . import parsers
+  from . import pipeline
+  from . import scheduler
+  from . import snapshot
+  from . import sqlite_store
+  from . import storage
+  from . import streams
+  from . import throttle
+  from . import transfer
+  from . import work_queue
+except ImportError:
+  import dedup
+  import entry_store
+  import events
+  import http_cache
+  import http_client
+  import journal
+  import lazy
+  import metrics
+  import parsers
+  import pipeline
+  import scheduler
+  import snapshot
+  import sqlite_store
+  import storage
+  import streams
+  import throttle
+  import transfer
+  import work_queue
 
 
 def datetime_ts():
   dt = datetime.datetime.now()
   return dt.isoformat().split('.')[0].replace(':', '-')
 
-# set up logging to file - see previous section for more details
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s %(name)-12s %(levelname)-8s %(message)s',
-    datefmt='%m-%d %H:%M',
-    filename='/tmp/truth_saver_%s.log' % datetime_ts(),
-    filemode='w')
+# Heavy dependencies, imported once a code path needing them runs
+requests = lazy.LazyModule('requests')
+pytube = lazy.LazyModule('pytube')
 
 
 # Base URL for the rankings
 BASE_URL = 'https://rankings.the-elite.net'
 AJAX_ENDPOINT = '/ajax/stage/'
 
-# Number of max atttempts to resolve url
-MAX_TRIES = 5
+# Default number of stages fetched concurrently by get_all_time_entries
+DEFAULT_CRAWL_WORKERS = 1
+
+# Directory for cached stage pages, used by the CLI unless --no_cache is given
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache',
+                                 'truthsaver')
+
+# Number of journaled status changes after which the record is rewritten
+DEFAULT_COMPACT_EVERY = 500
+
+# Seconds a resolved link or link error is trusted before it is resolved again
+DEFAULT_LINK_TTL = 30 * 24 * 3600
+
+# Default number of threads resolving video links and downloading videos
+DEFAULT_RESOLVE_WORKERS = 1
+DEFAULT_DOWNLOAD_WORKERS = 1
 
 # Standard download path
 DEFAULT_PATH = './vids/'
@@ -98,8 +146,15 @@ MODES = {
 # TIME_ENTRY
 class TimeEntry(collections.namedtuple('TimeEntry',
                                        ['url', 'time_id', 'player',
-                                        'mode', 'stage', 'time', 'status'])):
-  """TimeEntry is a container for all information needed for a ge time."""
+                                        'mode', 'stage', 'time', 'status',
+                                        'link', 'link_error',
+                                        'resolved_at'])):
+  """TimeEntry is a container for all information needed for a ge time.
+
+  link is the video link found on the time page, or link_error the reason
+  there is no usable one. resolved_at is the timestamp of when the time page
+  was last resolved, all three are None until it is.
+  """
 
   def vid_path(self):
     """Returns a local path for where videos should be downloaded."""
@@ -111,6 +166,21 @@ class TimeEntry(collections.namedtuple('TimeEntry',
                  player_name))
     return os.path.join(player_name, vid_name)
 
+  def labels(self):
+    """Returns the game, stage and mode metric labels of the time."""
+    game = {'ge': GAMES[0], 'pd': GAMES[1]}.get(
+        STAGE_PREFIX_DCT.get(self.stage), 'unknown')
+    return {'game': game, 'stage': self.stage, 'mode': self.mode}
+
+# Records saved before links were stored only have the first 7 fields.
+TimeEntry.__new__.__defaults__ = (None, None, None)
+
+
+def stage_labels(stage, page):
+  """Returns the metric labels of a stage page, regular or ltk."""
+  game = GAMES[0] if stage[0] < 21 else GAMES[1]
+  return {'game': game, 'stage': stage[1], 'page': page}
+
 
 def ge_time_to_sec(time_str):
   """Converts time MM:SS to int seconds."""
@@ -133,33 +203,36 @@ def sec_to_ge_time(time_sec):
                             int(time_sec % 3600)/60,
                             int(time_sec % 60))
 
-def request_with_retry(url):
-  """Requests with retry, upon failure it has exponetial backoff."""
-  tries = 0
-  while tries < MAX_TRIES:
-    try:
-      response = requests.get(url)
-      response.raise_for_status()
-    except ValueError:
-      time.sleep(2*2**tries)
-      tries += 1
-      continue
-    else:
-      break
+def request_with_retry(url, cache=None):
+  """Requests through the shared session, retrying transient failures.
+
+  If given a http_cache.ResponseCache the request is made conditional on the
+  cached validators, and a 304 response is answered from the cache.
+  """
+  headers = cache.conditional_headers(url) if cache else {}
+  response = http_client.get(url, headers=headers)
+  if cache:
+    cached_response = cache.update(url, response)
+    if cached_response is None:
+      return request_with_retry(url)
+    response = cached_response
   return response
 
+def video_errors():
+  """Returns the exceptions meaning a video itself can not be downloaded.
+
+  Not every pytube release defines all of the pytube exceptions used.
+  """
+  names = ('PytubeError', 'DoesNotExist', 'AgeRestricted')
+  return tuple(getattr(pytube.exceptions, name) for name in names
+               if hasattr(pytube.exceptions, name)) + (
+                   AttributeError, streams.NoStreamError)
+
 def pytubeRetry(url):
-  tries = 0
-  while tries < MAX_TRIES:
-    try:
-      yt_handle = pytube.YouTube(url)
-    except IOError:
-      time.sleep(2*2**tries)
-      tries += 1
-      continue
-    else:
-      return yt_handle
-  raise IOError('Unable to load %s into pytube.YouTube' % url)
+  try:
+    return http_client.retry_call(lambda: pytube.YouTube(url), IOError)
+  except IOError:
+    raise IOError('Unable to load %s into pytube.YouTube' % url)
 
 
 class TruthSaver(object):
@@ -170,10 +243,13 @@ class TruthSaver(object):
   opened up and parsed with Beautifulsoup converting the data on the page
   into a TimeEntry.
 
-  self.saved_entries is a dictonary of TimeEntrys with the keys equal to
-  TimeEntry.url which is gaurnteed to be unqiue.
+  self.saved_entries is an entry_store.EntryStore, a dictonary like store of
+  TimeEntrys with the keys equal to TimeEntry.url which is gaurnteed to be
+  unqiue.
 
-  self.record_path is the file containing the saved time entries..
+  self.record_path is the file containing the saved time entries. Status
+  changes made while downloading are appended to self.journal as they happen
+  and compacted into the record every self.compact_every changes.
   """
   NEW_URL = 0
   DOWNLOADED = 1
@@ -181,7 +257,22 @@ class TruthSaver(object):
   BAD_VIDEO = -2
 
   def __init__(self, record_path=None, video_root=None, new_times_path=None,
-               update_only=False, try_all=False, low_quality=False):
+               update_only=False, try_all=False, low_quality=False,
+               crawl_workers=DEFAULT_CRAWL_WORKERS, cache_dir=None,
+               cache_ttl=http_cache.DEFAULT_TTL,
+               cache_max_bytes=http_cache.DEFAULT_MAX_BYTES,
+               full_update=False, compact_every=DEFAULT_COMPACT_EVERY,
+               resolve_workers=DEFAULT_RESOLVE_WORKERS,
+               download_workers=DEFAULT_DOWNLOAD_WORKERS,
+               link_ttl=DEFAULT_LINK_TTL, priority=scheduler.INSERTION,
+               top_n=scheduler.DEFAULT_TOP_N, watchlist=None,
+               max_runtime=None, max_bytes=None, max_videos=None,
+               max_bytes_per_second=None, dedup_videos=True,
+               max_resolution=None, max_video_size=None,
+               containers=streams.DEFAULT_CONTAINERS,
+               codecs=streams.DEFAULT_CODECS, work_queue_path=None,
+               lease_seconds=work_queue.DEFAULT_LEASE_SECONDS,
+               claim_batch=work_queue.DEFAULT_CLAIM_BATCH, events_path=None):
     """Init.."""
 
     if record_path:
@@ -189,68 +280,341 @@ class TruthSaver(object):
       self.saved_entries = self.get_saved_list(record_path)
     else:
       self.record_path = ('./truth_saver_%s.json' % datetime_ts())
-      self.saved_entries = {}
+      self.saved_entries = entry_store.EntryStore(TimeEntry)
+
+    self.journal = journal.StatusJournal(
+        journal.StatusJournal.path_for(self.record_path))
+    self.compact_every = compact_every
+    # Guards saved_entries and the journal against the download threads.
+    self.status_lock = threading.RLock()
 
     self.new_times_path = new_times_path
-    self.new_times_list = []
+    # url -> video file of entries downloaded or linked, until their
+    # DOWNLOADED event is emitted.
+    self.video_paths = {}
+    # Every entry a download finishes with is emitted as an event, appended
+    # to events_path if given and passed to the add_download_hook hooks.
+    self.events = events.EventFeed(events_path)
+    # The vid_path of every video downloaded is written to new_times_path as
+    # its DOWNLOADED event is emitted.
+    self._new_times_lock = threading.Lock()
+    self._new_times_fh = None
+    if new_times_path:
+      self._new_times_fh = open(new_times_path, 'w')
+      self.add_download_hook(self.write_downloaded_path)
 
-    self.videos_dir_root = video_root
     self.update_only = update_only
     self.try_all = try_all
     self.low_quality = low_quality
-
-    if not self.videos_dir_root:
-      self.videos_dir_root = DEFAULT_PATH
-    if not os.path.isdir(self.videos_dir_root):
-      os.mkdir(self.videos_dir_root)
+    # Picks which of a video's streams is downloaded.
+    self.stream_policy = streams.StreamPolicy(
+        max_resolution=max_resolution, lowest=low_quality,
+        max_size=max_video_size, containers=containers, codecs=codecs)
+    self.resolve_workers = resolve_workers
+    self.download_workers = download_workers
+    # Seconds before a stored link or link error is resolved again.
+    self.link_ttl = link_ttl
+    # Order pending entries are tried in, and the limits of this run which
+    # start counting now.
+    self.scheduler = scheduler.Scheduler(priority, top_n=top_n,
+                                         watchlist=watchlist)
+    self.budget = scheduler.Budget(max_runtime=max_runtime,
+                                   max_bytes=max_bytes, max_videos=max_videos)
+    # Adapts how many of the download_workers transfer at once, and caps
+    # their combined bandwidth to max_bytes_per_second.
+    self.download_controller = throttle.AimdController(
+        max(1, download_workers), bytes_per_second=max_bytes_per_second)
+    # Counters and latencies of every phase of the run.
+    self.metrics = metrics.Metrics()
+    self.crawl_workers = max(1, crawl_workers or 1)
+    # Stage name -> error message for stages which failed the last crawl.
+    self.stage_errors = {}
+
+    # Stage -> mode -> highest saved time_id, rows at or below it are skipped
+    # when crawling unless full_update is set.
+    self.full_update = full_update
+    self.watermarks = self.saved_entries.watermarks()
+
+    # Stage pages are only cached when given a cache_dir.
+    self.response_cache = None
+    if cache_dir:
+      self.response_cache = http_cache.ResponseCache(
+          cache_dir, ttl=cache_ttl, max_bytes=cache_max_bytes)
+
+    # Shares the pending entries with other processes, only when given a
+    # work_queue_path.
+    self.work_queue = None
+    if work_queue_path:
+      self.work_queue = work_queue.WorkQueue(
+          work_queue_path, lease_seconds=lease_seconds,
+          claim_batch=claim_batch)
+
+    # video_root may be a list of roots, each player's directory is placed
+    # on one of them. The first also holds the archive's index files. With
+    # a work queue the placements and the video index are kept in it, so
+    # the processes sharing it agree on them.
+    video_roots = video_root or DEFAULT_PATH
+    if isinstance(video_roots, str):
+      video_roots = [video_roots]
+    if self.work_queue is None:
+      self.storage = storage.VideoStorage(video_roots)
+    else:
+      self.storage = storage.SharedVideoStorage(video_roots, self.work_queue)
+    self.videos_dir_root = self.storage.primary
+    # YouTube id -> downloaded file, so a video linked from several times is
+    # only downloaded once.
+    self.video_index = None
+    if dedup_videos and self.work_queue is None:
+      self.video_index = dedup.VideoIndex(self.videos_dir_root)
+    elif dedup_videos:
+      self.video_index = dedup.SharedVideoIndex(self.videos_dir_root,
+                                                self.work_queue)
+
+    if self.work_queue is not None:
+      self.apply_queue_results()
 
   @classmethod
   def get_saved_list(cls, record_path):
-    """Given full path return times_list saved as a pickle file"""
+    """Given full path return the saved entries as an EntryStore.
+
+    New entries, status and link changes in the record's journal are
+    replayed over the entries.
+    """
 
     _, ext = os.path.splitext(record_path)
     if ext == '.pkl':
       with open(record_path, 'rb') as fh:
         logging.info('Loading from pickle file %s', record_path)
-        return pickle.load(fh)
+        entries = entry_store.EntryStore.from_rows(
+            TimeEntry, pickle.load(fh).values())
     elif ext == '.json':
       with open(record_path, 'r') as fh:
         logging.info('Loading from JSON file %s', record_path)
-        return {key: TimeEntry(*tple) for key, tple in json.load(fh).items()}
+        entries = entry_store.EntryStore.from_rows(
+            TimeEntry, json.load(fh).values())
+    elif ext == '.sqlite':
+      logging.info('Opening SQLite file %s', record_path)
+      entries = sqlite_store.SqliteEntryStore(TimeEntry, record_path)
+    elif ext == '.snap':
+      logging.info('Mapping snapshot file %s', record_path)
+      entries = snapshot.SnapshotEntryStore(TimeEntry, record_path)
     else:
       raise ValueError(
-          'Valid file extensions must be .pkl or .json given %s' % ext)
+          'Valid file extensions must be .pkl, .json, .sqlite or .snap'
+          ' given %s' % ext)
+
+    n_replayed = 0
+    status_journal = journal.StatusJournal(
+        journal.StatusJournal.path_for(record_path))
+    for url, change in status_journal.replay():
+      if isinstance(change, list):
+        entries.add_row(*change)
+      elif url not in entries:
+        continue
+      elif isinstance(change, dict):
+        entries.set_link(url, change['link'], change['link_error'],
+                         change['resolved_at'])
+      else:
+        entries.set_status(url, change)
+      n_replayed += 1
+    if n_replayed:
+      logging.info('Replayed %d changes from %s',
+                   n_replayed, status_journal.path)
+    return entries
 
   @classmethod
   def save_entries(cls, record_path, entries):
-    """Save the currnet self.saved_entries to a pickle file."""
+    """Save the currnet self.saved_entries to a record file.
+
+    The pickle and JSON formats store a plain dictonary of url -> TimeEntry,
+    see snapshot for the .snap format. The file is written next to the record
+    and then atomically moved over it. Saving a SqliteEntryStore to its own
+    file only commits queued writes.
+    """
+
+    if (isinstance(entries, sqlite_store.SqliteEntryStore)
+        and entries.path == record_path):
+      logging.info('Committing to SQLite file %s', record_path)
+      entries.flush()
+      return
 
     _, ext = os.path.splitext(record_path)
+    tmp_path = '%s.%d.tmp' % (record_path, os.getpid())
+    rows = entries.rows() if hasattr(entries, 'rows') else entries.values()
     if ext == '.pkl':
-      with open(record_path, 'wb') as fh:
+      with open(tmp_path, 'wb') as fh:
         logging.info('Saving to pickle file %s', record_path)
-        pickle.dump(entries, fh)
+        pickle.dump({row[0]: TimeEntry(*row) for row in rows}, fh)
     elif ext == '.json':
-      with open(record_path, 'w') as fh:
+      with open(tmp_path, 'w') as fh:
         logging.info('Saving to JSON file %s', record_path)
-        fh.write(json.dumps(entries))
+        fh.write(json.dumps({row[0]: row for row in rows}))
+    elif ext == '.sqlite':
+      logging.info('Saving to SQLite file %s', record_path)
+      store = sqlite_store.SqliteEntryStore(TimeEntry, tmp_path)
+      store.add_rows(rows)
+      store.close()
+    elif ext == '.snap':
+      with open(tmp_path, 'wb') as fh:
+        logging.info('Saving to snapshot file %s', record_path)
+        snapshot.write_snapshot(fh, rows)
     else:
       raise ValueError(
-          'Valid file extensions must be .pkl or .json given %s' % ext)
+          'Valid file extensions must be .pkl, .json, .sqlite or .snap'
+          ' given %s' % ext)
+    os.replace(tmp_path, record_path)
+
+  @classmethod
+  def migrate_record(cls, src_path, dst_path):
+    """Copies the record at src_path into a new record at dst_path.
+
+    The format of each is given by its extension, e.g. a .json record can be
+    migrated to .sqlite.
+    """
+
+    entries = cls.get_saved_list(src_path)
+    cls.save_entries(dst_path, entries)
+    logging.info('Migrated %d entries from %s to %s',
+                 len(entries), src_path, dst_path)
+    return len(entries)
+
+  @staticmethod
+  def raise_watermark(watermarks, entry):
+    """Raises the watermark of the entry's stage and mode to its time_id."""
+
+    stage_marks = watermarks.setdefault(entry.stage, {})
+    if entry.time_id > stage_marks.get(entry.mode, 0):
+      stage_marks[entry.mode] = entry.time_id
+
+  @classmethod
+  def get_watermarks(cls, entries):
+    """Returns dictonary of stage -> mode -> highest time_id in entries."""
+
+    watermarks = {}
+    for entry in entries:
+      cls.raise_watermark(watermarks, entry)
+    return watermarks
+
+  def stage_watermarks(self, stage):
+    """Returns mode -> time_id below which rows of a stage are skipped."""
+
+    if self.full_update:
+      return {}
+    return self.watermarks.get(stage[1], {})
 
   def save(self):
-    self.save_entries(self.record_path, self.saved_entries)
+    """Saves the record, compacting the journal into it."""
+    with self.status_lock:
+      if self.work_queue is not None:
+        self.apply_queue_results()
+      self.save_entries(self.record_path, self.saved_entries)
+      self.journal.truncate()
+
+  def set_entry_status(self, url, status):
+    """Sets the status of a saved entry and journals the change."""
+
+    with self.status_lock:
+      self.saved_entries.set_status(url, status)
+      self.journal.append(url, status)
+      self._compact_journal()
+
+  def apply_queue_results(self):
+    """Sets the statuses reported to the work queue, returns how many."""
+
+    n_changed = 0
+    with self.status_lock:
+      for url, status in self.work_queue.results().items():
+        if (url in self.saved_entries
+            and self.saved_entries[url].status != status):
+          self.saved_entries.set_status(url, status)
+          n_changed += 1
+    if n_changed:
+      logging.info('Applied %d statuses from the work queue', n_changed)
+    return n_changed
+
+  def report_to_queue(self, event):
+    """Completes the claimed entry of a download event in the work queue.
+
+    Skipped entries, e.g. after a network error or once the run budget is
+    used up, did not get a new status and are released for any process to
+    retry.
+    """
+
+    if event['event'] == events.SKIPPED:
+      self.work_queue.release([event['url']])
+    else:
+      self.work_queue.complete(event['url'], event['status'])
+
+  def set_entry_statuses(self, urls, status):
+    """Sets the status of many saved entries, saving the record once."""
+
+    with self.status_lock:
+      for url in urls:
+        self.saved_entries.set_status(url, status)
+      self.save()
+
+  def add_entry(self, entry):
+    """Adds a new entry to the record, journaling it."""
+
+    with self.status_lock:
+      self.saved_entries[entry.url] = entry
+      self.raise_watermark(self.watermarks, entry)
+      self.metrics.count('new_times', **entry.labels())
+      self.journal.append_entry(entry)
+      self._compact_journal()
+
+  def set_entry_link(self, url, link, link_error=None):
+    """Stores the resolved link or link error of an entry, journaling it."""
+
+    resolved_at = time.time()
+    with self.status_lock:
+      self.saved_entries.set_link(url, link, link_error, resolved_at)
+      self.journal.append_link(url, link, link_error, resolved_at)
+      self._compact_journal()
+
+  def _compact_journal(self):
+    if self.journal.n_appended >= self.compact_every:
+      logging.info('Compacting %d journaled changes into %s',
+                   self.journal.n_appended, self.record_path)
+      self.save()
+
+  def write_metrics(self, json_path=None, prometheus_path=None):
+    """Writes the run's metrics as a JSON report and a Prometheus textfile."""
+
+    if json_path:
+      self.metrics.write_json(json_path)
+      logging.info('Wrote metrics report %s', json_path)
+    if prometheus_path:
+      self.metrics.write_prometheus(prometheus_path)
+      logging.info('Wrote Prometheus metrics %s', prometheus_path)
+
+  def write_downloaded_path(self, event):
+    """Appends the vid_path of a DOWNLOADED event to new_times_path."""
+
+    if event['event'] != events.DOWNLOADED:
+      return
+    vid_path = self.saved_entries[event['url']].vid_path()
+    with self._new_times_lock:
+      if self._new_times_fh is not None:
+        self._new_times_fh.write(vid_path + '\n')
+        self._new_times_fh.flush()
 
   def save_downloaded_paths(self):
-    """Saves all newly downloaded files if given a new_times_path."""
-    if self.new_times_path:
-      with open(self.new_times_path, 'w') as out_fd:
-        out_fd.write('\n'.join(self.new_times_list))
+    """Closes new_times_path, which holds every video downloaded so far."""
+
+    with self._new_times_lock:
+      if self._new_times_fh is not None:
+        self._new_times_fh.close()
+        self._new_times_fh = None
 
   def stage_data_to_times(self, stage, stage_data):
-    """Returns a dictonary of regular times with videos for a stage."""
+    """Returns a dictonary of regular times with videos for a stage.
+
+    Only times newer than the stage watermark of their mode are returned.
+    """
 
     times = {}
+    watermarks = self.stage_watermarks(stage)
 
     if stage[0] < 21:
       game = GAMES[0]
@@ -263,11 +627,11 @@ class TruthSaver(object):
     #      Time_ID, Time_sec, vid_comment_status*)
     # Comment vid_comment_status 0 = None, 1 = Comment, 2 = Video
     for mode, player_times in zip(MODES[game][:3], stage_data):
-      # The player_times array is not sliced by player this does that
-      sliced_times = [
-          player_times[i:i + 6] for i in range(0, len(player_times), 6)]
-      for t in sliced_times:
-        if t[5] == 2:
+      # The player_times array is flat, step through it one player at a time
+      watermark = watermarks.get(mode, 0)
+      for i in range(0, len(player_times), 6):
+        if player_times[i + 5] == 2 and player_times[i + 3] > watermark:
+          t = player_times[i:i + 6]
           time_id = t[3]
           time_url = BASE_URL + '/~' + t[1] + '/time/' + str(time_id)
           entry = TimeEntry(url=time_url, time_id=time_id,
@@ -277,7 +641,10 @@ class TruthSaver(object):
     return times
 
   def get_ltk_level_data(self, stage):
-    """Returns up-to-date (D)LTK times with videos for a stage."""
+    """Returns up-to-date (D)LTK times with videos for a stage.
+
+    Only times newer than the stage watermark of their mode are returned.
+    """
 
     if stage[0] < 21:
       game = GAMES[0]
@@ -285,7 +652,12 @@ class TruthSaver(object):
       game = GAMES[1]
 
     url = BASE_URL + '/' + game + '/ltk/stage/' + stage[1]
-    page = request_with_retry(url)
+    labels = stage_labels(stage, 'ltk')
+    with self.metrics.timer('stage_fetch_seconds', **labels):
+      page = request_with_retry(url, cache=self.response_cache)
+    ltk_times = self.get_cached_times(url, page, stage)
+    if ltk_times is not None:
+      return ltk_times
 
     try:
       page.raise_for_status()
@@ -295,51 +667,123 @@ class TruthSaver(object):
 
     ltk_times = {}
     game = url.split('/')[-4]
+    watermarks = self.stage_watermarks(stage)
 
     # Parse the HTML level page for all the player times with videos
-    soup = BeautifulSoup(page.text, "html.parser")
-    for table, mode in zip(soup.find_all('table'), MODES[game][3:]):
-      for tr in table.find_all('tr'):
-        if tr.find(class_='video-link'):
-          player = tr.find(class_='user').text
-          time_tag = tr.find(class_='time')
-          time_url = BASE_URL + time_tag['href']
-          time_id = int(time_url.split('/')[-1])
-          time_sec = ge_time_to_sec(time_tag.text)
+    with self.metrics.timer('parse_seconds', **labels):
+      tables = parsers.get_backend().ltk_tables(page.text)
+      for rows, mode in zip(tables, MODES[game][3:]):
+        watermark = watermarks.get(mode, 0)
+        for player, time_href, time_text in rows:
+          time_id = int(time_href.split('/')[-1])
+          if time_id <= watermark:
+            continue
+          time_url = BASE_URL + time_href
+          time_sec = ge_time_to_sec(time_text)
           entry = TimeEntry(url=time_url, time_id=time_id,
                             player=player, mode=mode, stage=stage[1],
                             time=time_sec, status=self.NEW_URL)
           ltk_times[entry.url] = entry
+    self.set_cached_times(url, ltk_times, stage)
     return ltk_times
 
+  def get_cached_times(self, url, response, stage):
+    """Returns the times parsed from an unmodified page, None otherwise.
+
+    The cached times are only usable if they were parsed with watermarks no
+    higher than the current ones, otherwise the cached body is reparsed.
+    """
+
+    if not getattr(response, 'from_cache', False):
+      return None
+    cached = self.response_cache.get_parsed(url)
+    if cached is None:
+      return None
+    watermarks = self.stage_watermarks(stage)
+    for mode, watermark in cached['watermarks'].items():
+      if watermarks.get(mode, 0) < watermark:
+        return None
+    return {row[0]: TimeEntry(*row) for row in cached['rows']
+            if row[1] > watermarks.get(row[3], 0)}
+
+  def set_cached_times(self, url, times, stage):
+    """Stores the times parsed from url so a 304 can skip the parsing."""
+
+    if self.response_cache:
+      self.response_cache.set_parsed(url, {
+          'watermarks': dict(self.stage_watermarks(stage)),
+          'rows': list(times.values()),
+      })
+
   def get_regular_level_data(self, stage):
     """Returns dictonary of up to date regular times for a stage."""
 
     url = BASE_URL + AJAX_ENDPOINT + str(stage[0])
     logging.info('Loading AJAX page %s', url)
-    response = request_with_retry(url)
-    try:
-      response.raise_for_status()
-      stage_data = response.json()
-    except ValueError as e:
-      logging.error('Could not fetch data %s', str(e))
-      raise
-    return self.stage_data_to_times(stage, stage_data)
+    labels = stage_labels(stage, 'regular')
+    with self.metrics.timer('stage_fetch_seconds', **labels):
+      response = request_with_retry(url, cache=self.response_cache)
+    times = self.get_cached_times(url, response, stage)
+    if times is not None:
+      return times
+    with self.metrics.timer('parse_seconds', **labels):
+      try:
+        response.raise_for_status()
+        stage_data = response.json()
+      except ValueError as e:
+        logging.error('Could not fetch data %s', str(e))
+        raise
+      times = self.stage_data_to_times(stage, stage_data)
+    self.set_cached_times(url, times, stage)
+    return times
+
+  def get_stage_entries(self, stage):
+    """Returns dictonary of all up to date times with videos for a stage."""
+
+    times = self.get_regular_level_data(stage)
+    times.update(self.get_ltk_level_data(stage))
+    if not times:
+      logging.info('No new times for stage %s', stage[1])
+    return times
 
   def get_all_time_entries(self):
-    """Returns dictonry of all up to date GE/PD times with videos."""
+    """Returns dictonry of all up to date GE/PD times with videos.
+
+    Stages are fetched by self.crawl_workers threads. A stage which fails to
+    load is logged and recorded in self.stage_errors, the remaining stages
+    are still returned. Results are always merged in stage order.
+    """
+
+    stages = [stage for game in GAMES for stage in STAGES[game]]
+    stage_times = [None] * len(stages)
+    self.stage_errors = {}
+
+    def fetch(idx):
+      stage = stages[idx]
+      try:
+        stage_times[idx] = self.get_stage_entries(stage)
+      except (requests.exceptions.RequestException, ValueError) as e:
+        logging.error('Failed to load stage %s: %s', stage[1], repr(e))
+        self.stage_errors[stage[1]] = repr(e)
+      return stage
 
-    time_entries = {}
     print('Loading Stage Data...')
-    for game in GAMES:
-      for stage in STAGES[game]:
-        print('%02d/40 ... %s       '
-              % (stage[0], stage[1]), end='\r')
-        # Regular mode data first
-        time_entries.update(self.get_regular_level_data(stage))
-        # LTK Times
-        time_entries.update(self.get_ltk_level_data(stage))
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=self.crawl_workers) as pool:
+      futures = [pool.submit(fetch, idx) for idx in range(len(stages))]
+      for n, future in enumerate(
+          concurrent.futures.as_completed(futures), 1):
+        print('%02d/%d ... %s       '
+              % (n, len(stages), future.result()[1]), end='\r')
     print('')
+
+    time_entries = {}
+    for times in stage_times:
+      if times:
+        time_entries.update(times)
+    if self.stage_errors:
+      print('Failed to load %d stage(s): %s'
+            % (len(self.stage_errors), ', '.join(sorted(self.stage_errors))))
     return time_entries
 
   @classmethod
@@ -348,25 +792,21 @@ class TruthSaver(object):
 
     response = request_with_retry(time_entry.url)
     response.raise_for_status()
-    soup = BeautifulSoup(response.content, 'html.parser')
-    for tag in soup.find_all('p'):
-      for link in tag.find_all('a', href=True):
-        if 'YouTube' in link.text:
-          return link['href']
-        elif ('Download video' in link.text
-              and 'youtu' in link['href']):
-          return link['href']
-
-        if 'Twitch' in link.text:
-          raise ValueError(
-              'Cannot download %s it is a twitch video %s'
-              % (os.path.basename(time_entry.vid_path()),
-                 link['href']))
-        elif 'Download video' in link.text:
-          raise ValueError(
-              'Manually download %s, at %s'
-              % (os.path.basename(time_entry.vid_path()),
-                 link['href']))
+    for link_text, href in parsers.get_backend().paragraph_links(
+        response.content):
+      if 'YouTube' in link_text:
+        return href
+      elif 'Download video' in link_text and 'youtu' in href:
+        return href
+
+      if 'Twitch' in link_text:
+        raise ValueError(
+            'Cannot download %s it is a twitch video %s'
+            % (os.path.basename(time_entry.vid_path()), href))
+      elif 'Download video' in link_text:
+        raise ValueError(
+            'Manually download %s, at %s'
+            % (os.path.basename(time_entry.vid_path()), href))
 
     raise ValueError('Expected video link for time %s, found nothing.'
                      % os.path.basename(time_entry.vid_path()))
@@ -376,79 +816,283 @@ class TruthSaver(object):
 
     current_entries = self.get_all_time_entries()
 
+    n_new = 0
     for cur_entry_k, cur_entry_v in current_entries.items():
       if cur_entry_k not in self.saved_entries:
         self.saved_entries[cur_entry_k] = cur_entry_v
-    self.save_entries(self.record_path, self.saved_entries)
+        self.raise_watermark(self.watermarks, cur_entry_v)
+        self.metrics.count('new_times', **cur_entry_v.labels())
+        n_new += 1
+    logging.info('Found %d new times', n_new)
+    print('Found %d new times.' % n_new)
+    self.save()
 
   def download_yt_video(self, yt_link, time_entry):
-    """Downloads highest quality yt video given the link, and TimeEntry."""
+    """Downloads highest quality yt video given the link, and TimeEntry.
+
+    A video already downloaded for another entry, per self.video_index, is
+    hardlinked or copied instead. Returns the bytes downloaded, 0 if the
+    video was linked, the file is recorded in self.video_paths until the
+    entry's event is emitted.
+    """
+
+    vid_id = (dedup.video_id(yt_link) if self.video_index is not None
+              else None)
+    if vid_id is None:
+      vid_file, n_bytes = self.fetch_yt_video(yt_link, time_entry)
+    else:
+      with self.video_index.lock_for(vid_id):
+        vid_file = self.link_indexed_video(vid_id, time_entry)
+        n_bytes = 0
+        if vid_file is None:
+          vid_file, n_bytes = self.fetch_yt_video(yt_link, time_entry)
+          self.video_index.add(vid_id, vid_file)
+    self.video_paths[time_entry.url] = vid_file
+    logging.info('Downloaded video: %s', time_entry.vid_path())
+    return n_bytes
+
+  def link_indexed_video(self, vid_id, time_entry):
+    """Links the entry to the indexed file of vid_id, returns its path.
+
+    Returns None if the video was not downloaded before.
+    """
 
+    src = self.video_index.lookup(vid_id)
+    if src is None:
+      return None
     player_dirname, vid_basename = os.path.split(time_entry.vid_path())
-    vid_dirname = os.path.join(self.videos_dir_root, player_dirname)
-    yt_handle = pytubeRetry(yt_link)
-
-    if not os.path.isdir(vid_dirname):
-      os.mkdir(vid_dirname)
-    yt_handle.set_filename(vid_basename)
-    # This will download the highest quality video
-    hq_vid = sorted(yt_handle.videos, key=lambda x: x.resolution,
-                    reverse=(not self.low_quality))[0]
+    vid_dirname = self.storage.player_dir(player_dirname)
+    os.makedirs(vid_dirname, exist_ok=True)
+    vid_file = os.path.join(vid_dirname, '%s%s' % (
+        vid_basename, os.path.splitext(src)[1]))
+    if os.path.abspath(src) != os.path.abspath(vid_file):
+      linked = dedup.link_file(src, vid_file)
+      logging.info('%s video %s to %s', 'Linked' if linked else 'Copied',
+                   src, vid_file)
+    labels = time_entry.labels()
+    self.metrics.count('dedup_videos', **labels)
+    self.metrics.count('dedup_bytes', os.path.getsize(vid_file), **labels)
+    return vid_file
+
+  def fetch_yt_video(self, yt_link, time_entry):
+    """Downloads the video of the link, returns (path, bytes received).
+
+    The video is written to a .part file named after the stream, resumed if
+    a previous attempt at the same stream was cut off, and only moved to its
+    final path once complete.
+    """
+
+    player_dirname, vid_basename = os.path.split(time_entry.vid_path())
+    vid_dirname = self.storage.player_dir(player_dirname)
+    labels = time_entry.labels()
+    with self.metrics.timer('pytube_seconds', **labels):
+      yt_handle = pytubeRetry(yt_link)
+
+    os.makedirs(vid_dirname, exist_ok=True)
+    stream = self.stream_policy.select(streams.video_streams(yt_handle))
+    logging.info('Picked %s %s stream of %s', stream.resolution,
+                 streams.container(stream), yt_link)
+    vid_file = os.path.join(vid_dirname,
+                            '%s.%s' % (vid_basename, streams.container(stream)))
     try:
-      hq_vid.download(vid_dirname)
+      with self.download_controller.transfer() as slot, \
+           self.metrics.timer('download_seconds', **labels):
+        slot.n_bytes = n_bytes = transfer.download_file(
+            stream.url, vid_file,
+            rate_limiter=self.download_controller.bucket,
+            on_status=self.download_controller.on_status,
+            part_key=streams.stream_key(stream),
+            expected_size=streams.advertised_size(stream))
+      self.metrics.count('download_bytes', n_bytes, **labels)
     except IOError as e:
       logging.error('IOError downloading %s/%s',
                     vid_dirname, vid_basename)
       logging.error(str(e))
       logging.error('Skipping entry for now retry later')
-      raise IOError
-    if self.new_times_path:
-      self.new_times_list.append(time_entry.vid_path())
-    logging.info('Downloaded video: %s', time_entry.vid_path())
+      raise
+    return vid_file, n_bytes
+
+  def pending_statuses(self):
+    """Returns the statuses of entries which download_videos should try."""
+
+    if self.try_all:
+      return (self.NEW_URL, self.BAD_LINK, self.BAD_VIDEO)
+    return (self.NEW_URL,)
+
+  def link_is_fresh(self, time_entry):
+    """Returns True if the entry was resolved less than link_ttl ago."""
+
+    return (time_entry.resolved_at is not None
+            and time.time() - time_entry.resolved_at < self.link_ttl)
+
+  def resolve_entry(self, time_entry):
+    """Returns the youtube link for an entry, None if it has no usable link.
+
+    The time page is only fetched if the entry's stored link is older than
+    self.link_ttl, the link or the reason there is none is stored with the
+    entry. Entries without a youtube link are marked BAD_LINK, entries whose
+    time page could not be loaded are left to be retried later.
+    """
+
+    labels = time_entry.labels()
+    if self.link_is_fresh(time_entry):
+      self.metrics.count('stored_links', **labels)
+      if time_entry.link:
+        return time_entry.link
+      link_error = time_entry.link_error
+    else:
+      try:
+        with self.metrics.timer('resolve_seconds', **labels):
+          link = self.get_yt_link(time_entry)
+      except requests.exceptions.RequestException as e:
+        logging.error('Could not load %s: %r', time_entry.url, e)
+        return None
+      except ValueError as e:
+        link_error = str(e)
+        self.set_entry_link(time_entry.url, None, link_error)
+      else:
+        self.set_entry_link(time_entry.url, link)
+        return link
+    logging.error(link_error)
+    if time_entry.status != self.BAD_LINK:
+      self.set_entry_status(time_entry.url, self.BAD_LINK)
+    return None
+
+  def resolve_links(self):
+    """Resolves the links of every pending entry without downloading.
+
+    Entries with a link younger than self.link_ttl are skipped, the rest are
+    resolved by self.resolve_workers threads. Returns the number of entries
+    resolved.
+    """
+
+    entries = [entry for entry in self.scheduler.order(
+        self.saved_entries.with_status(*self.pending_statuses()),
+        self.saved_entries) if not self.link_is_fresh(entry)]
+    print('Resolving links of %d times' % len(entries))
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=max(1, self.resolve_workers)) as pool:
+      links = list(pool.map(self.resolve_entry, entries))
+    n_links = sum(link is not None for link in links)
+    logging.info('Resolved %d links, %d times have no usable link',
+                 n_links, len(links) - n_links)
+    print('Resolved %d links.' % n_links)
+    self.save()
+    return len(entries)
+
+  def add_download_hook(self, hook):
+    """Calls hook(event) as each entry is downloaded, fails or is skipped.
+
+    See events.EventFeed for the event fields and threading.
+    """
+
+    self.events.add_hook(hook)
+
+  def emit_event(self, event, time_entry, n_bytes=None, seconds=None,
+                 error=None):
+    """Emits a download event of an entry, see events.EventFeed."""
+
+    path = size = None
+    if event == events.DOWNLOADED:
+      path = self.video_paths.pop(time_entry.url, None)
+      if path is not None and os.path.exists(path):
+        size = os.path.getsize(path)
+    return self.events.emit(
+        event, url=time_entry.url, time_id=time_entry.time_id,
+        player=time_entry.player, stage=time_entry.stage,
+        mode=time_entry.mode, time=time_entry.time,
+        status=self.saved_entries[time_entry.url].status, path=path,
+        size=size, bytes=n_bytes, seconds=seconds, error=error)
+
+  def resolve_download(self, time_entry):
+    """resolve_entry() for a download run, emitting an event on no link."""
+
+    link = self.resolve_entry(time_entry)
+    if link is None:
+      entry = self.saved_entries[time_entry.url]
+      if entry.status == self.BAD_LINK:
+        self.emit_event(events.FAILED, time_entry, error=entry.link_error)
+      else:
+        self.emit_event(events.SKIPPED, time_entry,
+                        error='Time page could not be loaded')
+    return link
+
+  def download_entry(self, time_entry, yt_link):
+    """Downloads the video of an entry and records the resulting status.
+
+    Once self.budget is used up the entry is left pending for the next run.
+    """
+
+    if not self.budget.start():
+      self.emit_event(events.SKIPPED, time_entry,
+                      error='Run budget used up')
+      return
+    n_bytes = None
+    start = time.time()
+    try:
+      logging.info('Downloading video %s', yt_link)
+      n_bytes = self.download_yt_video(yt_link, time_entry)
+    except video_errors() as e:
+      logging.error(str(e))
+      logging.error('Error downloading the video %s', yt_link)
+      self.metrics.count('bad_videos', **time_entry.labels())
+      self.set_entry_status(time_entry.url, self.BAD_VIDEO)
+      self.emit_event(events.FAILED, time_entry,
+                      seconds=time.time() - start, error=str(e))
+    except IOError as e:
+      logging.error(repr(e))
+      self.emit_event(events.SKIPPED, time_entry,
+                      seconds=time.time() - start, error=repr(e))
+    else:
+      self.metrics.count('downloaded_videos', **time_entry.labels())
+      self.set_entry_status(time_entry.url, self.DOWNLOADED)
+      self.emit_event(events.DOWNLOADED, time_entry, n_bytes=n_bytes,
+                      seconds=time.time() - start)
+    finally:
+      self.budget.finish(n_bytes or 0, downloaded=n_bytes is not None)
 
   def download_videos(self):
-    """Saves all new videos and retries error videos if try_all is true."""
-
-    n_entries = sum(e.status != self.DOWNLOADED
-                    for e in self.saved_entries.values())
-    if not self.try_all:
-      n_entries = sum(e.status == self.NEW_URL
-                      for e in self.saved_entries.values())
-    n = 1
+    """Saves all new videos and retries error videos if try_all is true.
+
+    Links are resolved by self.resolve_workers threads which feed
+    self.download_workers download threads, see pipeline.DownloadPipeline.
+    Entries are tried in the order of self.scheduler until self.budget is
+    used up. With a work queue only the entries this process claims are
+    tried, and each is reported back by its event, see report_to_queue().
+    """
+
+    statuses = self.pending_statuses()
+    entries = self.scheduler.order(self.saved_entries.with_status(*statuses),
+                                   self.saved_entries)
+    n_entries = sum(self.saved_entries.count(status) for status in statuses)
     print('Checking / Downloading: %s Videos ' % n_entries)
-    for time_entry in self.saved_entries.values():
+
+    def print_progress(n, entry):
       bar_len = int(25*n/n_entries)
       bar = '+'*bar_len + ' '*(25 - bar_len)
       print('[ %s / %s ] |%s| ' % (n, n_entries, bar), end='\r')
-      if time_entry.status == self.DOWNLOADED:
-        continue
-      if time_entry.status != self.NEW_URL and not self.try_all:
-        continue
-      try:
-        yt_link = self.get_yt_link(time_entry)
-      except ValueError as e:
-        logging.error(e)
-        self.saved_entries[time_entry.url] = (time_entry._replace(
-            status=self.BAD_LINK))
-        continue
+
+    download_pipeline = pipeline.DownloadPipeline(
+        self.resolve_download, self.download_entry,
+        resolve_workers=self.resolve_workers,
+        download_workers=self.download_workers,
+        on_done=print_progress)
+    feed = self.budget.limit(entries)
+    if self.work_queue is None:
+      download_pipeline.run(feed)
+    else:
+      self.work_queue.start_heartbeat()
+      self.add_download_hook(self.report_to_queue)
       try:
-        logging.info('Downloading video %s', yt_link)
-        self.download_yt_video(yt_link, time_entry)
-      except (pytube.exceptions.PytubeError,
-              pytube.exceptions.DoesNotExist,
-              pytube.exceptions.AgeRestricted,
-              AttributeError) as e:
-        logging.error(str(e))
-        logging.error('Error downloading the video %s', yt_link)
-        self.saved_entries[time_entry.url] = (
-            time_entry._replace(status=self.BAD_VIDEO))
-        continue
-      except IOError as e:
-        logging.error(repr(e))
-        continue
-      else:
-        self.saved_entries[time_entry.url] = (
-            time_entry._replace(status=self.DOWNLOADED))
-        n += 1
-    print('[ %s / %s ] |%s| ' % (n, n_entries, '+'*25))
+        download_pipeline.run(self.work_queue.claimed(feed))
+      finally:
+        self.events.remove_hook(self.report_to_queue)
+        self.work_queue.stop_heartbeat()
+        self.work_queue.release()
+    reason = self.budget.used_up()
+    if reason:
+      print('')
+      print('Stopped, run budget used up: %s' % reason)
+      return
+    print('[ %s / %s ] |%s| ' % (n_entries, n_entries, '+'*25))
     print('Finished downloading all videos.')
@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""SQLite work queue sharing one backlog between several download processes.
+
+Every process loads the same record and offers its pending entries to
+claim(). An entry is only handed to the process holding its lease, which
+expires lease_seconds after it was claimed or last renewed, so the entries
+of a process which died go back to the pool on their own. Finished entries
+are reported with complete(), and their statuses are kept in the queue so
+every process can merge them into the record it saves.
+
+The queue also holds what the processes must agree on about the video
+tree: the root each player directory is placed on, and the file of every
+video downloaded by YouTube id, along with leases on the videos being
+downloaded so each is only fetched by one process.
+
+The database must be on a volume whose file locking SQLite supports, e.g. a
+local disk shared by several processes.
+"""
+
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+# Seconds a claimed entry stays leased without a heartbeat
+DEFAULT_LEASE_SECONDS = 300
+
+# Number of entries claimed in one transaction
+DEFAULT_CLAIM_BATCH = 10
+
+# Seconds to wait for another process to release the database lock
+_BUSY_TIMEOUT = 30
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS leases (
+    url TEXT PRIMARY KEY,
+    worker TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS leases_worker ON leases (worker);
+CREATE TABLE IF NOT EXISTS results (
+    url TEXT PRIMARY KEY,
+    status INTEGER NOT NULL,
+    worker TEXT NOT NULL,
+    finished_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS placements (
+    player_dir TEXT PRIMARY KEY,
+    root TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS videos (
+    video_id TEXT PRIMARY KEY,
+    path TEXT,
+    worker TEXT,
+    expires_at REAL
+);
+"""
+
+
+def default_worker_id():
+  """Returns an id unique to this process, across hosts."""
+
+  return '%s-%d' % (socket.gethostname(), os.getpid())
+
+
+class WorkQueue(object):
+  """Leases entries of a shared backlog to this process, see the module.
+
+  Entries with a result in the queue are never claimed again, start a new
+  queue file to retry them.
+  """
+
+  def __init__(self, path, worker_id=None,
+               lease_seconds=DEFAULT_LEASE_SECONDS,
+               claim_batch=DEFAULT_CLAIM_BATCH):
+    self.path = path
+    self.worker_id = worker_id or default_worker_id()
+    self.lease_seconds = lease_seconds
+    self.claim_batch = max(1, claim_batch)
+    self._lock = threading.Lock()
+    # Autocommit, transactions are begun explicitly.
+    self._conn = sqlite3.connect(path, timeout=_BUSY_TIMEOUT,
+                                 isolation_level=None,
+                                 check_same_thread=False)
+    self._conn.executescript(_SCHEMA)
+    self._heartbeat = None
+    self._stop_heartbeat = threading.Event()
+
+  def _transaction(self, fn):
+    with self._lock:
+      self._conn.execute('BEGIN IMMEDIATE')
+      try:
+        result = fn(self._conn, time.time())
+      except BaseException:
+        self._conn.execute('ROLLBACK')
+        raise
+      self._conn.execute('COMMIT')
+      return result
+
+  def claim(self, urls):
+    """Leases the urls no other process holds, returns the set leased.
+
+    Urls already finished, by any process, are skipped.
+    """
+
+    def claim_urls(conn, now):
+      claimed = set()
+      for url in urls:
+        if conn.execute('SELECT 1 FROM results WHERE url = ?',
+                        (url,)).fetchone():
+          continue
+        lease = conn.execute('SELECT worker, expires_at FROM leases '
+                             'WHERE url = ?', (url,)).fetchone()
+        if lease and lease[0] != self.worker_id and lease[1] > now:
+          continue
+        if lease and lease[0] != self.worker_id:
+          logging.info('Taking over the expired lease of %s from %s',
+                       url, lease[0])
+        conn.execute('INSERT OR REPLACE INTO leases (url, worker, expires_at)'
+                     ' VALUES (?, ?, ?)',
+                     (url, self.worker_id, now + self.lease_seconds))
+        claimed.add(url)
+      return claimed
+
+    return self._transaction(claim_urls)
+
+  def claimed(self, entries):
+    """Yields the entries this process leases, claiming claim_batch at once.
+
+    Entries are claimed as they are needed, so leases are not held on
+    entries a long way down the backlog.
+    """
+
+    batch = []
+    for entry in entries:
+      batch.append(entry)
+      if len(batch) >= self.claim_batch:
+        for claimed in self._claim_batch(batch):
+          yield claimed
+        batch = []
+    for claimed in self._claim_batch(batch):
+      yield claimed
+
+  def _claim_batch(self, batch):
+    if not batch:
+      return []
+    urls = self.claim([entry.url for entry in batch])
+    return [entry for entry in batch if entry.url in urls]
+
+  def complete(self, url, status):
+    """Records the final status of a leased url and drops its lease."""
+
+    def complete_url(conn, now):
+      conn.execute('INSERT OR REPLACE INTO results '
+                   '(url, status, worker, finished_at) VALUES (?, ?, ?, ?)',
+                   (url, status, self.worker_id, now))
+      conn.execute('DELETE FROM leases WHERE url = ? AND worker = ?',
+                   (url, self.worker_id))
+
+    self._transaction(complete_url)
+
+  def release(self, urls=None):
+    """Drops the leases of urls, every lease of this process if None."""
+
+    def release_urls(conn, _):
+      if urls is None:
+        conn.execute('DELETE FROM leases WHERE worker = ?', (self.worker_id,))
+        conn.execute('UPDATE videos SET worker = NULL, expires_at = NULL '
+                     'WHERE worker = ?', (self.worker_id,))
+      else:
+        conn.executemany('DELETE FROM leases WHERE url = ? AND worker = ?',
+                         [(url, self.worker_id) for url in urls])
+
+    self._transaction(release_urls)
+
+  def renew(self):
+    """Extends every lease of this process, returns how many it holds."""
+
+    def renew_leases(conn, now):
+      n_leases = 0
+      for table in ('leases', 'videos'):
+        n_leases += conn.execute(
+            'UPDATE %s SET expires_at = ? WHERE worker = ?' % table,
+            (now + self.lease_seconds, self.worker_id)).rowcount
+      return n_leases
+
+    return self._transaction(renew_leases)
+
+  def results(self):
+    """Returns url -> status of every finished url."""
+
+    with self._lock:
+      return dict(self._conn.execute('SELECT url, status FROM results'))
+
+  def place(self, player_dir, choose, roots):
+    """Returns the root of player_dir, placing it on choose() if new.
+
+    A placement on a root not in roots is replaced. The lookup and the
+    placement are one transaction, so every process places a player on the
+    same root.
+    """
+
+    def place_player(conn, _):
+      row = conn.execute('SELECT root FROM placements WHERE player_dir = ?',
+                         (player_dir,)).fetchone()
+      if row and row[0] in roots:
+        return row[0]
+      root = choose()
+      conn.execute('INSERT OR REPLACE INTO placements (player_dir, root) '
+                   'VALUES (?, ?)', (player_dir, root))
+      return root
+
+    return self._transaction(place_player)
+
+  def pin(self, placement, replace=True):
+    """Records player directory -> root placements.
+
+    Unless replace, players already placed keep their root.
+    """
+
+    def pin_players(conn, _):
+      conn.executemany('INSERT OR %s INTO placements (player_dir, root) '
+                       'VALUES (?, ?)' % ('REPLACE' if replace else 'IGNORE'),
+                       placement.items())
+
+    self._transaction(pin_players)
+
+  def placement(self):
+    """Returns player directory -> root of every placed player."""
+
+    with self._lock:
+      return dict(self._conn.execute('SELECT player_dir, root '
+                                     'FROM placements'))
+
+  def video_path(self, video_id):
+    """Returns the recorded path of a video, None if not downloaded."""
+
+    with self._lock:
+      row = self._conn.execute('SELECT path FROM videos WHERE video_id = ?',
+                               (video_id,)).fetchone()
+    return row[0] if row else None
+
+  def count_videos(self):
+    """Returns the number of videos with a recorded path."""
+
+    with self._lock:
+      return self._conn.execute('SELECT COUNT(*) FROM videos '
+                                'WHERE path IS NOT NULL').fetchone()[0]
+
+  def set_video_paths(self, paths, replace=True):
+    """Records video id -> path of downloaded videos.
+
+    Unless replace, videos which already have a path keep it.
+    """
+
+    rows = list(paths.items())
+
+    def set_paths(conn, _):
+      conn.executemany('INSERT OR IGNORE INTO videos (video_id) VALUES (?)',
+                       [(video_id,) for video_id, _ in rows])
+      conn.executemany('UPDATE videos SET path = ? WHERE video_id = ?'
+                       + ('' if replace else ' AND path IS NULL'),
+                       [(path, video_id) for video_id, path in rows])
+
+    self._transaction(set_paths)
+
+  def forget_video(self, video_id, path):
+    """Drops the path of a video, unless it was changed to another."""
+
+    self._transaction(lambda conn, _: conn.execute(
+        'UPDATE videos SET path = NULL WHERE video_id = ? AND path = ?',
+        (video_id, path)))
+
+  def lease_video(self, video_id):
+    """Leases a video to download, returns False if another process has it.
+
+    Video leases expire and are renewed like the leases of entries.
+    """
+
+    def lease(conn, now):
+      row = conn.execute('SELECT worker, expires_at FROM videos '
+                         'WHERE video_id = ?', (video_id,)).fetchone()
+      if row and row[0] not in (None, self.worker_id) and row[1] > now:
+        return False
+      conn.execute('INSERT OR IGNORE INTO videos (video_id) VALUES (?)',
+                   (video_id,))
+      conn.execute('UPDATE videos SET worker = ?, expires_at = ? '
+                   'WHERE video_id = ?',
+                   (self.worker_id, now + self.lease_seconds, video_id))
+      return True
+
+    return self._transaction(lease)
+
+  def release_video(self, video_id):
+    """Drops this process's lease of a video."""
+
+    self._transaction(lambda conn, _: conn.execute(
+        'UPDATE videos SET worker = NULL, expires_at = NULL '
+        'WHERE video_id = ? AND worker = ?', (video_id, self.worker_id)))
+
+  def start_heartbeat(self, interval=None):
+    """Renews this process's leases every interval seconds in a thread.
+
+    interval defaults to a third of lease_seconds.
+    """
+
+    interval = interval or self.lease_seconds / 3.0
+
+    def beat():
+      while not self._stop_heartbeat.wait(interval):
+        try:
+          self.renew()
+        except sqlite3.Error as e:
+          logging.error('Failed to renew the leases of %s: %r',
+                        self.worker_id, e)
+
+    self._stop_heartbeat.clear()
+    self._heartbeat = threading.Thread(target=beat, name='lease-heartbeat')
+    self._heartbeat.daemon = True
+    self._heartbeat.start()
+
+  def stop_heartbeat(self):
+    """Stops the heartbeat thread, if running."""
+
+    if self._heartbeat is not None:
+      self._stop_heartbeat.set()
+      self._heartbeat.join()
+      self._heartbeat = None
+
+  def close(self):
+    self.stop_heartbeat()
+    with self._lock:
+      self._conn.close()